@@ -0,0 +1,103 @@
+"""Generators for synthetic templates used by the benchmark suite."""
+import random
+from pathlib import Path
+from typing import List, Tuple
+
+from pydantic import BaseModel
+
+JINJA_LINE = "{{ project_name }} - {{ project_title }} ({{ current_year }})\n"
+PLAIN_LINE = "The quick brown fox jumps over the lazy dog.\n"
+
+
+class TemplateSpec(BaseModel):
+    """The shape of a synthetic template."""
+
+    file_count: int = 10
+    file_size: int = 1024
+    depth: int = 1
+    jinja_ratio: float = 0.5
+    binary_ratio: float = 0.0
+    exclude_count: int = 0
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return (
+            f"files={self.file_count},size={self.file_size},depth={self.depth},"
+            f"jinja={self.jinja_ratio},binary={self.binary_ratio},"
+            f"excludes={self.exclude_count}"
+        )
+
+
+def _fill(line: str, size: int) -> str:
+    """Repeat a line until it is at least size characters long."""
+    return line * max(1, size // len(line))
+
+
+def _directory_for(index: int, depth: int) -> Path:
+    """Spread files across a tree of directories, depth levels deep."""
+    parts = []
+    for level in range(depth - 1):
+        parts.append(f"dir_{level}_{index % (level + 2)}")
+    return Path(*parts)
+
+
+def _counts(spec: TemplateSpec) -> Tuple[int, int]:
+    """Return how many binary and Jinja files a template has. The rest are
+    plain files, numbered after them."""
+    binary_count = int(spec.file_count * spec.binary_ratio)
+    jinja_count = int((spec.file_count - binary_count) * spec.jinja_ratio)
+    return binary_count, jinja_count
+
+
+def _excludes(spec: TemplateSpec) -> List[str]:
+    # Each pattern matches at most one plain file so the exclusion count can be
+    # varied independently of how many files are excluded.
+    first_plain = sum(_counts(spec))
+    return [
+        f"**/plain_{i}.txt"
+        for i in range(first_plain, first_plain + spec.exclude_count)
+    ]
+
+
+def generate_template(spec: TemplateSpec, path: Path) -> Path:
+    """Generate a synthetic template in path according to spec."""
+    rng = random.Random(spec.seed)
+    path.mkdir(parents=True, exist_ok=True)
+
+    binary_count, jinja_count = _counts(spec)
+
+    jinja_contents = _fill(JINJA_LINE, spec.file_size)
+    plain_contents = _fill(PLAIN_LINE, spec.file_size)
+
+    for i in range(spec.file_count):
+        directory = path / _directory_for(i, spec.depth)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        if i < binary_count:
+            # Invalid UTF-8, so the file is skipped by the renderer
+            data = b"\xff\xfe" + rng.getrandbits(8 * spec.file_size).to_bytes(
+                spec.file_size,
+                "little",
+            )
+            (directory / f"binary_{i}.bin").write_bytes(data)
+        elif i < binary_count + jinja_count:
+            (directory / f"{{{{ project_name }}}}_{i}.txt").write_text(jinja_contents)
+        else:
+            (directory / f"plain_{i}.txt").write_text(plain_contents)
+
+    excludes = ", ".join(f'"{pattern}"' for pattern in _excludes(spec))
+    (path / ".itmpl.toml").write_text(
+        "[metadata]\n"
+        f'template_description = "Synthetic template ({spec.name})"\n'
+        f"templating_excludes = [{excludes}]\n"
+    )
+
+    return path
+
+
+def generate_catalogue(count: int, spec: TemplateSpec, path: Path) -> Path:
+    """Generate a directory of count synthetic templates."""
+    for i in range(count):
+        generate_template(spec, path / f"template-{i}")
+    return path
@@ -0,0 +1,396 @@
+"""Run the iTmpl benchmark suite.
+
+Usage:
+
+    python -m benchmarks.run --suite quick --output results.json
+    python -m benchmarks.run --compare results.json
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import typer
+from pydantic import BaseModel
+from rich import print
+from rich.markup import escape
+from rich.table import Table
+
+from benchmarks.generators import TemplateSpec, generate_catalogue, generate_template
+from itmpl import config, global_vars, metadata, template_index, templating, tree_utils
+
+RESULTS_VERSION = 1
+
+app = typer.Typer()
+
+
+class Suite(str, Enum):
+    QUICK = "quick"
+    FULL = "full"
+
+
+class BenchmarkResult(BaseModel):
+    """Timings for one benchmark on one synthetic template."""
+
+    benchmark: str
+    case: str
+    spec: Dict[str, Any]
+    times: List[float]
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.benchmark, self.case
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+
+class BenchmarkResults(BaseModel):
+    """A full run of the benchmark suite."""
+
+    version: int = RESULTS_VERSION
+    python: str = platform.python_version()
+    platform: str = platform.platform()
+    results: List[BenchmarkResult] = []
+
+
+def _specs(suite: Suite) -> Iterator[TemplateSpec]:
+    """Vary one axis at a time from a small base template."""
+    full = suite == Suite.FULL
+    base = TemplateSpec(file_count=100)
+
+    for file_count in [10, 100, 1000] + ([10_000, 100_000] if full else []):
+        yield base.copy(update={"file_count": file_count})
+    for file_size in [64 * 1024] + ([1024 * 1024] if full else []):
+        yield base.copy(update={"file_size": file_size})
+    for depth in [5] + ([20] if full else []):
+        yield base.copy(update={"depth": depth})
+    for jinja_ratio in [0.0, 1.0]:
+        yield base.copy(update={"jinja_ratio": jinja_ratio})
+    for binary_ratio in [0.5]:
+        yield base.copy(update={"binary_ratio": binary_ratio})
+    for exclude_count in [10, 100] + ([1000] if full else []):
+        yield base.copy(update={"exclude_count": exclude_count})
+
+
+def _catalogue_sizes(suite: Suite) -> List[int]:
+    return [10, 100] + ([1000] if suite == Suite.FULL else [])
+
+
+def _time(
+    run: Callable[[], Any],
+    setup: Callable[[], Any],
+    repeat: int,
+) -> List[float]:
+    """Time run, calling setup (untimed) before each repetition."""
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _variables() -> Dict[str, Any]:
+    return templating.get_default_variables("bench")
+
+
+def _benchmark_template(
+    spec: TemplateSpec,
+    workdir: Path,
+    repeat: int,
+) -> Iterator[BenchmarkResult]:
+    template_path = generate_template(spec, workdir / "template")
+    excludes = metadata.read_itmpl_toml(
+        template_path / ".itmpl.toml"
+    ).metadata.templating_excludes
+    scratch = workdir / "scratch"
+
+    def reset_scratch():
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    def fresh_copy():
+        reset_scratch()
+        tree_utils.copy_tree(template_path, scratch)
+
+    def populated_destination():
+        if not (workdir / "duplicates").exists():
+            tree_utils.copy_tree(template_path, workdir / "duplicates")
+
+    benchmarks: Dict[str, Tuple[Callable[[], Any], Callable[[], Any]]] = {
+        "copy_tree": (
+            lambda: tree_utils.copy_tree(template_path, scratch),
+            reset_scratch,
+        ),
+        "find_duplicates": (
+            lambda: list(
+                tree_utils.find_duplicates(template_path, workdir / "duplicates")
+            ),
+            populated_destination,
+        ),
+        "template_directory": (
+            lambda: templating.template_directory(
+                scratch,
+                _variables(),
+                ignore_undefined=True,
+                exclude=excludes,
+            ),
+            fresh_copy,
+        ),
+        "render_template": (
+            lambda: templating.render_template(
+                project_name="bench",
+                template="template",
+                destination=scratch,
+                template_path=template_path,
+                exclude=excludes,
+                prompt_if_duplicates=False,
+            ),
+            reset_scratch,
+        ),
+    }
+
+    for name, (run, setup) in benchmarks.items():
+        yield BenchmarkResult(
+            benchmark=name,
+            case=spec.name,
+            spec=spec.dict(),
+            times=_time(run, setup, repeat),
+        )
+
+
+def _benchmark_catalogue(
+    count: int,
+    workdir: Path,
+    repeat: int,
+) -> List[BenchmarkResult]:
+    spec = TemplateSpec(file_count=1)
+    catalogue = generate_catalogue(count, spec, workdir / "catalogue")
+    extra_templates_dir = workdir / "extra"
+    extra_templates_dir.mkdir()
+
+    config_path = workdir / "config.json"
+    config_path.write_text(
+        config.Config(extra_templates_dir=extra_templates_dir).json(),
+    )
+
+    original_config_path = config.CONFIG_PATH
+    original_templates_dir = global_vars.TEMPLATES_DIR
+    original_index_dir = template_index.INDEX_DIR
+    config.CONFIG_PATH = config_path
+    global_vars.TEMPLATES_DIR = catalogue
+    template_index.INDEX_DIR = workdir / "index"
+    benchmarks = {
+        "get_template_options": templating.get_template_options,
+        "search_templates": lambda: templating.search_templates("template"),
+    }
+    try:
+        times = {
+            name: _time(benchmark, lambda: None, repeat)
+            for name, benchmark in benchmarks.items()
+        }
+    finally:
+        config.CONFIG_PATH = original_config_path
+        global_vars.TEMPLATES_DIR = original_templates_dir
+        template_index.INDEX_DIR = original_index_dir
+
+    return [
+        BenchmarkResult(
+            benchmark=name,
+            case=f"templates={count}",
+            spec={"template_count": count, **spec.dict()},
+            times=benchmark_times,
+        )
+        for name, benchmark_times in times.items()
+    ]
+
+
+def _benchmark_cli(workdir: Path, repeat: int) -> List[BenchmarkResult]:
+    """Time `itmpl new` run as a command, forwarded to a running daemon and
+    rendered in its own process."""
+    if not sys.platform.startswith("linux"):
+        # The app directory is only moved by XDG_CONFIG_HOME on Linux
+        return []
+
+    spec = TemplateSpec(file_count=10)
+    extra_templates_dir = workdir / "extra"
+    generate_template(spec, extra_templates_dir / "bench-template")
+    environment = {**os.environ, "XDG_CONFIG_HOME": str(workdir / "config")}
+    app_dir = workdir / "config" / "itmpl"
+    app_dir.mkdir(parents=True)
+    (app_dir / "config.json").write_text(
+        config.Config(extra_templates_dir=extra_templates_dir).json(),
+    )
+    socket_path = workdir / "itmpl.sock"
+    destination = workdir / "projects"
+    destination.mkdir()
+    command = [sys.executable, "-c", "from itmpl.client import main; main()"]
+
+    def reset_destination():
+        shutil.rmtree(destination / "bench", ignore_errors=True)
+
+    def new(*args: str):
+        subprocess.run(
+            [*command, "new", "bench-template", "bench", "--path", str(destination)]
+            + ["--socket", str(socket_path), *args],
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    server = subprocess.Popen(
+        [*command, "serve", "--socket", str(socket_path)],
+        env=environment,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not socket_path.exists():
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("The daemon didn't start")
+            time.sleep(0.05)
+
+        times = {
+            "cli_new_daemon": _time(new, reset_destination, repeat),
+            "cli_new_local": _time(
+                lambda: new("--no-daemon"), reset_destination, repeat
+            ),
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+    return [
+        BenchmarkResult(
+            benchmark=name,
+            case=spec.name,
+            spec=spec.dict(),
+            times=benchmark_times,
+        )
+        for name, benchmark_times in times.items()
+    ]
+
+
+def run_suite(suite: Suite, repeat: int) -> BenchmarkResults:
+    results = BenchmarkResults()
+
+    for count in _catalogue_sizes(suite):
+        with tempfile.TemporaryDirectory() as tempdir:
+            catalogue_results = _benchmark_catalogue(count, Path(tempdir), repeat)
+        for result in catalogue_results:
+            print(escape(f"{result.benchmark} [{result.case}]: {result.median:.4f}s"))
+            results.results.append(result)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        cli_results = _benchmark_cli(Path(tempdir), repeat)
+    for result in cli_results:
+        print(escape(f"{result.benchmark} [{result.case}]: {result.median:.4f}s"))
+        results.results.append(result)
+
+    for spec in _specs(suite):
+        with tempfile.TemporaryDirectory() as tempdir:
+            for result in _benchmark_template(spec, Path(tempdir), repeat):
+                print(
+                    escape(f"{result.benchmark} [{result.case}]: {result.median:.4f}s")
+                )
+                results.results.append(result)
+
+    return results
+
+
+def compare_results(
+    baseline: BenchmarkResults,
+    current: BenchmarkResults,
+    threshold: float,
+) -> Tuple[Table, List[BenchmarkResult]]:
+    """Compare median timings against a baseline. A benchmark has regressed if
+    its median is more than threshold (as a fraction) slower than the
+    baseline."""
+    baseline_results = {result.key: result for result in baseline.results}
+    regressions = []
+
+    table = Table(show_header=True, header_style="bold")
+    table.add_column("Benchmark", header_style="blue", no_wrap=True)
+    table.add_column("Case")
+    table.add_column("Baseline (s)", justify="right")
+    table.add_column("Current (s)", justify="right")
+    table.add_column("Change", justify="right")
+
+    for result in current.results:
+        previous = baseline_results.get(result.key)
+        if previous is None:
+            continue
+
+        change = (result.median - previous.median) / previous.median
+        regressed = change > threshold
+        if regressed:
+            regressions.append(result)
+
+        colour = "red" if regressed else "green" if change < -threshold else "white"
+        table.add_row(
+            result.benchmark,
+            result.case,
+            f"{previous.median:.4f}",
+            f"{result.median:.4f}",
+            f"[{colour}]{change:+.1%}[/{colour}]",
+        )
+
+    return table, regressions
+
+
+@app.command()
+def main(
+    suite: Suite = typer.Option(Suite.QUICK, help="Which set of cases to run."),
+    repeat: int = typer.Option(3, min=1, help="Repetitions of each benchmark."),
+    output: Optional[Path] = typer.Option(
+        None,
+        dir_okay=False,
+        help="Write the results to this JSON file.",
+    ),
+    compare: Optional[Path] = typer.Option(
+        None,
+        exists=True,
+        dir_okay=False,
+        help="Compare the results against a previous JSON results file.",
+    ),
+    threshold: float = typer.Option(
+        0.2,
+        help="Fractional slowdown against the baseline counted as a regression.",
+    ),
+):
+    """Benchmark iTmpl against synthetic templates."""
+    results = run_suite(suite, repeat)
+
+    if output is not None:
+        output.write_text(results.json(indent=4), encoding="utf-8")
+        print(f"Wrote results to [green]{output}[/green]")
+
+    if compare is not None:
+        baseline = BenchmarkResults.parse_obj(json.loads(compare.read_text()))
+        if baseline.version != RESULTS_VERSION:
+            print(
+                f"[red]Cannot compare results format version {baseline.version} "
+                f"with version {RESULTS_VERSION}.[/red]"
+            )
+            raise typer.Exit(1)
+
+        table, regressions = compare_results(baseline, results, threshold)
+        print(table)
+
+        if regressions:
+            print(f"[red]{len(regressions)} benchmark(s) regressed.[/red]")
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
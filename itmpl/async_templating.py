@@ -0,0 +1,419 @@
+"""Asynchronous versions of the templating functions, for embedding iTmpl in an
+asyncio application.
+
+File I/O and rendering run in a bounded thread pool, so they never block the
+event loop. Hooks in `.itmpl.py` may be defined with `async def`, in which case
+they are awaited on the loop; plain hooks are run in the thread pool.
+
+Example usage:
+
+```python
+async with RenderPool(max_renders=4) as pool:
+    await asyncio.gather(
+        *(
+            pool.render_template(name, "poetry-project", root / name, template_path)
+            for name in names
+        )
+    )
+```
+"""
+import asyncio
+import functools
+import inspect
+import shutil
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from itmpl import events, global_vars, profiling, templating
+from itmpl.blobstore import LinkMode
+from itmpl.budgets import BudgetError, Budgets, run_limited, strictest
+from itmpl.durability import Durability, OutputWriter
+from itmpl.templating import TemplatingException
+
+T = TypeVar("T")
+
+
+async def _run_in_executor(
+    executor: Optional[Executor],
+    function: Callable[..., T],
+    *args: Any,
+) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+async def _run_hook_async(
+    executor: Optional[Executor],
+    hook: Callable[..., Any],
+    *args: Any,
+) -> Any:
+    """Await an async hook on the loop, or run a plain hook in the executor."""
+    if inspect.iscoroutinefunction(hook):
+        return await hook(*args)
+
+    result = await _run_in_executor(executor, hook, *args)
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+async def _run_hook_limited(
+    executor: Optional[Executor],
+    hook: Callable[..., Any],
+    args: Tuple[Any, ...],
+    budgets: Budgets,
+) -> Any:
+    """Run a hook within the hook budgets. An async hook with only a time
+    limit is cancelled on the loop when it runs out of time. Otherwise a
+    limited hook is run by run_limited in the executor, which kills a hook
+    that runs out of time, so it doesn't keep holding a worker."""
+    if budgets.hook_memory_mb is None and inspect.iscoroutinefunction(hook):
+        if budgets.hook_timeout is None:
+            return await hook(*args)
+        try:
+            return await asyncio.wait_for(hook(*args), budgets.hook_timeout)
+        except asyncio.TimeoutError as e:
+            raise BudgetError(f"timed out after {budgets.hook_timeout:g}s") from e
+
+    if budgets.hook_memory_mb is None and budgets.hook_timeout is None:
+        return await _run_hook_async(executor, hook, *args)
+    # In a forked child, an async hook is run in a new event loop
+    return await _run_in_executor(
+        executor, run_limited, templating.run_hook, (hook, *args), budgets
+    )
+
+
+async def get_python_variables_async(
+    temp_directory: Path,
+    project_name: str,
+    destination: Path,
+    variables: Dict[str, Any],
+    executor: Optional[Executor] = None,
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
+) -> Dict[str, str]:
+    """Get extra variables from the .itmpl.py file in the template directory,
+    within the hook budgets."""
+    hook = await _run_in_executor(
+        executor,
+        templating.get_hook,
+        temp_directory,
+        "get_variables",
+    )
+
+    if hook is None:
+        return {}
+
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with templating.hook_errors("get_variables"), profiler.hook("get_variables"):
+        return await _run_hook_limited(
+            executor,
+            hook,
+            (project_name, destination, variables),
+            budgets or Budgets(),
+        )
+
+
+async def run_post_script_async(
+    project_name: str,
+    final_directory: Path,
+    variables: Dict[str, str],
+    executor: Optional[Executor] = None,
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
+) -> Dict[str, str]:
+    """Run the post script in the .itmpl.py file in the template directory,
+    within the hook budgets."""
+    hook = await _run_in_executor(
+        executor,
+        templating.get_hook,
+        final_directory,
+        "post_script",
+    )
+
+    if hook is None:
+        return {}
+
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with templating.hook_errors("post_script"), profiler.hook("post_script"):
+        return await _run_hook_limited(
+            executor,
+            hook,
+            (project_name, final_directory, variables),
+            budgets or Budgets(),
+        )
+
+
+async def template_directory_async(
+    dir_path: Path,
+    variables: Dict[str, Any],
+    ignore_undefined: bool = False,
+    exclude: Optional[List[str]] = None,
+    executor: Optional[Executor] = None,
+    writer: Optional[OutputWriter] = None,
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
+) -> int:
+    """Template the contents of a directory using Jinja. Both file contents and
+    filenames are templated. Files are templated concurrently in the
+    executor, and written with the writer if one is given. If budgets are
+    given, a file that takes too long to render or renders too much output
+    raises a TemplatingException. If a profiler is given, each file is
+    recorded in it. Returns the number of files written."""
+    profiler = profiler or profiling.Profiler(enabled=False)
+    files_to_template, directories_to_rename = await _run_in_executor(
+        executor,
+        templating.find_paths_to_template,
+        dir_path,
+        exclude,
+    )
+
+    written = await asyncio.gather(
+        *(
+            _run_in_executor(
+                executor,
+                templating.template_directory_file,
+                dir_path,
+                file_path,
+                variables,
+                ignore_undefined,
+                profiler,
+                writer,
+                budgets,
+            )
+            for file_path in files_to_template
+        )
+    )
+
+    await _run_in_executor(
+        executor,
+        templating.rename_directories,
+        directories_to_rename,
+        variables,
+        writer,
+    )
+    return sum(written)
+
+
+async def render_template_async(
+    project_name: str,
+    template: str,
+    destination: Path,
+    template_path: Path,
+    exclude: Optional[List[str]] = None,
+    fail_if_duplicates: bool = False,
+    executor: Optional[Executor] = None,
+    durability: Durability = Durability.NONE,
+    links: LinkMode = LinkMode.NONE,
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
+) -> None:
+    """Render a template into the destination directory without blocking the
+    event loop. There is no prompt for files that already exist in the
+    destination: they are overwritten, unless fail_if_duplicates is True, in
+    which case a TemplatingException is raised before anything is written.
+    Files in the destination are written according to the durability mode,
+    and linked from the blob store according to the link mode. The budgets
+    are combined with those of the template, as in render_template.
+
+    If a profiler is given, each phase of the render is recorded in it, and
+    events for the render are sent to its observers, as in render_template.
+    A profiler shouldn't be shared by renders that run at the same time."""
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with templating.profile_render(profiler, template, destination):
+        await _render_template_async(
+            project_name,
+            template,
+            destination,
+            template_path,
+            exclude,
+            fail_if_duplicates,
+            executor,
+            durability,
+            links,
+            budgets,
+            profiler,
+        )
+
+
+async def _render_template_async(
+    project_name: str,
+    template: str,
+    destination: Path,
+    template_path: Path,
+    exclude: Optional[List[str]],
+    fail_if_duplicates: bool,
+    executor: Optional[Executor],
+    durability: Durability,
+    links: LinkMode,
+    budgets: Optional[Budgets],
+    profiler: profiling.Profiler,
+) -> None:
+    profiler.report.durability = durability
+    blobs, writer, temp_writer = templating.output_writers(durability, links)
+    default_variables = {
+        **templating.get_default_variables(project_name=project_name),
+        **global_vars.VARIABLES,
+    }
+
+    tempdir = await _run_in_executor(executor, tempfile.mkdtemp)
+    try:
+        temp_project_dir = Path(tempdir) / template
+        toml = await _run_in_executor(
+            executor,
+            templating.copy_to_temp,
+            template_path,
+            temp_project_dir,
+            profiler,
+        )
+        limits = strictest(toml.metadata.budgets, budgets or Budgets())
+
+        with profiler.phase("get_variables"):
+            toml_variables = toml.variables
+            python_variables = await get_python_variables_async(
+                temp_directory=temp_project_dir,
+                project_name=project_name,
+                destination=destination,
+                variables={**default_variables, **toml_variables},
+                executor=executor,
+                budgets=limits,
+                profiler=profiler,
+            )
+
+        variables = {**default_variables, **toml_variables, **python_variables}
+        with profiler.phase("render"):
+            await template_directory_async(
+                temp_project_dir,
+                variables,
+                exclude=exclude,
+                ignore_undefined=True,
+                executor=executor,
+                writer=temp_writer,
+                budgets=limits,
+                profiler=profiler,
+            )
+
+        if fail_if_duplicates:
+            duplicates = await _run_in_executor(
+                executor,
+                templating.find_duplicate_files,
+                temp_project_dir,
+                destination,
+                profiler,
+            )
+            if duplicates:
+                raise TemplatingException(
+                    "The following files already exist: "
+                    + ", ".join(str(d) for d in duplicates)
+                )
+
+        await _run_in_executor(
+            executor,
+            templating.copy_to_destination,
+            temp_project_dir,
+            destination,
+            profiler,
+            writer,
+            temp_writer,
+        )
+
+        # As templating.finish_render, with the hook awaited and the second
+        # render run concurrently
+        with profiler.phase("post_script"):
+            new_variables = await run_post_script_async(
+                project_name=project_name,
+                final_directory=destination,
+                variables=variables.copy(),
+                executor=executor,
+                budgets=limits,
+                profiler=profiler,
+            )
+        if new_variables:
+            with templating.second_render(profiler):
+                await template_directory_async(
+                    destination,
+                    new_variables,
+                    exclude=exclude,
+                    ignore_undefined=False,
+                    executor=executor,
+                    writer=writer,
+                    budgets=limits,
+                    profiler=profiler,
+                )
+        await _run_in_executor(
+            executor, templating.clean_up, destination, profiler, writer
+        )
+
+        if blobs:
+            await _run_in_executor(executor, blobs.record, destination, writer.shared)
+    finally:
+        await _run_in_executor(executor, shutil.rmtree, tempdir, True)
+
+
+class RenderPool:
+    """Run many renders on one event loop, limiting how many run at once and
+    sharing a bounded thread pool for their file I/O. Events for every render
+    are sent to the observers, from the loop and the pool's threads."""
+
+    def __init__(
+        self,
+        max_renders: int = 4,
+        max_workers: int = 8,
+        observers: Sequence[events.RenderObserver] = (),
+    ) -> None:
+        self.max_renders = max_renders
+        self.observers = list(observers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="itmpl",
+        )
+        # Created on first use, as on Python < 3.10 a semaphore is bound to the
+        # event loop that is current when it is created
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def render_template(
+        self,
+        project_name: str,
+        template: str,
+        destination: Path,
+        template_path: Path,
+        exclude: Optional[List[str]] = None,
+        fail_if_duplicates: bool = False,
+        durability: Durability = Durability.NONE,
+        links: LinkMode = LinkMode.NONE,
+        budgets: Optional[Budgets] = None,
+        profiler: Optional[profiling.Profiler] = None,
+    ) -> None:
+        """Render a template once a slot is free. See render_template_async.
+        Unless a profiler is given, each render gets its own, sending events
+        to the pool's observers."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_renders)
+
+        async with self._semaphore:
+            await render_template_async(
+                project_name=project_name,
+                template=template,
+                destination=destination,
+                template_path=template_path,
+                exclude=exclude,
+                fail_if_duplicates=fail_if_duplicates,
+                executor=self.executor,
+                durability=durability,
+                links=links,
+                budgets=budgets,
+                profiler=profiler
+                or profiling.Profiler(enabled=False, observers=self.observers),
+            )
+
+    def close(self) -> None:
+        """Shut down the thread pool, waiting for running work to finish."""
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self) -> "RenderPool":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,262 @@
+"""A content-addressed store of files shared between rendered projects.
+
+When the `blob_links` config option (or `itmpl new --links`) is set, files
+that rendering leaves unchanged, such as licences, `.gitignore` files and
+images, are stored once under `BLOB_DIR` by the SHA-256 of their contents, and
+linked into each project rather than copied:
+
+- `reflink` clones the stored file. The clone shares disk blocks with the
+  store until either is written to, when the filesystem copies them, so it is
+  always safe to edit. Where reflinks aren't supported (filesystems other than
+  Btrfs, XFS, APFS and the like, or a store on another filesystem), files are
+  copied instead.
+- `hardlink` links the stored file itself into the project, which is faster
+  and works on any filesystem, but means every project shares the one file.
+  Stored files are read-only, so editors and tools replace them rather than
+  writing to them, and iTmpl breaks the link before writing to one itself. A
+  process that ignores permissions (e.g. running as root) and writes to a
+  linked file in place changes it in every project. Falls back to copying
+  across filesystems.
+
+Each render records which stored files it linked into which project under
+`refs/`. `itmpl cache gc` removes stored files that no longer exist in any
+recorded project, and aren't hard linked anywhere else.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import enum
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional, Set, Tuple
+
+from itmpl import global_vars
+
+BLOB_DIR: Path = global_vars.APP_DIR / "blobs"
+
+# Suffix of the stored copy of an executable file, as hard links share modes
+EXECUTABLE_SUFFIX = ".x"
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class LinkMode(str, enum.Enum):
+    """How files are materialised from the blob store."""
+
+    # Don't use the blob store
+    NONE = "none"
+    REFLINK = "reflink"
+    HARDLINK = "hardlink"
+
+
+def _load_clonefile() -> Optional[Callable[[bytes, bytes, int], int]]:
+    if sys.platform != "darwin":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.clonefile
+    except (OSError, AttributeError):
+        return None
+
+
+_clonefile = _load_clonefile()
+
+
+def _reflink(source: Path, destination: Path) -> bool:
+    """Clone a file, if the platform and filesystem support it. Returns
+    whether the clone was made."""
+    if _clonefile is not None:
+        return _clonefile(os.fsencode(source), os.fsencode(destination), 0) == 0
+
+    try:
+        import fcntl
+    except ImportError:
+        # Windows
+        return False
+
+    with source.open("rb") as src, destination.open("wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def file_digest(path: Path) -> str:
+    """The SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class GcResult(NamedTuple):
+    blobs_removed: int
+    bytes_freed: int
+    refs_removed: int
+
+
+class BlobStore:
+    """Files stored by content, and the projects they were linked into."""
+
+    def __init__(self, links: LinkMode, root: Optional[Path] = None) -> None:
+        self.links = links
+        self.root = root or BLOB_DIR
+        self.objects = self.root / "objects"
+        self.refs = self.root / "refs"
+
+    @staticmethod
+    def blob_name(digest: str, executable: bool) -> str:
+        return digest + (EXECUTABLE_SUFFIX if executable else "")
+
+    def path(self, name: str) -> Path:
+        return self.objects / name[:2] / name
+
+    def _store(self, name: str, write: Callable[[Path], None]) -> None:
+        path = self.path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique to the thread, as renders may store the same file at once
+        temp_path = path.with_name(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            write(temp_path)
+            os.chmod(temp_path, 0o555 if name.endswith(EXECUTABLE_SUFFIX) else 0o444)
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                temp_path.unlink()
+            raise
+
+    def add_file(self, source: Path) -> str:
+        """Store a file, unless it is already stored. Returns its name in the
+        store."""
+        executable = os.access(source, os.X_OK)
+        name = self.blob_name(file_digest(source), executable)
+        if not self.path(name).exists():
+            self._store(name, lambda p: shutil.copyfile(source, p))
+        return name
+
+    def add_bytes(self, data: bytes, executable: bool, digest: str) -> str:
+        """Store the contents of a file, whose SHA-256 is digest, unless it is
+        already stored. Returns its name in the store."""
+        name = self.blob_name(digest, executable)
+        if not self.path(name).exists():
+            self._store(name, lambda p: p.write_bytes(data))
+        return name
+
+    def materialize(self, name: str, destination: Path) -> None:
+        """Create a file from the store at destination, which must not
+        exist."""
+        blob = self.path(name)
+        if self.links == LinkMode.HARDLINK:
+            try:
+                os.link(blob, destination)
+                return
+            except OSError as e:
+                # Another filesystem, or one without hard links
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        elif self.links == LinkMode.REFLINK and _reflink(blob, destination):
+            self.make_writable(name, destination)
+            return
+
+        shutil.copyfile(blob, destination)
+        self.make_writable(name, destination)
+
+    @staticmethod
+    def make_writable(name: str, path: Path) -> None:
+        """Give a file materialised from the store the mode of a normal file:
+        writable by its owner, and executable where it is readable if the
+        stored file is executable."""
+        mode = stat.S_IMODE(path.stat().st_mode) | stat.S_IWUSR
+        if name.endswith(EXECUTABLE_SUFFIX):
+            mode |= (mode & 0o444) >> 2
+        os.chmod(path, mode)
+
+    def _ref_path(self, destination: Path) -> Path:
+        key = hashlib.sha256(str(destination.resolve()).encode()).hexdigest()
+        return self.refs / f"{key}.json"
+
+    def record(self, destination: Path, linked: Dict[Path, str]) -> None:
+        """Record the files linked into a project, by their path in the
+        project."""
+        if not linked:
+            return
+        ref_path = self._ref_path(destination)
+        files: Dict[str, str] = {}
+        with contextlib.suppress(FileNotFoundError, ValueError):
+            files = json.loads(ref_path.read_text(encoding="utf-8"))["files"]
+        for path, name in linked.items():
+            if not path.is_file():
+                # Removed after it was linked, such as a hook file
+                continue
+            files[path.relative_to(destination).as_posix()] = name
+
+        ref_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = ref_path.with_name(
+            f".{ref_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        temp_path.write_text(
+            json.dumps({"destination": str(destination.resolve()), "files": files}),
+            encoding="utf-8",
+        )
+        os.replace(temp_path, ref_path)
+
+    def _live_blobs(self, dry_run: bool) -> Tuple[Set[str], int]:
+        live: Set[str] = set()
+        refs_removed = 0
+        if not self.refs.is_dir():
+            return live, refs_removed
+
+        for ref_path in self.refs.glob("*.json"):
+            try:
+                ref = json.loads(ref_path.read_text(encoding="utf-8"))
+                destination = Path(ref["destination"])
+                files = ref["files"]
+            except (OSError, ValueError, KeyError):
+                files = {}
+            # Files deleted from the project no longer hold a reference
+            remaining = {
+                relative: name
+                for relative, name in files.items()
+                if (destination / relative).is_file()
+            }
+            live.update(remaining.values())
+            if remaining:
+                continue
+            refs_removed += 1
+            if not dry_run:
+                ref_path.unlink()
+        return live, refs_removed
+
+    def gc(self, dry_run: bool = False) -> GcResult:
+        """Remove stored files that aren't in any recorded project, or hard
+        linked anywhere else, and records of projects that no longer have any
+        stored files."""
+        live, refs_removed = self._live_blobs(dry_run)
+        blobs_removed = bytes_freed = 0
+        if not self.objects.is_dir():
+            return GcResult(blobs_removed, bytes_freed, refs_removed)
+
+        for blob in self.objects.glob("*/*"):
+            if blob.name.startswith("."):
+                # Being stored
+                continue
+            blob_stat = blob.stat()
+            if blob.name in live or blob_stat.st_nlink > 1:
+                continue
+            blobs_removed += 1
+            bytes_freed += blob_stat.st_size
+            if not dry_run:
+                blob.unlink()
+        return GcResult(blobs_removed, bytes_freed, refs_removed)
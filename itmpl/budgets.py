@@ -0,0 +1,198 @@
+"""Limits on the time and memory a render can use.
+
+Budgets can be set in the `[metadata.budgets]` table of a template's
+`.itmpl.toml`, and on the command line. When both are set, the stricter limit
+applies.
+
+- `hook_timeout` limits how long, in seconds, `get_variables` and
+  `post_script` in `.itmpl.py` can run.
+- `hook_memory_mb` limits the address space of a hook, with `RLIMIT_AS`, so
+  this is only supported on platforms with the `resource` module.
+- `render_timeout` limits how long, in seconds, rendering a single file can
+  take.
+- `max_output_kb` limits the size of a single rendered file.
+
+A hook with a time or memory limit is run in a forked child process, in its
+own process group, so hook limits are only supported on platforms with
+`fork`. A hook that runs out of time is killed along with any commands it
+started, so nothing keeps writing to the project after the render fails. A
+hook run this way has no standard input, so it can't prompt, and must return
+something that can be pickled. Render timeouts are checked each time
+Jinja produces output, and also enforced with `SIGALRM` when rendering on the
+main thread of a Unix process, which stops loops that produce no output.
+"""
+import contextlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from pydantic import BaseModel
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None  # type: ignore
+
+
+class BudgetError(Exception):
+    """Exception raised when a budget is exceeded, or can't be enforced."""
+
+
+class Budgets(BaseModel):
+    """Resource limits for a render. None means unlimited."""
+
+    hook_timeout: Optional[float] = None
+    hook_memory_mb: Optional[int] = None
+    render_timeout: Optional[float] = None
+    max_output_kb: Optional[int] = None
+
+
+def _minimum(*values: Optional[float]) -> Optional[float]:
+    limits = [v for v in values if v is not None]
+    return min(limits) if limits else None
+
+
+def strictest(*budgets: Budgets) -> Budgets:
+    """Combine budgets, taking the smallest limit for each resource."""
+    return Budgets(
+        **{
+            field: _minimum(*(getattr(b, field) for b in budgets))
+            for field in Budgets.__fields__
+        }
+    )
+
+
+def _kill_process_group(process: Any) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # Every process in the group has exited
+        pass
+
+
+def _run_in_child(
+    function: Callable[..., Any],
+    args: Iterable[Any],
+    timeout: Optional[float],
+    memory_mb: Optional[int],
+):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        raise BudgetError("limits for hooks are not supported on this platform")
+    if memory_mb is not None and resource is None:
+        raise BudgetError("memory limits for hooks are not supported on this platform")
+
+    context = multiprocessing.get_context("fork")
+    receiver, sender = context.Pipe(duplex=False)
+
+    def target() -> None:
+        # So the commands the hook starts can be killed with it
+        os.setpgid(0, 0)
+        if memory_mb is not None:
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        try:
+            sender.send((True, function(*args)))
+        except MemoryError:
+            sender.send((False, BudgetError(f"exceeded {memory_mb} MiB of memory")))
+        except BaseException as e:
+            try:
+                sender.send((False, e))
+            except Exception:
+                # The exception can't be pickled
+                sender.send((False, RuntimeError(repr(e))))
+
+    process = context.Process(target=target, name="itmpl-hook", daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise BudgetError(f"timed out after {timeout:g}s")
+        try:
+            ok, value = receiver.recv()
+        except EOFError:
+            process.join()
+            message = f"exited with code {process.exitcode}"
+            if memory_mb is not None:
+                message += f", possibly after exceeding {memory_mb} MiB of memory"
+            raise BudgetError(message)
+    except BaseException:
+        # Including being interrupted, as the hook is no longer in the
+        # terminal's foreground process group
+        _kill_process_group(process)
+        raise
+    finally:
+        process.join()
+        receiver.close()
+
+    if not ok:
+        raise value
+    return value
+
+
+def run_limited(
+    function: Callable[..., Any],
+    args: Iterable[Any],
+    budgets: Budgets,
+) -> Any:
+    """Call a function within the hook time and memory budgets. Raises a
+    BudgetError if a budget is exceeded."""
+    if budgets.hook_memory_mb is None and budgets.hook_timeout is None:
+        return function(*args)
+    return _run_in_child(function, args, budgets.hook_timeout, budgets.hook_memory_mb)
+
+
+@contextlib.contextmanager
+def _alarm(seconds: Optional[float]) -> Iterator[None]:
+    """Raise a BudgetError if the block takes longer than seconds. Only
+    possible on the main thread, on platforms with SIGALRM."""
+    if (
+        seconds is None
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def handler(signum: int, frame: Any) -> None:
+        raise BudgetError(f"timed out after {seconds:g}s")
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def render_limited(chunks: Callable[[], Iterable[str]], budgets: Budgets) -> str:
+    """Join the chunks of a streamed render, within the render timeout and
+    output size budgets. Raises a BudgetError if a budget is exceeded."""
+    if budgets.render_timeout is None and budgets.max_output_kb is None:
+        return "".join(chunks())
+
+    max_size = None
+    if budgets.max_output_kb is not None:
+        max_size = budgets.max_output_kb * 1024
+    deadline = None
+    if budgets.render_timeout is not None:
+        deadline = time.monotonic() + budgets.render_timeout
+
+    output = []
+    size = 0
+    with _alarm(budgets.render_timeout):
+        for chunk in chunks():
+            output.append(chunk)
+            if max_size is not None:
+                size += len(chunk.encode("utf-8", "surrogatepass"))
+                if size > max_size:
+                    raise BudgetError(
+                        f"produced more than {budgets.max_output_kb} KiB of output"
+                    )
+            if deadline is not None and time.monotonic() > deadline:
+                raise BudgetError(f"timed out after {budgets.render_timeout:g}s")
+    return "".join(output)
@@ -0,0 +1,208 @@
+"""Ahead-of-time checks of templates.
+
+`itmpl check` compiles every file, file name and directory name that a render
+would template, and reports Jinja syntax errors and variables that nothing
+defines. A variable is defined if it is a default variable, in the
+`[variables]` table of `.itmpl.toml`, or a key of a dict literal returned by
+`get_variables` or `post_script` in `.itmpl.py`. Hooks are never run, so when
+a hook returns anything else the variables it defines can't be known, and
+undefined variables are reported as warnings rather than errors.
+
+The compiled templates are stored, so the next `itmpl new` loads them rather
+than compiling them again.
+"""
+import ast
+import io
+import tempfile
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import jinja2
+import jinja2.meta
+from rich.table import Table
+
+from itmpl import global_vars, templating
+
+HOOKS = ("get_variables", "post_script")
+
+
+class CheckProblem(NamedTuple):
+    # Relative to the template directory
+    path: str
+    message: str
+    line: Optional[int] = None
+    # False for warnings
+    error: bool = True
+
+
+def _returns(function: ast.AST) -> Iterator[ast.Return]:
+    """Find the return statements of a function, but not of functions nested
+    in it."""
+    stack = list(ast.iter_child_nodes(function))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Return):
+            yield node
+        elif not isinstance(
+            node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+        ):
+            stack.extend(ast.iter_child_nodes(node))
+
+
+def _literal_keys(node: Optional[ast.expr]) -> Optional[Set[str]]:
+    """The keys of a returned dict, or None if they can't be known."""
+    if node is None or (isinstance(node, ast.Constant) and node.value is None):
+        return set()
+    if isinstance(node, ast.Dict):
+        keys = set()
+        for key in node.keys:
+            # A None key is ** unpacking
+            if not (isinstance(key, ast.Constant) and isinstance(key.value, str)):
+                return None
+            keys.add(key.value)
+        return keys
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id == "dict"
+        and not node.args
+        and all(keyword.arg is not None for keyword in node.keywords)
+    ):
+        return {keyword.arg for keyword in node.keywords if keyword.arg}
+    return None
+
+
+def hook_variables(source: str) -> Tuple[Set[str], bool]:
+    """Find the variables the hooks in an .itmpl.py file define, without
+    running it. Returns the names found, and whether they are all of them.
+    Raises a SyntaxError if the source is invalid."""
+    names: Set[str] = set()
+    complete = True
+    for node in ast.parse(source).body:
+        if (
+            not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            or node.name not in HOOKS
+        ):
+            continue
+        for statement in _returns(node):
+            keys = _literal_keys(statement.value)
+            if keys is None:
+                complete = False
+            else:
+                names.update(keys)
+    return names, complete
+
+
+def _check_source(
+    relative: str,
+    source: str,
+    kind: str,
+    known: Set[str],
+    complete: bool,
+) -> List[CheckProblem]:
+    """Compile and store a template, and check it only uses known
+    variables."""
+    try:
+        parsed = templating.store_compiled_template(source)
+    except jinja2.TemplateSyntaxError as e:
+        return [CheckProblem(relative, f"{kind}: {e.message}", e.lineno)]
+
+    undefined = jinja2.meta.find_undeclared_variables(parsed) - known
+    lines = {}
+    for node in parsed.find_all(jinja2.nodes.Name):
+        if node.name in undefined:
+            lines.setdefault(node.name, node.lineno)
+    return [
+        CheckProblem(
+            relative,
+            f"{kind} uses undefined variable {name}",
+            lines.get(name),
+            error=complete,
+        )
+        for name in sorted(undefined)
+    ]
+
+
+def check_template(template_path: Path) -> List[CheckProblem]:
+    """Compile every file, file name and directory name of a template that a
+    render would template, storing the compiled templates. Returns the
+    problems found. Raises a TemplatingException if the template can't be
+    read."""
+    layers, toml = templating.resolve_template(template_path)
+    problems: List[CheckProblem] = []
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        # Check exactly what a render would see, after overlaying the
+        # templates it extends and leaving out ignored files
+        directory = Path(tempdir) / template_path.name
+        templating.copy_template(
+            layers,
+            directory,
+            symlinks=toml.metadata.symlinks,
+            copy_excludes=toml.metadata.copy_excludes,
+        )
+        directory = directory.resolve()
+
+        hook_names: Set[str] = set()
+        complete = True
+        hook_file = directory / ".itmpl.py"
+        if hook_file.is_file():
+            try:
+                hook_names, complete = hook_variables(
+                    hook_file.read_text(encoding="utf-8")
+                )
+            except SyntaxError as e:
+                problems.append(
+                    CheckProblem(".itmpl.py", f"Invalid Python: {e.msg}", e.lineno)
+                )
+                complete = False
+
+        known = {
+            *templating.get_default_variables(project_name=""),
+            *global_vars.VARIABLES,
+            *toml.variables,
+            *hook_names,
+            *templating.jinja_environment(jinja2.Undefined).globals,
+        }
+
+        files, directories = templating.find_paths_to_template(
+            directory, toml.metadata.templating_excludes
+        )
+        for path in directories:
+            relative = path.relative_to(directory).as_posix()
+            problems.extend(_check_source(relative, path.name, "Name", known, complete))
+
+        for path in files:
+            relative = path.relative_to(directory).as_posix()
+            problems.extend(_check_source(relative, path.name, "Name", known, complete))
+            if path.is_symlink():
+                # Only the names of symlinks are templated
+                continue
+            try:
+                # Decoded the same way as when rendering
+                source = io.TextIOWrapper(io.BytesIO(path.read_bytes())).read()
+            except UnicodeDecodeError:
+                continue
+            problems.extend(
+                _check_source(relative, source, "Contents", known, complete)
+            )
+
+    return sorted(problems, key=lambda p: (p.path, p.line or 0, p.message))
+
+
+def construct_table_from_problems(problems: List[CheckProblem]) -> Table:
+    """Construct a Rich table of the problems found in a template."""
+    table = Table(show_header=True, header_style="bold")
+    table.add_column("File", justify="left", header_style="blue")
+    table.add_column("Line", justify="right")
+    table.add_column("Problem", justify="left")
+
+    for problem in problems:
+        colour = "red" if problem.error else "yellow"
+        table.add_row(
+            problem.path,
+            str(problem.line) if problem.line is not None else "",
+            f"[{colour}]{problem.message}[/{colour}]",
+        )
+
+    return table
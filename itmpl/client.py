@@ -0,0 +1,198 @@
+"""The `itmpl` command, and a thin client for the `itmpl serve` daemon.
+
+`itmpl new` is forwarded to a running daemon using only the standard library,
+so a render through the daemon doesn't pay for importing Typer, Jinja,
+pydantic and the rest of iTmpl. Every other command, and anything the daemon
+can't render, falls back to the full CLI in `itmpl.main`.
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, NoReturn, Optional
+
+PACK_SUFFIX = ".itmplpack"
+
+# The values of durability.Durability and blobstore.LinkMode
+DURABILITY_MODES = ("none", "atomic", "durable")
+LINK_MODES = ("none", "reflink", "hardlink")
+
+
+def app_dir() -> Path:
+    """The iTmpl app directory, in the same place as `typer.get_app_dir`
+    puts it."""
+    if sys.platform.startswith("win"):
+        return Path(os.environ.get("APPDATA") or os.path.expanduser("~"), "itmpl")
+    if sys.platform == "darwin":
+        return Path(os.path.expanduser("~/Library/Application Support"), "itmpl")
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config")
+    return Path(config_home, "itmpl")
+
+
+DEFAULT_SOCKET_PATH: Path = app_dir() / "itmpl.sock"
+
+
+class DaemonError(Exception):
+    """Exception raised when the daemon cannot be reached."""
+
+
+def send_request(
+    socket_path: Path,
+    request: Dict[str, Any],
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Send a request to the daemon and wait for its response."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise DaemonError("The iTmpl daemon requires Unix domain sockets")
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(str(socket_path))
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except OSError as e:
+        raise DaemonError(f"Could not reach daemon at {socket_path}: {e}") from e
+
+    if not line:
+        raise DaemonError(f"No response from daemon at {socket_path}")
+    return json.loads(line)
+
+
+def is_running(socket_path: Path = DEFAULT_SOCKET_PATH) -> bool:
+    """Check whether a daemon is listening on the socket."""
+    if not socket_path.exists():
+        return False
+
+    try:
+        return bool(send_request(socket_path, {"command": "ping"}, timeout=1).get("ok"))
+    except DaemonError:
+        return False
+
+
+class _ArgumentError(Exception):
+    pass
+
+
+class _ArgumentParser(argparse.ArgumentParser):
+    def error(self, message: str) -> NoReturn:
+        # Leave reporting bad arguments to the full CLI
+        raise _ArgumentError(message)
+
+
+def _new_parser() -> argparse.ArgumentParser:
+    """A parser for the options of `itmpl new`, matching `itmpl.main.new`."""
+    parser = _ArgumentParser(prog="itmpl new", add_help=False, allow_abbrev=False)
+    parser.add_argument("template")
+    parser.add_argument("name")
+    parser.add_argument("--path", "-p", type=Path, default=Path("."))
+    parser.add_argument("--force", "-f", action="store_true")
+    parser.add_argument("--only", action="append")
+    parser.add_argument("--durability", type=str.lower, choices=DURABILITY_MODES)
+    parser.add_argument("--links", type=str.lower, choices=LINK_MODES)
+    parser.add_argument("--hook-timeout", type=float)
+    parser.add_argument("--hook-memory", type=int)
+    parser.add_argument("--render-timeout", type=float)
+    parser.add_argument("--max-output", type=int)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile-json", type=Path)
+    parser.add_argument("--socket", type=Path, default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--no-daemon", action="store_true")
+    return parser
+
+
+def _below(value: Optional[float], minimum: float) -> bool:
+    return value is not None and value < minimum
+
+
+def forward_new(args: List[str]) -> Optional[int]:
+    """Render `itmpl new` with a running daemon.
+
+    Parameters
+    ----------
+    args : List[str]
+        The arguments given after `itmpl new`.
+
+    Returns
+    -------
+    Optional[int]
+        The exit code, or None if the project should be rendered by the full
+        CLI instead.
+    """
+    try:
+        options = _new_parser().parse_args(args)
+    except _ArgumentError:
+        return None
+
+    if (
+        options.no_daemon
+        or options.profile
+        or options.profile_json is not None
+        or options.template.endswith(PACK_SUFFIX)
+        or not options.path.exists()
+        or _below(options.hook_timeout, 0)
+        or _below(options.hook_memory, 1)
+        or _below(options.render_timeout, 0)
+        or _below(options.max_output, 1)
+        or not options.socket.exists()
+    ):
+        return None
+
+    # Allow the user to template in this directory
+    path = options.path.resolve()
+    if path.name == options.name:
+        path = path.parent
+    destination = path / options.name
+
+    try:
+        response = send_request(
+            options.socket,
+            {
+                "command": "render",
+                "template": options.template,
+                "name": options.name,
+                "destination": str(destination),
+                "force": options.force,
+                "only": options.only,
+                # The daemon fills in the config defaults
+                "durability": options.durability,
+                "links": options.links,
+                "budgets": {
+                    "hook_timeout": options.hook_timeout,
+                    "hook_memory_mb": options.hook_memory,
+                    "render_timeout": options.render_timeout,
+                    "max_output_kb": options.max_output,
+                },
+                "environment": dict(os.environ),
+                "cwd": os.getcwd(),
+            },
+        )
+    except DaemonError as e:
+        print(f"{e}. Rendering without the daemon.", file=sys.stderr)
+        return None
+
+    if response.get("ok"):
+        print(f"Created {options.template} project at {destination}")
+        return 0
+    if not response.get("interactive"):
+        print(f"Error when templating project: {response.get('error')}")
+        return 1
+    print("Template needs input. Rendering without the daemon.", file=sys.stderr)
+    return None
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """Run the `itmpl` command, forwarding `itmpl new` to a running daemon and
+    loading the full CLI only when needed."""
+    args = sys.argv[1:] if args is None else list(args)
+    if args[:1] == ["new"]:
+        exit_code = forward_new(args[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from itmpl.main import app
+
+    app(args=args, prog_name="itmpl")
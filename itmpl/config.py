@@ -1,12 +1,16 @@
 import enum
+import os
 from pathlib import Path
+from typing import List, Optional
 
 import typer
 from pydantic import BaseModel
-from pydantic.fields import ModelField
+from pydantic.fields import SHAPE_LIST, ModelField
 from rich import print
 from typer import Typer
 
+from itmpl.blobstore import LinkMode
+from itmpl.durability import Durability
 from itmpl.global_vars import APP_DIR
 
 app = Typer()
@@ -19,6 +23,26 @@ class Config(BaseModel):
     """Configuration for iTmpl."""
 
     extra_templates_dir: Path = APP_DIR / "templates"
+    # Extra template directories, highest precedence first
+    template_dirs: List[Path] = []
+    # Git repositories of templates ("<url>" or "<url>#<ref>"), highest
+    # precedence first, after template_dirs
+    template_repos: List[str] = []
+    # Seconds before a template repository is fetched again
+    git_refresh_interval: int = 3600
+    wheelhouse_dir: Optional[Path] = None
+    golden_virtualenvs: bool = True
+    # Hard link files from golden virtualenvs where reflinks aren't supported,
+    # rather than copying them. Faster, but writing to a file in a project's
+    # virtualenv in place changes the golden virtualenv for every project
+    golden_virtualenv_hardlinks: bool = False
+    # How carefully rendered files are written: none, atomic or durable
+    durability: Durability = Durability.NONE
+    # Directory to write Prometheus textfile and JSON lines render metrics to
+    metrics_dir: Optional[Path] = None
+    # How files left unchanged by rendering are shared through the blob
+    # store: none, reflink or hardlink
+    blob_links: LinkMode = LinkMode.NONE
 
 
 ConfigOption = enum.Enum("ConfigOption", {k: k for k in Config.__fields__})
@@ -51,11 +75,15 @@ def set_(
     option: ConfigOption,  # type: ignore
     value: str,
 ):
-    """Set a configuration option."""
+    """Set a configuration option. Lists of directories are separated by the
+    platform's path separator (: or ;), and other lists by commas."""
     config = read_config()
 
     # Some custom validation using Pydantic's ModelField validation
     model_field: ModelField = config.__fields__[option.value]
+    if model_field.shape == SHAPE_LIST:
+        separator = os.pathsep if model_field.type_ == Path else ","
+        value = [v.strip() for v in value.split(separator) if v.strip()]  # type: ignore
     other_attrs = {k: v for k, v in config.__dict__.items() if k != option.value}
     new, error = model_field.validate(value, other_attrs, loc=option.value, cls=Config)
 
@@ -65,11 +93,13 @@ def set_(
             param_hint=option.value,
         )
 
-    if new and model_field.type_ == Path and not (new.exists() and new.is_dir()):
-        raise typer.BadParameter(
-            f"{value} is not a valid directory",
-            param_hint=option.value,
-        )
+    if new and model_field.type_ == Path:
+        for path in new if model_field.shape == SHAPE_LIST else [new]:
+            if not (path.exists() and path.is_dir()):
+                raise typer.BadParameter(
+                    f"{path} is not a valid directory",
+                    param_hint=option.value,
+                )
 
     config.__setattr__(option.value, new)
     write_config(config)
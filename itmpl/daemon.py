@@ -0,0 +1,245 @@
+"""A long-running iTmpl process that renders templates on request.
+
+The daemon listens on a Unix socket and keeps iTmpl and the template index
+loaded between requests. Requests and responses are single lines of JSON.
+
+Each request is rendered in a forked child process, with the environment
+variables and working directory of the client that sent it, so requests are
+rendered concurrently. Where processes can't be forked, requests are rendered
+in threads, one at a time.
+
+The `itmpl` command forwards `itmpl new` to the daemon using `itmpl.client`,
+without importing the rest of iTmpl.
+"""
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import click
+from pydantic import BaseModel
+from rich import print
+
+from itmpl import config, events, profiling, templating
+from itmpl.blobstore import LinkMode
+from itmpl.budgets import Budgets
+from itmpl.client import DEFAULT_SOCKET_PATH, DaemonError, is_running, send_request
+from itmpl.durability import Durability
+from itmpl.metadata import ItmplToml
+
+if hasattr(os, "fork"):
+    _ConcurrencyMixIn: type = socketserver.ForkingMixIn
+else:
+    _ConcurrencyMixIn = socketserver.ThreadingMixIn
+
+
+class RenderRequest(BaseModel):
+    """A request to render a template."""
+
+    template: str
+    name: str
+    destination: Path
+    force: bool = False
+    only: Optional[List[str]] = None
+    # The durability and blob_links config options are used if not given
+    durability: Optional[Durability] = None
+    budgets: Budgets = Budgets()
+    links: Optional[LinkMode] = None
+    # The client's environment variables and working directory, for the hooks
+    # to run with. The daemon's own are used if they aren't given.
+    environment: Optional[Dict[str, str]] = None
+    cwd: Optional[Path] = None
+
+
+class RenderResponse(BaseModel):
+    """The result of a render request."""
+
+    ok: bool
+    destination: Optional[Path] = None
+    error: Optional[str] = None
+    # The template needs input from the user, so can't be rendered by the daemon
+    interactive: bool = False
+
+
+class TemplateIndex:
+    """The available templates, re-read only when a template directory or any
+    template's .itmpl.toml has changed."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._snapshot: Optional[List[Tuple[str, float]]] = None
+        self._templates: Dict[str, Tuple[Path, ItmplToml]] = {}
+
+    @staticmethod
+    def _take_snapshot() -> List[Tuple[str, float]]:
+        snapshot = []
+        for directory in templating.get_template_roots():
+            if not directory.is_dir():
+                continue
+            snapshot.append((str(directory), directory.stat().st_mtime))
+            for toml_path in directory.glob("*/.itmpl.toml"):
+                snapshot.append((str(toml_path), toml_path.stat().st_mtime))
+        return snapshot
+
+    def get(self) -> Dict[str, Tuple[Path, ItmplToml]]:
+        with self._lock:
+            snapshot = self._take_snapshot()
+            if snapshot != self._snapshot:
+                self._templates = templating.get_template_options()
+                self._snapshot = snapshot
+            return self._templates
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: "ItmplDaemon"
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get("command")
+            if command == "ping":
+                response: Dict[str, Any] = {"ok": True}
+            elif command == "render":
+                render_request = RenderRequest.parse_obj(request)
+                response = json.loads(self.server.render(render_request).json())
+            else:
+                response = {"ok": False, "error": f"Unknown command: {command}"}
+        except Exception as e:
+            response = {"ok": False, "error": f"Invalid request: {e}"}
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class ItmplDaemon(_ConcurrencyMixIn, socketserver.UnixStreamServer):  # type: ignore
+    """Serve render requests over a Unix socket, one child process per request,
+    or one thread per request where processes can't be forked."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: Path,
+        observers: Sequence[events.RenderObserver] = (),
+    ) -> None:
+        self.socket_path = socket_path
+        self.observers = list(observers)
+        self.index = TemplateIndex()
+        self._environment_lock = threading.Lock()
+        templating.enable_hook_cache()
+        super().__init__(str(socket_path), _RequestHandler)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        # Refresh the index before forking, so children inherit it rather than
+        # each re-reading it
+        try:
+            self.index.get()
+        except templating.DuplicateTemplateError:
+            pass  # Reported by the render
+        super().process_request(request, client_address)
+
+    @contextlib.contextmanager
+    def _client_environment(self, request: RenderRequest) -> Iterator[None]:
+        """Switch to the client's environment variables and working directory
+        while rendering. Threads share them, so when rendering in threads only
+        one request is rendered at a time."""
+        with self._environment_lock:
+            environment = dict(os.environ)
+            cwd = os.getcwd()
+            try:
+                if request.environment is not None:
+                    os.environ.clear()
+                    os.environ.update(request.environment)
+                if request.cwd is not None:
+                    os.chdir(request.cwd)
+                yield
+            finally:
+                os.chdir(cwd)
+                os.environ.clear()
+                os.environ.update(environment)
+
+    def render(self, request: RenderRequest) -> RenderResponse:
+        try:
+            template_options = self.index.get()
+        except templating.DuplicateTemplateError as e:
+            return RenderResponse(
+                ok=False,
+                error="Duplicate templates found: " + ", ".join(e.duplicate_templates),
+            )
+
+        if request.template not in template_options:
+            return RenderResponse(
+                ok=False,
+                error=f"Template {request.template} not found",
+            )
+
+        template_path, template_metadata = template_options[request.template]
+        settings = config.read_config()
+        try:
+            with self._client_environment(request):
+                templating.render_template(
+                    project_name=request.name,
+                    template=request.template,
+                    destination=request.destination,
+                    template_path=template_path,
+                    exclude=template_metadata.metadata.templating_excludes,
+                    prompt_if_duplicates=not request.force,
+                    only=request.only,
+                    durability=request.durability or settings.durability,
+                    budgets=request.budgets,
+                    links=request.links or settings.blob_links,
+                    profiler=profiling.Profiler(
+                        enabled=False,
+                        observers=self.observers,
+                    ),
+                )
+        except templating.TemplatingException as e:
+            return RenderResponse(
+                ok=False,
+                error=str(e),
+                interactive=isinstance(e.__cause__, click.exceptions.Abort),
+            )
+        except click.exceptions.Abort:
+            # A prompt, e.g. to overwrite existing files, with no one to answer
+            return RenderResponse(ok=False, error="Input required", interactive=True)
+
+        return RenderResponse(ok=True, destination=request.destination)
+
+
+def serve(socket_path: Path = DEFAULT_SOCKET_PATH) -> None:
+    """Run the daemon until interrupted."""
+    if not hasattr(socket, "AF_UNIX"):
+        raise DaemonError("The iTmpl daemon requires Unix domain sockets")
+
+    if socket_path.exists():
+        if is_running(socket_path):
+            raise DaemonError(f"A daemon is already listening on {socket_path}")
+        # Left behind by a daemon that didn't shut down cleanly
+        socket_path.unlink()
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    server = ItmplDaemon(socket_path, observers=events.configured_observers())
+    # Nobody can answer prompts, so make them fail rather than block
+    with open(os.devnull) as devnull:
+        stdin, sys.stdin = sys.stdin, devnull
+        try:
+            print(f"Listening on [green]{socket_path}[/green]")
+            server.serve_forever()
+        finally:
+            sys.stdin = stdin
+            server.server_close()
+            socket_path.unlink(missing_ok=True)
+
+
+def render(socket_path: Path, request: RenderRequest) -> RenderResponse:
+    """Ask the daemon to render a template."""
+    return RenderResponse.parse_obj(
+        send_request(
+            socket_path,
+            {"command": "render", **json.loads(request.json())},
+        ),
+    )
@@ -0,0 +1,226 @@
+"""How carefully rendered projects are written to disk.
+
+- `none` writes files in place, and leaves flushing them to the OS. A crash
+  can leave files half-written. This is the fastest, and fine for throwaway
+  scaffolds.
+- `atomic` writes each file to a temporary file next to it and renames it
+  into place, so every file is either the old version or the new one.
+- `durable` writes atomically, and flushes everything written to disk once
+  the render has finished. On Linux, this is a single `syncfs` per
+  filesystem; elsewhere each file is fsynced, followed by each directory
+  written to, so the renames are recorded too. Syncing once at the end, rather
+  than after every file, keeps this fast on slow disks and network mounts.
+
+Files linked from the blob store are created the same way, with the link in
+place of the written file.
+"""
+import ctypes
+import ctypes.util
+import enum
+import os
+import shutil
+import stat
+import sys
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+from itmpl.blobstore import BlobStore
+
+
+class Durability(str, enum.Enum):
+    """How carefully output files are written."""
+
+    NONE = "none"
+    ATOMIC = "atomic"
+    DURABLE = "durable"
+
+
+def _load_syncfs() -> Optional[Callable[[int], int]]:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+_syncfs = _load_syncfs()
+
+
+def _fsync_path(path: Path, directory: bool = False) -> None:
+    flags = os.O_RDONLY | (getattr(os, "O_DIRECTORY", 0) if directory else 0)
+    fd = os.open(path, flags)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class OutputWriter:
+    """Write and copy output files according to a durability mode, keeping
+    track of what has been written so it can be synced in one batch.
+
+    If a blob store is given, shared files are linked from it, and the files
+    linked are kept in shared, by path. If track is set, the files written are
+    kept in files whatever the durability mode.
+    """
+
+    def __init__(
+        self,
+        durability: Durability = Durability.NONE,
+        blobs: Optional[BlobStore] = None,
+        track: bool = False,
+    ) -> None:
+        self.durability = durability
+        self.blobs = blobs
+        self.track = track or durability == Durability.DURABLE
+        self.files: Set[Path] = set()
+        self.directories: Set[Path] = set()
+        self.shared: Dict[Path, str] = {}
+        # Files may be written from several threads by the async renderer
+        self._lock = threading.Lock()
+
+    def _written(self, path: Path) -> None:
+        if self.track:
+            with self._lock:
+                self.files.add(path)
+                self.directories.add(path.parent)
+
+    def _write_atomically(
+        self,
+        path: Path,
+        write: Callable[[Path], None],
+        keep_mode: bool = True,
+    ) -> None:
+        temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            write(temp_path)
+            if keep_mode and path.exists() and not path.is_symlink():
+                shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+    def _break_link(self, path: Path) -> Optional[int]:
+        """Remove a file that is about to be written if it is hard linked
+        elsewhere, such as from the blob store, so the other links keep their
+        contents. Returns the mode to give the new file, if it was removed."""
+        if self.shared:
+            with self._lock:
+                self.shared.pop(path, None)
+        try:
+            path_stat = os.lstat(path)
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(path_stat.st_mode) or path_stat.st_nlink == 1:
+            return None
+        path.unlink()
+        # Files linked from the store are read-only
+        return stat.S_IMODE(path_stat.st_mode) | stat.S_IWUSR
+
+    def write_bytes(self, path: Path, data: bytes) -> None:
+        """Write the contents of a file."""
+        mode = self._break_link(path)
+        if self.durability == Durability.NONE:
+            path.write_bytes(data)
+        else:
+            self._write_atomically(path, lambda p: p.write_bytes(data))
+        if mode is not None:
+            os.chmod(path, mode)
+        self._written(path)
+
+    def copy_file(self, source: Path, destination: Path, shared: bool = False) -> None:
+        """Copy a file with its metadata, like shutil.copy2. Shared files are
+        linked from the blob store instead, if there is one."""
+        if shared and self.blobs is not None:
+            self.link_blob(self.blobs.add_file(source), destination)
+            return
+
+        self._break_link(destination)
+        if self.durability == Durability.NONE:
+            shutil.copy2(source, destination)
+        else:
+            self._write_atomically(destination, lambda p: shutil.copy2(source, p))
+        self._written(destination)
+
+    def link_blob(self, name: str, destination: Path) -> None:
+        """Link a file from the blob store into place, replacing any existing
+        file."""
+        blobs = self.blobs
+        if blobs is None:
+            raise ValueError("There is no blob store to link files from")
+        if self.durability == Durability.NONE:
+            if destination.is_symlink() or destination.exists():
+                destination.unlink()
+            blobs.materialize(name, destination)
+        else:
+            # The existing file's mode would be copied to the stored file
+            self._write_atomically(
+                destination, lambda p: blobs.materialize(name, p), keep_mode=False
+            )
+        with self._lock:
+            self.shared[destination] = name
+        self._written(destination)
+
+    def rename(self, source: Path, destination: Path) -> None:
+        """Rename a file or directory, keeping track of anything written or
+        linked under it."""
+        source.rename(destination)
+
+        def moved(path: Path) -> Path:
+            if path == source or source in path.parents:
+                return destination / path.relative_to(source)
+            return path
+
+        with self._lock:
+            if self.shared:
+                self.shared = {moved(path): name for path, name in self.shared.items()}
+            if not self.track:
+                return
+            self.files = {moved(path) for path in self.files}
+            self.directories = {moved(path) for path in self.directories}
+            self.directories.update([source.parent, destination.parent])
+
+    def sync(self, *roots: Path) -> int:
+        """Flush everything written to disk, if the durability mode is
+        durable. The roots are directories that were written to without going
+        through the writer, such as by deleting files. Returns the number of
+        sync calls made."""
+        if self.durability != Durability.DURABLE:
+            return 0
+
+        with self._lock:
+            files, self.files = self.files, set()
+            directories, self.directories = self.directories, set()
+        directories = {d for d in directories.union(roots) if d.is_dir()}
+
+        if _syncfs is not None:
+            # One directory on each filesystem written to is enough
+            filesystems: Dict[int, Path] = {}
+            for directory in directories:
+                filesystems.setdefault(directory.stat().st_dev, directory)
+            for directory in filesystems.values():
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    if _syncfs(fd) != 0:
+                        error = ctypes.get_errno()
+                        raise OSError(error, os.strerror(error), str(directory))
+                finally:
+                    os.close(fd)
+            return len(filesystems)
+
+        for file in files:
+            try:
+                _fsync_path(file)
+            except FileNotFoundError:
+                # Removed since it was written
+                continue
+        if os.name != "nt":
+            # Windows can't open directories to fsync them
+            for directory in directories:
+                _fsync_path(directory, directory=True)
+        return len(files) + len(directories)
@@ -0,0 +1,352 @@
+"""Events emitted while rendering, for monitoring iTmpl when it is embedded in
+another application.
+
+Pass observers to a `profiling.Profiler`, and pass the profiler to
+`templating.render_template`:
+
+```python
+class Logger(events.RenderObserver):
+    def on_event(self, event: events.RenderEvent) -> None:
+        print(event.json())
+
+profiler = profiling.Profiler(enabled=False, observers=[Logger()])
+templating.render_template(..., profiler=profiler)
+```
+
+`async_templating.render_template_async` takes a profiler the same way, and
+`async_templating.RenderPool` takes observers, giving each render its own
+profiler.
+
+`MetricsExporter` is a built-in observer that appends every event to a JSON
+lines file, and keeps a Prometheus textfile (for node_exporter's textfile
+collector) of counters up to date. Set the `metrics_dir` config option to
+enable it for `itmpl new` and `itmpl serve`. Every process adds to the same
+textfile, so the counters cover every render, not just the last process's.
+"""
+import contextlib
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import DefaultDict, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import BaseModel, Field
+
+from itmpl import config
+
+TEXTFILE_NAME = "itmpl.prom"
+JSONL_NAME = "itmpl-events.jsonl"
+
+
+class RenderEvent(BaseModel):
+    """Something that happened during a render."""
+
+    event: str
+    timestamp: float = Field(default_factory=time.time)
+    # The template being rendered
+    template: Optional[str] = None
+
+
+class RenderStarted(RenderEvent):
+    event: str = "render_started"
+    destination: Path
+
+
+class RenderFinished(RenderEvent):
+    event: str = "render_finished"
+    destination: Path
+    ok: bool = True
+    error: Optional[str] = None
+    duration: float = 0.0
+    files_rendered: int = 0
+    files_skipped: int = 0
+    files_copied: int = 0
+    bytes_written: int = 0
+    compile_cache_hits: int = 0
+
+
+class PhaseFinished(RenderEvent):
+    event: str = "phase_finished"
+    phase: str
+    duration: float
+
+
+class FileRendered(RenderEvent):
+    """A file was templated and written."""
+
+    event: str = "file_rendered"
+    path: Path
+    duration: float
+    bytes_read: int
+    bytes_written: int
+
+
+class FileSkipped(RenderEvent):
+    """A file was templated, but left alone, as its contents didn't change or
+    it isn't text."""
+
+    event: str = "file_skipped"
+    path: Path
+    duration: float
+
+
+class FileCopied(RenderEvent):
+    """A file was copied into the destination."""
+
+    event: str = "file_copied"
+    path: Path
+    size: int
+
+
+class HookStarted(RenderEvent):
+    event: str = "hook_started"
+    hook: str
+
+
+class HookFinished(RenderEvent):
+    event: str = "hook_finished"
+    hook: str
+    duration: float
+    ok: bool = True
+
+
+class RenderObserver:
+    """Receives the events of renders. Subclasses override on_event.
+
+    Events are delivered synchronously, from the thread doing the render, so
+    observers should be quick, and thread-safe if renders run concurrently.
+    """
+
+    def on_event(self, event: RenderEvent) -> None:
+        pass
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{k}="{_escape_label(v)}"' for k, v in sorted(labels.items()))
+    return f"{{{pairs}}}"
+
+
+# A sample in the Prometheus text format
+_SAMPLE = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)$"
+)
+_LABEL = re.compile(r'(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)="(?P<value>(?:[^"\\]|\\.)*)"')
+_UNESCAPE = {"\\\\": "\\", '\\"': '"', "\\n": "\n"}
+
+Counters = DefaultDict[str, Dict[Tuple[Tuple[str, str], ...], float]]
+
+
+def _counters() -> Counters:
+    return defaultdict(lambda: defaultdict(float))
+
+
+def _unescape_label(value: str) -> str:
+    return re.sub(r"\\.", lambda m: _UNESCAPE.get(m.group(), m.group()), value)
+
+
+def _parse_textfile(text: str) -> Counters:
+    """Read the samples of a Prometheus textfile, skipping any line that
+    can't be parsed."""
+    counters = _counters()
+    for line in text.splitlines():
+        match = _SAMPLE.match(line.strip())
+        if match is None:
+            continue
+        try:
+            value = float(match.group("value"))
+        except ValueError:
+            continue
+        labels = tuple(
+            sorted(
+                (label.group("key"), _unescape_label(label.group("value")))
+                for label in _LABEL.finditer(match.group("labels") or "")
+            )
+        )
+        counters[match.group("name")][labels] += value
+    return counters
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a file, shared by every process."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a+b") as f:
+        try:
+            import fcntl
+        except ImportError:
+            # Windows
+            import msvcrt
+
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _format(value: float) -> str:
+    # Counts are kept exact, rather than in exponent notation
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class MetricsExporter(RenderObserver):
+    """Write events as JSON lines, and render counters as a Prometheus
+    textfile.
+
+    When each render finishes, the counts since the last write are added to
+    the counters already in the textfile, which is then replaced atomically.
+    This is done under a lock file next to the textfile, so short-lived
+    processes such as `itmpl new`, including ones running at the same time,
+    all add to the same counters. They only reset if the textfile is deleted.
+    counters holds the counts of this exporter alone.
+    """
+
+    # name: (type, help)
+    METRICS = {
+        "itmpl_renders_total": ("counter", "Renders, by template and status."),
+        "itmpl_render_duration_seconds": ("summary", "Time taken by renders."),
+        "itmpl_files_rendered_total": ("counter", "Files templated and written."),
+        "itmpl_files_skipped_total": ("counter", "Files templated but unchanged."),
+        "itmpl_files_copied_total": ("counter", "Files copied to destinations."),
+        "itmpl_bytes_written_total": ("counter", "Bytes written by renders."),
+        "itmpl_compile_cache_hits_total": (
+            "counter",
+            "Templates found in the compile cache.",
+        ),
+        "itmpl_phase_duration_seconds": ("summary", "Time taken by render phases."),
+        "itmpl_hook_duration_seconds": ("summary", "Time taken by .itmpl.py hooks."),
+    }
+
+    def __init__(
+        self,
+        textfile: Optional[Path] = None,
+        jsonl: Optional[Path] = None,
+    ) -> None:
+        self.textfile = textfile
+        self.jsonl = jsonl
+        # name -> labels -> value
+        self.counters = _counters()
+        # Counts not yet added to the textfile
+        self._unwritten = _counters()
+        self._lock = threading.Lock()
+        self._jsonl_file: Optional[TextIO] = None
+
+    def _add(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        self.counters[name][key] += value
+        self._unwritten[name][key] += value
+
+    def _observe(self, name: str, value: float, **labels: str) -> None:
+        self._add(f"{name}_sum", value, **labels)
+        self._add(f"{name}_count", 1, **labels)
+
+    def _record(self, event: RenderEvent) -> None:
+        template = event.template or ""
+        if isinstance(event, RenderFinished):
+            status = "ok" if event.ok else "error"
+            self._add("itmpl_renders_total", 1, template=template, status=status)
+            self._observe(
+                "itmpl_render_duration_seconds", event.duration, template=template
+            )
+            for name, value in [
+                ("itmpl_files_rendered_total", event.files_rendered),
+                ("itmpl_files_skipped_total", event.files_skipped),
+                ("itmpl_files_copied_total", event.files_copied),
+                ("itmpl_bytes_written_total", event.bytes_written),
+            ]:
+                self._add(name, value, template=template)
+            self._add("itmpl_compile_cache_hits_total", event.compile_cache_hits)
+        elif isinstance(event, PhaseFinished):
+            self._observe(
+                "itmpl_phase_duration_seconds", event.duration, phase=event.phase
+            )
+        elif isinstance(event, HookFinished):
+            self._observe(
+                "itmpl_hook_duration_seconds", event.duration, hook=event.hook
+            )
+
+    def render_textfile(self, counters: Optional[Counters] = None) -> str:
+        """Render counters, by default this exporter's, in the Prometheus text
+        format."""
+        counters = self.counters if counters is None else counters
+        lines: List[str] = []
+        for metric, (metric_type, help_text) in self.METRICS.items():
+            names = [metric]
+            if metric_type == "summary":
+                names = [f"{metric}_sum", f"{metric}_count"]
+            if not any(name in counters for name in names):
+                continue
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for name in names:
+                for labels, value in sorted(counters.get(name, {}).items()):
+                    lines.append(f"{name}{_labels(**dict(labels))} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _write_textfile(self, path: Path) -> None:
+        with _file_lock(path.with_name(f".{path.name}.lock")):
+            try:
+                counters = _parse_textfile(path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                counters = _counters()
+            for name, samples in self._unwritten.items():
+                for labels, value in samples.items():
+                    counters[name][labels] += value
+
+            # The collector may read the file at any time, so it is replaced
+            # rather than rewritten
+            temp_path = path.with_name(f".{path.name}.{os.getpid()}")
+            temp_path.write_text(self.render_textfile(counters), encoding="utf-8")
+            os.replace(temp_path, path)
+        self._unwritten = _counters()
+
+    def on_event(self, event: RenderEvent) -> None:
+        with self._lock:
+            if self.jsonl is not None:
+                if self._jsonl_file is None:
+                    self.jsonl.parent.mkdir(parents=True, exist_ok=True)
+                    self._jsonl_file = self.jsonl.open("a", encoding="utf-8")
+                self._jsonl_file.write(event.json() + "\n")
+                self._jsonl_file.flush()
+
+            self._record(event)
+            if isinstance(event, RenderFinished) and self.textfile is not None:
+                self._write_textfile(self.textfile)
+
+    def close(self) -> None:
+        """Close the JSON lines file."""
+        with self._lock:
+            if self._jsonl_file is not None:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+
+
+def configured_observers() -> List[RenderObserver]:
+    """The observers enabled in the config: a MetricsExporter writing to the
+    metrics_dir, if one is set."""
+    metrics_dir = config.read_config().metrics_dir
+    if metrics_dir is None:
+        return []
+    return [
+        MetricsExporter(
+            textfile=metrics_dir / TEXTFILE_NAME,
+            jsonl=metrics_dir / JSONL_NAME,
+        )
+    ]
@@ -0,0 +1,302 @@
+"""Template roots stored in git repositories.
+
+Each repository in the `template_repos` config option is mirrored as a bare
+repository under `GIT_DIR`, and fetched again only once it is older than
+`git_refresh_interval` seconds. The requested ref is resolved to a commit,
+and the commit's tree is streamed out of the object store with `git archive`
+into a snapshot directory named after the commit. Snapshots are never
+modified, so rendering a version that has been rendered before costs nothing
+beyond the render itself.
+
+The commit each ref resolved to is recorded in the mirror, next to
+`FETCH_HEAD`, so until the mirror is fetched again no git commands are run at
+all. A failed fetch is retried only after `FETCH_RETRY_DELAY` seconds.
+
+Snapshots are touched whenever they are used. `itmpl cache gc` removes the
+snapshots of commits no ref resolves to any more, once they haven't been used
+for `SNAPSHOT_GRACE_PERIOD` seconds, so renders and long-running processes
+still using them aren't affected.
+
+A repository is given as a URL (anything `git clone` accepts, including
+`file://` URLs and local paths), optionally followed by `#<ref>`, e.g.
+`https://github.com/org/templates.git#v2`. Its top-level directories are
+templates.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from rich import print
+
+from itmpl import global_vars
+
+GIT_DIR: Path = global_vars.APP_DIR / "git"
+
+COMMIT_REGEX = re.compile(r"^[0-9a-f]{40}$")
+
+# The commit each ref of a mirror resolved to, and when the mirror had last
+# been fetched at the time
+RESOLVED_FILE = "ITMPL_RESOLVED"
+
+# Touched when a fetch succeeds. git writes FETCH_HEAD even when one fails.
+FETCHED_FILE = "ITMPL_FETCHED"
+
+# Touched when a fetch fails, so it isn't retried on every call while offline
+FETCH_FAILED_FILE = "ITMPL_FETCH_FAILED"
+
+# Seconds before a failed fetch is retried, unless git_refresh_interval is
+# shorter
+FETCH_RETRY_DELAY = 300.0
+
+# Seconds an unreferenced snapshot must have gone unused before it is pruned
+SNAPSHOT_GRACE_PERIOD = 24 * 60 * 60.0
+
+# The snapshot each repository resolved to in this process, and when
+_resolved: Dict[str, Tuple[float, Path]] = {}
+
+
+class GitTemplateError(Exception):
+    """Exception raised when a template repository can't be read."""
+
+
+def parse_repo_spec(spec: str) -> Tuple[str, Optional[str]]:
+    """Split a repository spec into its URL and ref."""
+    url, _, ref = spec.partition("#")
+    if "://" not in url and not re.match(r"^[\w.-]+@[\w.-]+:", url):
+        # A local path, which must not depend on the working directory
+        url = str(Path(url).expanduser().resolve())
+    return url, ref or None
+
+
+def _git(*args: str, cwd: Optional[Path] = None) -> str:
+    try:
+        result = subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except FileNotFoundError as e:
+        raise GitTemplateError("git is not installed") from e
+    except subprocess.CalledProcessError as e:
+        raise GitTemplateError(
+            f"git {' '.join(args)} failed: {e.stderr.strip()}"
+        ) from e
+    return result.stdout.strip()
+
+
+def repo_path(url: str) -> Path:
+    """The path of the bare mirror of a repository."""
+    digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+    return GIT_DIR / "repos" / f"{digest}.git"
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _last_fetched(repo: Path) -> float:
+    # A fresh mirror hasn't been fetched yet
+    return _mtime(repo / FETCHED_FILE) or _mtime(repo / "HEAD")
+
+
+def _backing_off(repo: Path, max_age: float) -> bool:
+    """Whether a fetch of the mirror failed too recently to try again."""
+    delay = min(max_age, FETCH_RETRY_DELAY)
+    return time.time() - _mtime(repo / FETCH_FAILED_FILE) < delay
+
+
+def _fetch(repo: Path) -> None:
+    try:
+        _git("fetch", "--quiet", "--prune", cwd=repo)
+    except GitTemplateError:
+        (repo / FETCH_FAILED_FILE).touch()
+        raise
+    (repo / FETCHED_FILE).touch()
+    (repo / FETCH_FAILED_FILE).unlink(missing_ok=True)
+
+
+def update_repo(url: str, max_age: float) -> Path:
+    """Mirror a repository, or fetch it if the mirror is older than max_age
+    seconds. If a fetch fails, the existing mirror is used, and it isn't
+    fetched again for FETCH_RETRY_DELAY seconds."""
+    repo = repo_path(url)
+    if not (repo / "HEAD").exists():
+        repo.parent.mkdir(parents=True, exist_ok=True)
+        temp_repo = Path(tempfile.mkdtemp(prefix=f".{repo.name}-", dir=repo.parent))
+        try:
+            _git("clone", "--quiet", "--mirror", url, str(temp_repo))
+            os.replace(temp_repo, repo)
+        except OSError:
+            # Another process cloned it first
+            if not (repo / "HEAD").exists():
+                raise
+        finally:
+            shutil.rmtree(temp_repo, ignore_errors=True)
+        return repo
+
+    if time.time() - _last_fetched(repo) > max_age and not _backing_off(repo, max_age):
+        try:
+            _fetch(repo)
+        except GitTemplateError as e:
+            print(f"[yellow]Using cached templates from {url}: {e}[/yellow]")
+
+    return repo
+
+
+def resolve_commit(repo: Path, ref: Optional[str]) -> str:
+    """Resolve a ref in a repository to a commit hash."""
+    return _git(
+        "rev-parse", "--verify", "--quiet", f"{ref or 'HEAD'}^{{commit}}", cwd=repo
+    )
+
+
+def _read_resolved(repo: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads((repo / RESOLVED_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _record_resolved(repo: Path, ref: Optional[str], commit: str) -> None:
+    """Record the commit a ref resolved to in the mirror."""
+    resolved = _read_resolved(repo)
+    resolved[ref or "HEAD"] = {"commit": commit, "fetched": _last_fetched(repo)}
+    temp_path = repo / f".{RESOLVED_FILE}.{os.getpid()}"
+    try:
+        temp_path.write_text(json.dumps(resolved), encoding="utf-8")
+        os.replace(temp_path, repo / RESOLVED_FILE)
+    except OSError:
+        # Only saves resolving the ref again
+        pass
+
+
+def _recorded_commit(repo: Path, ref: Optional[str]) -> Optional[str]:
+    """The commit a ref resolved to, if the mirror hasn't been fetched since."""
+    recorded = _read_resolved(repo).get(ref or "HEAD")
+    if recorded is None or recorded.get("fetched") != _last_fetched(repo):
+        return None
+    return recorded.get("commit")
+
+
+def _use_snapshot(snapshot: Path) -> Path:
+    """Mark a snapshot as used, so it isn't pruned while in use."""
+    try:
+        os.utime(snapshot)
+    except OSError:
+        pass
+    return snapshot
+
+
+def prune_snapshots(
+    grace_period: float = SNAPSHOT_GRACE_PERIOD,
+    dry_run: bool = False,
+) -> List[Path]:
+    """Remove the snapshots of commits no ref of any mirror resolves to, that
+    haven't been used for grace_period seconds. Returns the snapshots removed,
+    or that would be removed if dry_run is True."""
+    referenced = {
+        r.get("commit")
+        for resolved_path in GIT_DIR.glob(f"repos/*.git/{RESOLVED_FILE}")
+        for r in _read_resolved(resolved_path.parent).values()
+    }
+
+    removed = []
+    now = time.time()
+    for snapshot in sorted((GIT_DIR / "snapshots").glob("*")):
+        # Exports left behind by a process that was killed are never referenced
+        if snapshot.name in referenced or now - _mtime(snapshot) < grace_period:
+            continue
+        if not dry_run:
+            shutil.rmtree(snapshot, ignore_errors=True)
+        removed.append(snapshot)
+    return removed
+
+
+def export_commit(repo: Path, commit: str) -> Path:
+    """Extract the tree of a commit into its snapshot directory, streaming it
+    from the object store without a checkout. Does nothing if the snapshot
+    already exists."""
+    snapshot = GIT_DIR / "snapshots" / commit
+    if snapshot.exists():
+        return snapshot
+
+    snapshot.parent.mkdir(parents=True, exist_ok=True)
+    temp_snapshot = Path(tempfile.mkdtemp(prefix=f".{commit}-", dir=snapshot.parent))
+    try:
+        process = subprocess.Popen(
+            ["git", "archive", "--format=tar", commit],
+            cwd=repo,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        assert process.stdout is not None
+        with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+            if hasattr(tarfile, "data_filter"):
+                archive.extractall(temp_snapshot, filter="data")
+            else:
+                archive.extractall(temp_snapshot)
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            raise GitTemplateError(
+                f"git archive {commit} failed: {stderr.decode().strip()}"
+            )
+
+        try:
+            os.replace(temp_snapshot, snapshot)
+        except OSError:
+            if not snapshot.exists():
+                raise
+    finally:
+        shutil.rmtree(temp_snapshot, ignore_errors=True)
+
+    return snapshot
+
+
+def get_repo_root(spec: str, max_age: float) -> Path:
+    """Get the template root for a repository spec, fetching and exporting it
+    if needed. A commit hash that has been exported before, or a ref resolved
+    since the mirror was last fetched, needs no git commands at all."""
+    cached = _resolved.get(spec)
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return _use_snapshot(cached[1])
+
+    url, ref = parse_repo_spec(spec)
+    if ref is not None and COMMIT_REGEX.match(ref):
+        snapshot = GIT_DIR / "snapshots" / ref
+        if snapshot.exists():
+            return _use_snapshot(snapshot)
+
+    repo = update_repo(url, max_age)
+    commit = _recorded_commit(repo, ref)
+    if commit is not None and (GIT_DIR / "snapshots" / commit).exists():
+        snapshot = GIT_DIR / "snapshots" / commit
+        _resolved[spec] = (time.monotonic(), snapshot)
+        return _use_snapshot(snapshot)
+
+    try:
+        commit = resolve_commit(repo, ref)
+    except GitTemplateError:
+        if ref is None or _backing_off(repo, max_age):
+            raise
+        # The ref may be new since the last fetch
+        _fetch(repo)
+        commit = resolve_commit(repo, ref)
+
+    snapshot = export_commit(repo, commit)
+    _record_resolved(repo, ref, commit)
+    _resolved[spec] = (time.monotonic(), snapshot)
+    return _use_snapshot(snapshot)
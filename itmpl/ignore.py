@@ -0,0 +1,142 @@
+"""Gitignore-style rules for leaving files out of a template when it's copied.
+
+Rules come from the `copy_excludes` key in a template's `.itmpl.toml`, and
+from an `.itmplignore` file in the template directory. They use the same
+syntax as `.gitignore`:
+
+- Blank lines and lines starting with `#` are ignored.
+- `*` matches anything except `/`, `?` matches one character, and `[...]`
+  matches a range of characters.
+- `**` matches any number of directories.
+- A pattern ending in `/` only matches directories.
+- A pattern containing a `/` (other than at the end) is relative to the
+  template directory. Otherwise it matches at any depth.
+- A pattern starting with `!` re-includes paths excluded by earlier patterns.
+
+Rules are compiled to regular expressions once, and checked against paths
+relative to the template directory as it is walked, so ignored directories
+are never entered.
+"""
+import re
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Pattern
+
+IGNORE_FILE = ".itmplignore"
+
+
+class IgnoreRule(NamedTuple):
+    regex: Pattern[str]
+    negate: bool
+    directories_only: bool
+
+
+def _translate_glob(pattern: str) -> str:
+    """Translate a gitignore glob, without the leading or trailing slash, to a
+    regular expression."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i) and i + 2 == len(pattern):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            contents = pattern[i + 1 : end]
+            if contents.startswith("!"):
+                contents = "^" + contents[1:]
+            contents = contents.replace("\\", "\\\\")
+            parts.append(f"[{contents}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+def compile_rule(line: str) -> Optional[IgnoreRule]:
+    """Compile a line of an ignore file. Returns None for blank lines and
+    comments."""
+    line = line.rstrip("\n")
+    if not line.strip() or line.startswith("#"):
+        return None
+    # Trailing spaces are ignored unless escaped
+    line = re.sub(r"(?<!\\)\s+$", "", line)
+
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+
+    directories_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+
+    anchored = "/" in line
+    line = line.lstrip("/")
+    regex = _translate_glob(line)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+
+    return IgnoreRule(re.compile(f"^{regex}$"), negate, directories_only)
+
+
+class IgnoreRules:
+    """A compiled set of ignore rules. Later rules take precedence."""
+
+    def __init__(self, lines: Iterable[str] = ()) -> None:
+        self.rules: List[IgnoreRule] = []
+        for line in lines:
+            rule = compile_rule(line)
+            if rule is not None:
+                self.rules.append(rule)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, IgnoreRules):
+            return NotImplemented
+        return [
+            (rule.regex.pattern, rule.negate, rule.directories_only)
+            for rule in self.rules
+        ] == [
+            (rule.regex.pattern, rule.negate, rule.directories_only)
+            for rule in other.rules
+        ]
+
+    def is_ignored(self, relative_path: str, is_dir: bool) -> bool:
+        """Check whether a path, relative to the template directory and using
+        / as the separator, is ignored."""
+        ignored = False
+        for rule in self.rules:
+            if rule.directories_only and not is_dir:
+                continue
+            if rule.negate == ignored and rule.regex.match(relative_path):
+                ignored = not rule.negate
+        return ignored
+
+
+def read_ignore_rules(
+    template_dirs: Iterable[Path],
+    copy_excludes: Iterable[str] = (),
+) -> IgnoreRules:
+    """Read the copy exclusions for a template: its copy_excludes, then the
+    .itmplignore file of each of its directories, base first."""
+    lines = list(copy_excludes)
+    for directory in template_dirs:
+        ignore_file = directory / IGNORE_FILE
+        if ignore_file.is_file():
+            lines.extend(ignore_file.read_text(encoding="utf-8").splitlines())
+    return IgnoreRules(lines)
@@ -1,23 +1,128 @@
 import subprocess
+import sys
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import typer
 from rich import print
+from rich.console import Console
 from typer import Typer
 
-from itmpl import config, global_vars, templating, utils
+from itmpl import (
+    blobstore,
+    check,
+    config,
+    daemon,
+    events,
+    git_templates,
+    global_vars,
+    pack,
+    profiling,
+    templating,
+    utils,
+    watcher,
+)
+from itmpl.budgets import Budgets
+from itmpl.durability import Durability
 
 app = Typer()
+error_console = Console(stderr=True)
 app.add_typer(config.app, name="config", help="Manage iTmpl configuration.")
+cache_app = Typer()
+app.add_typer(cache_app, name="cache", help="Manage the blob store.")
 
 
 @app.command("list")
-def list_():
-    """List all available templates."""
+def list_(
+    output_format: utils.ListFormat = typer.Option(
+        utils.ListFormat.TABLE,
+        "--format",
+        case_sensitive=False,
+        help=(
+            "The output format. json, jsonl and plain are written as templates "
+            "are read, for use in scripts."
+        ),
+    ),
+    filters: Optional[List[str]] = typer.Option(
+        None,
+        "--filter",
+        help=(
+            "Only list templates matching FIELD=GLOB, where FIELD is name, "
+            "description or requirements, or containing the text in any field. "
+            "Can be given more than once."
+        ),
+    ),
+):
+    """List all available templates.
+
+    Parameters
+    ----------
+    output_format : utils.ListFormat
+        The output format: a table, a JSON array, JSON lines, or one tab
+        separated name and description per line.
+    filters : Optional[List[str]]
+        Filters that every listed template must match.
+    """
+    try:
+        parsed_filters = [utils.parse_template_filter(f) for f in filters or []]
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint="--filter")
+
+    try:
+        template_options = templating.iter_template_options()
+    except templating.DuplicateTemplateError as e:
+        # Kept off stdout, which scripts parse
+        error_console.print("[red]Duplicate templates found:[/red]")
+        error_console.print(
+            utils.construct_table_from_templates(e.duplicate_templates.values()),
+        )
+        error_console.print("[red]Please remove the duplicates and try again.[/red]")
+        raise typer.Exit(1)
+
+    templates = (
+        (name, path, toml)
+        for name, path, toml in template_options
+        if utils.template_matches(name, toml, parsed_filters)
+    )
+    if output_format == utils.ListFormat.TABLE:
+        print(
+            utils.construct_table_from_templates(
+                (path, toml) for _, path, toml in templates
+            ),
+        )
+    else:
+        utils.write_templates(templates, output_format, sys.stdout)
+
+
+@app.command()
+def search(
+    query: str,
+    limit: int = typer.Option(
+        10,
+        "--limit",
+        "-n",
+        min=1,
+        help="The maximum number of templates to show.",
+    ),
+):
+    """Search templates by name, description, requirements and variables.
+
+    Parameters
+    ----------
+    query : str
+        The words to search for. Every word must match the start of a word in
+        the template's metadata.
+    limit : int
+        The maximum number of templates to show, best match first.
+    """
+    results = templating.search_templates(query)
+    if not results:
+        print(f"[yellow]No templates match [white]{query}[/white].[/yellow]")
+        raise typer.Exit(1)
+
     print(
         utils.construct_table_from_templates(
-            templating.get_template_options().values(),
+            (path, toml) for _, path, toml in results[:limit]
         ),
     )
 
@@ -39,19 +144,248 @@ def new(
         "-f",
         help="Overwrite any files that already exist without prompting.",
     ),
+    only: Optional[List[str]] = typer.Option(
+        None,
+        "--only",
+        help=(
+            "Only render paths in the template matching this glob, e.g. "
+            "'tests/**'. Can be given more than once. The post script is not run."
+        ),
+    ),
+    durability: Optional[Durability] = typer.Option(
+        None,
+        "--durability",
+        case_sensitive=False,
+        help=(
+            "How carefully files are written: none, atomic (write to a temporary "
+            "file and rename it) or durable (atomic, then flush to disk). "
+            "Defaults to the durability config option."
+        ),
+    ),
+    links: Optional[blobstore.LinkMode] = typer.Option(
+        None,
+        "--links",
+        case_sensitive=False,
+        help=(
+            "How files the template leaves unchanged are shared through the blob "
+            "store: none, reflink (copy-on-write clones) or hardlink (read-only "
+            "links). Defaults to the blob_links config option."
+        ),
+    ),
+    hook_timeout: Optional[float] = typer.Option(
+        None,
+        "--hook-timeout",
+        min=0,
+        help="Seconds the .itmpl.py hooks may each run for.",
+    ),
+    hook_memory: Optional[int] = typer.Option(
+        None,
+        "--hook-memory",
+        min=1,
+        help="MiB of memory the .itmpl.py hooks may each use. Hooks can't prompt.",
+    ),
+    render_timeout: Optional[float] = typer.Option(
+        None,
+        "--render-timeout",
+        min=0,
+        help="Seconds rendering each file may take.",
+    ),
+    max_output: Optional[int] = typer.Option(
+        None,
+        "--max-output",
+        min=1,
+        help="KiB each rendered file may contain.",
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Print a summary of the time and memory used by each phase.",
+    ),
+    profile_json: Optional[Path] = typer.Option(
+        None,
+        "--profile-json",
+        dir_okay=False,
+        help="Write a JSON profiling report to this file.",
+    ),
+    socket: Path = typer.Option(
+        daemon.DEFAULT_SOCKET_PATH,
+        "--socket",
+        dir_okay=False,
+        help="The socket of a running `itmpl serve` daemon to render with.",
+    ),
+    no_daemon: bool = typer.Option(
+        False,
+        "--no-daemon",
+        help="Render in this process even if a daemon is running.",
+    ),
 ):
     """Create a new project from a template.
 
     Parameters
     ----------
     template : str
-        The name of the template to use.
+        The name of the template to use, or the path to a pack made by
+        `itmpl pack`.
     name : str
         The name of the project to create.
     path : Path
         The path to create the project in.
     force : bool
         If True, overwrite any files that already exist without prompting.
+    only : Optional[List[str]]
+        If given, only render the paths in the template matching these globs,
+        and don't run the post script.
+    durability : Optional[Durability]
+        How carefully files are written. If not given, the durability config
+        option is used.
+    links : Optional[blobstore.LinkMode]
+        How unchanged files are linked from the blob store. If not given, the
+        blob_links config option is used.
+    hook_timeout : Optional[float]
+        If given, the seconds each .itmpl.py hook may run for.
+    hook_memory : Optional[int]
+        If given, the MiB of memory each .itmpl.py hook may use.
+    render_timeout : Optional[float]
+        If given, the seconds rendering each file may take.
+    max_output : Optional[int]
+        If given, the KiB each rendered file may contain.
+    profile : bool
+        If True, print a summary of the time and memory used by each phase.
+    profile_json : Optional[Path]
+        If given, write a JSON profiling report to this file.
+    socket : Path
+        The socket of a running daemon. If one is listening, `itmpl.client`
+        forwards the command to it, with this process's environment variables
+        and working directory, before this command is loaded, unless profiling
+        is enabled. It only reaches here if the daemon can't render it.
+    no_daemon : bool
+        If True, never render with the daemon.
+    """
+    settings = config.read_config()
+    durability = durability or settings.durability
+    links = links or settings.blob_links
+    budgets = Budgets(
+        hook_timeout=hook_timeout,
+        hook_memory_mb=hook_memory,
+        render_timeout=render_timeout,
+        max_output_kb=max_output,
+    )
+    profiling_enabled = profile or profile_json is not None
+    is_pack = template.endswith(pack.PACK_SUFFIX)
+    if is_pack and only:
+        print("[red]--only can't be used when rendering a pack.[/red]")
+        raise typer.Exit(1)
+
+    profiler = profiling.Profiler(
+        enabled=profiling_enabled, observers=events.configured_observers()
+    )
+    profiler.start()
+
+    if not is_pack:
+        try:
+            with profiler.phase("discovery"):
+                template_options = templating.get_template_options()
+        except templating.DuplicateTemplateError as e:
+            print("[red]Duplicate templates found:[/red]")
+            print(utils.construct_table_from_templates(e.duplicate_templates.values()))
+            print("[red]Please remove the duplicates and try again.[/red]")
+            raise typer.Exit(1)
+
+        if template not in template_options:
+            print(
+                f"[red]Template [white]{template}[/white] not found. "
+                f"Available templates:[/red]"
+            )
+            print(utils.construct_table_from_templates(template_options.values()))
+            raise typer.Exit(1)
+
+    # Allow the user to template in this directory
+    path = path.resolve()
+    if path.name == name:
+        path = path.parent
+
+    destination = path / name
+
+    try:
+        if is_pack:
+            template = pack.render_pack(
+                project_name=name,
+                pack_path=Path(template),
+                destination=destination,
+                prompt_if_duplicates=not force,
+                profiler=profiler,
+                durability=durability,
+                budgets=budgets,
+                links=links,
+            )
+        else:
+            template_path, template_metadata = template_options[template]
+            templating.render_template(
+                project_name=name,
+                template=template,
+                destination=destination,
+                template_path=template_path,
+                exclude=template_metadata.metadata.templating_excludes,
+                prompt_if_duplicates=not force,
+                profiler=profiler,
+                only=only or None,
+                durability=durability,
+                budgets=budgets,
+                links=links,
+            )
+    except templating.TemplatingException as e:
+        print(f"[red]Error when templating project:[/red] {e}")
+        raise typer.Exit(1)
+    finally:
+        profiler.stop()
+
+    print(f"Created [green]{template}[/green] project at [green]{destination}[/green]")
+
+    if profile:
+        print(profiling.construct_table_from_report(profiler.report))
+    if profile_json is not None:
+        profiling.write_report(profiler.report, profile_json)
+
+
+@app.command()
+def dev(
+    template: str,
+    name: str,
+    path: Path = typer.Option(
+        Path("."),
+        "--path",
+        "-p",
+        exists=True,
+        help="The path to render the project in.",
+    ),
+    watch: bool = typer.Option(
+        False,
+        "--watch",
+        "-w",
+        help="Keep running, and re-render files as the template changes.",
+    ),
+    interval: float = typer.Option(
+        0.25,
+        "--interval",
+        min=0.01,
+        help="Seconds between checks for changes to the template.",
+    ),
+):
+    """Render a template without running its post script, for developing
+    templates. With --watch, only the files that change are rendered again.
+
+    Parameters
+    ----------
+    template : str
+        The name of the template to render.
+    name : str
+        The name of the project to render.
+    path : Path
+        The path to render the project in.
+    watch : bool
+        If True, poll the template for changes and re-render them.
+    interval : float
+        The number of seconds between checks for changes.
     """
     try:
         template_options = templating.get_template_options()
@@ -69,34 +403,165 @@ def new(
         print(utils.construct_table_from_templates(template_options.values()))
         raise typer.Exit(1)
 
-    # Allow the user to template in this directory
     path = path.resolve()
     if path.name == name:
         path = path.parent
-
     destination = path / name
 
-    template_path = template_options[template][0]
-    template_metadata = template_options[template][1]
+    template_path, template_metadata = template_options[template]
+    renderer = watcher.DevRenderer(
+        project_name=name,
+        template_path=template_path,
+        destination=destination,
+        exclude=template_metadata.metadata.templating_excludes,
+    )
 
     try:
-        templating.render_template(
-            project_name=name,
-            template=template,
-            destination=destination,
-            template_path=template_path,
-            exclude=template_metadata.metadata.templating_excludes,
-            prompt_if_duplicates=not force,
-        )
+        count = renderer.render()
     except templating.TemplatingException as e:
         print(f"[red]Error when templating project:[/red] {e}")
         raise typer.Exit(1)
+    print(f"Rendered {count} file(s) to [green]{destination}[/green]")
 
-    print(f"Created [green]{template}[/green] project at [green]{destination}[/green]")
+    if not watch:
+        return
+
+    print(f"Watching [green]{template_path}[/green] for changes. Press Ctrl+C to stop.")
+    while True:
+        try:
+            for count, duration in renderer.watch(interval):
+                print(f"Rendered {count} file(s) in {duration:.3f}s")
+        except templating.TemplatingException as e:
+            # Keep watching, so the error can be fixed in the template
+            print(f"[red]Error when templating project:[/red] {e}")
+        except KeyboardInterrupt:
+            return
+
+
+@app.command("check")
+def check_(template: Optional[str] = typer.Argument(None)):
+    """Compile the specified template, and report Jinja syntax errors and
+    undefined variables before rendering it. If no template is specified,
+    check all templates. The compiled templates are stored, so rendering them
+    later doesn't compile them again.
+
+    Parameters
+    ----------
+    template : Optional[str]
+        The name of the template to check.
+    """
+    try:
+        template_options = templating.get_template_options()
+    except templating.DuplicateTemplateError as e:
+        print("[red]Duplicate templates found:[/red]")
+        print(utils.construct_table_from_templates(e.duplicate_templates.values()))
+        print("[red]Please remove the duplicates and try again.[/red]")
+        raise typer.Exit(1)
+
+    if template is not None and template not in template_options:
+        print(
+            f"[red]Template [white]{template}[/white] not found. "
+            f"Available templates:[/red]"
+        )
+        print(utils.construct_table_from_templates(template_options.values()))
+        raise typer.Exit(1)
+
+    if template is None:
+        selected_templates = template_options
+    else:
+        selected_templates = {template: template_options[template]}
+
+    failed = False
+    for template_name, (template_path, _) in sorted(selected_templates.items()):
+        try:
+            problems = check.check_template(template_path)
+        except templating.TemplatingException as e:
+            print(f"[red]{template_name}: {e}[/red]")
+            failed = True
+            continue
+
+        if not problems:
+            print(f"[green]{template_name}: OK[/green]")
+            continue
+
+        errors = sum(problem.error for problem in problems)
+        colour = "red" if errors else "yellow"
+        print(
+            f"[{colour}]{template_name}: {errors} error(s), "
+            f"{len(problems) - errors} warning(s)[/{colour}]"
+        )
+        print(check.construct_table_from_problems(problems))
+        failed = failed or bool(errors)
+
+    if failed:
+        raise typer.Exit(1)
+
+
+@app.command("pack")
+def pack_(
+    template: str,
+    output: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        "-o",
+        dir_okay=False,
+        help="The file to write. Defaults to <template>.itmplpack.",
+    ),
+):
+    """Pack a template, with its files classified and compiled, into a single
+    file. `itmpl new <pack> <name>` renders from it without reading or
+    compiling the template again.
+
+    Parameters
+    ----------
+    template : str
+        The name of the template to pack.
+    output : Optional[Path]
+        The file to write the pack to.
+    """
+    try:
+        template_options = templating.get_template_options()
+    except templating.DuplicateTemplateError as e:
+        print("[red]Duplicate templates found:[/red]")
+        print(utils.construct_table_from_templates(e.duplicate_templates.values()))
+        print("[red]Please remove the duplicates and try again.[/red]")
+        raise typer.Exit(1)
+
+    if template not in template_options:
+        print(
+            f"[red]Template [white]{template}[/white] not found. "
+            f"Available templates:[/red]"
+        )
+        print(utils.construct_table_from_templates(template_options.values()))
+        raise typer.Exit(1)
+
+    output = output or Path(f"{template}{pack.PACK_SUFFIX}")
+    try:
+        header = pack.write_pack(template_options[template][0], output)
+    except templating.TemplatingException as e:
+        print(f"[red]Error when packing template:[/red] {e}")
+        raise typer.Exit(1)
+
+    print(
+        f"Packed [green]{template}[/green] ({len(header.entries)} entries) "
+        f"to [green]{output}[/green]"
+    )
 
 
 @app.command()
-def deps(template: Optional[str] = typer.Argument(None)):
+def deps(
+    template: Optional[str] = typer.Argument(None),
+    wheelhouse: Optional[Path] = typer.Option(
+        None,
+        "--wheelhouse",
+        file_okay=False,
+        help=(
+            "Build the template requirements and .itmpl.requirements*.txt files "
+            "into this wheel cache, and install from it without a package index. "
+            "Defaults to the wheelhouse_dir config option."
+        ),
+    ),
+):
     """Install dependencies for the specified template. If no template is specified,
     install dependencies for all templates."""
     try:
@@ -116,41 +581,117 @@ def deps(template: Optional[str] = typer.Argument(None)):
         raise typer.Exit(1)
 
     if template is None:
-        templates_with_dependencies = [
-            (template_name, toml_obj.metadata.template_requirements)
-            for template_name, (_, toml_obj) in template_options.items()
-        ]
+        selected_templates = template_options
     else:
-        templates_with_dependencies = [
-            (template, template_options[template][1].metadata.template_requirements),
-        ]
+        selected_templates = {template: template_options[template]}
 
     to_install = [
-        (template_name, dependencies)
-        for template_name, dependencies in templates_with_dependencies
-        if dependencies
+        (template_name, toml_obj.metadata.template_requirements)
+        for template_name, (_, toml_obj) in selected_templates.items()
+        if toml_obj.metadata.template_requirements
     ]
 
+    wheelhouse = wheelhouse or config.read_config().wheelhouse_dir
+    if wheelhouse is not None:
+        # Generated projects' requirements are cached too, so hooks can
+        # install them offline
+        to_build = utils.deduplicate_requirements(
+            [
+                *(d for _, dependencies in to_install for d in dependencies),
+                *(
+                    d
+                    for template_path, _ in selected_templates.values()
+                    for d in utils.read_template_requirements_files(template_path)
+                ),
+            ],
+        )
+        if to_build:
+            print(f"[green]Updating wheelhouse [white]{wheelhouse}[/white][/green]")
+            try:
+                utils.build_wheelhouse(to_build, wheelhouse)
+            except subprocess.CalledProcessError as e:
+                print(f"[red]Error building wheelhouse: {e}[/red]")
+                raise typer.Exit(1)
+
     if not to_install:
         print("[green]No dependencies to install.[/green]")
         raise typer.Exit(0)
 
-    for template_name, dependencies in to_install:
-        print(
-            f"[green]Installing dependencies for template "
-            f"[white]{template_name}[/white][/green]"
-        )
-        try:
-            utils.install_dependencies(dependencies)
-        except subprocess.CalledProcessError as e:
-            print(
-                f"[red]Error installing dependencies for template "
-                f"[white]{template_name}[/white]: {e}[/red]"
-            )
+    # Check every requirement once, no matter how many templates share it
+    all_dependencies = [
+        dependency for _, dependencies in to_install for dependency in dependencies
+    ]
+    satisfied = utils.check_requirements(all_dependencies)
+    print(utils.construct_dependency_table(to_install, satisfied))
+
+    unsatisfied = utils.deduplicate_requirements(
+        d for d in all_dependencies if not satisfied[d]
+    )
+    if not unsatisfied:
+        print("[green]All dependencies are already installed.[/green]")
+        raise typer.Exit(0)
+
+    # Install everything in a single resolver run
+    print(
+        f"[green]Installing dependencies: "
+        f"[white]{', '.join(unsatisfied)}[/white][/green]"
+    )
+    try:
+        utils.install_dependencies(unsatisfied, wheelhouse=wheelhouse)
+    except subprocess.CalledProcessError as e:
+        print(f"[red]Error installing dependencies: {e}[/red]")
+        raise typer.Exit(1)
 
     print("[green]Done.[/green]")
 
 
+@cache_app.command("gc")
+def cache_gc(
+    dry_run: bool = typer.Option(
+        False,
+        "--dry-run",
+        help="Only show what would be removed.",
+    ),
+):
+    """Remove files from the blob store that no project uses any more, and
+    snapshots of template repositories that no ref points to any more.
+
+    Parameters
+    ----------
+    dry_run : bool
+        If True, don't remove anything.
+    """
+    result = blobstore.BlobStore(blobstore.LinkMode.NONE).gc(dry_run=dry_run)
+    snapshots = git_templates.prune_snapshots(dry_run=dry_run)
+    verb = "Would remove" if dry_run else "Removed"
+    print(
+        f"{verb} [green]{result.blobs_removed}[/green] stored files "
+        f"([green]{profiling.format_bytes(result.bytes_freed)}[/green]), "
+        f"[green]{result.refs_removed}[/green] project records and "
+        f"[green]{len(snapshots)}[/green] template repository snapshots."
+    )
+
+
+@app.command()
+def serve(
+    socket: Path = typer.Option(
+        daemon.DEFAULT_SOCKET_PATH,
+        "--socket",
+        dir_okay=False,
+        help="The Unix socket to listen on.",
+    ),
+):
+    """Run a daemon that keeps templates warm in memory. While it is running,
+    `itmpl new` renders projects through it."""
+    try:
+        daemon.serve(socket)
+    except daemon.DaemonError as e:
+        print(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+    except KeyboardInterrupt:
+        print("[green]Stopped.[/green]")
+
+
 @app.callback()
 def create_directories():
     """Create directories used by iTmpl. This is called automatically when iTmpl is
@@ -159,6 +700,8 @@ def create_directories():
     global_vars.TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
     c = config.read_config()
     c.extra_templates_dir.mkdir(parents=True, exist_ok=True)
+    if c.wheelhouse_dir is not None:
+        c.wheelhouse_dir.mkdir(parents=True, exist_ok=True)
 
 
 if __name__ == "__main__":
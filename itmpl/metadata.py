@@ -9,6 +9,9 @@ except ImportError:
 
 from pydantic import BaseModel
 
+from itmpl.budgets import Budgets
+from itmpl.tree_utils import SymlinkPolicy
+
 
 class ItmplMetadata(BaseModel):
     """Metadata from the .itmpl.toml file."""
@@ -16,6 +19,14 @@ class ItmplMetadata(BaseModel):
     template_description: Optional[str] = None
     template_requirements: List[str] = []
     templating_excludes: List[str] = []
+    # Gitignore-style patterns for paths that aren't copied from the template
+    copy_excludes: List[str] = []
+    # The name of a template this template is layered on top of
+    extends: Optional[str] = None
+    # How symlinks in the template are copied. Defaults to copying their targets.
+    symlinks: Optional[SymlinkPolicy] = None
+    # Limits on the time and memory used to render the template
+    budgets: Budgets = Budgets()
 
 
 class ItmplToml(BaseModel):
@@ -29,3 +40,46 @@ def read_itmpl_toml(path: Path) -> ItmplToml:
     if not path.exists():
         return ItmplToml()
     return ItmplToml.parse_obj(tomli.loads(path.read_text(encoding="utf-8")))
+
+
+def merge_itmpl_toml(base: ItmplToml, child: ItmplToml) -> ItmplToml:
+    """Merge the .itmpl.toml of a template with that of the template it
+    extends. The child's values take precedence, and lists are combined."""
+    return ItmplToml(
+        metadata=ItmplMetadata(
+            template_description=(
+                child.metadata.template_description
+                or base.metadata.template_description
+            ),
+            template_requirements=list(
+                dict.fromkeys(
+                    [
+                        *base.metadata.template_requirements,
+                        *child.metadata.template_requirements,
+                    ]
+                )
+            ),
+            templating_excludes=list(
+                dict.fromkeys(
+                    [
+                        *base.metadata.templating_excludes,
+                        *child.metadata.templating_excludes,
+                    ]
+                )
+            ),
+            # Order matters for negated patterns, so these aren't de-duplicated
+            copy_excludes=[
+                *base.metadata.copy_excludes,
+                *child.metadata.copy_excludes,
+            ],
+            extends=child.metadata.extends,
+            symlinks=child.metadata.symlinks or base.metadata.symlinks,
+            budgets=Budgets(
+                **{
+                    **base.metadata.budgets.dict(exclude_none=True),
+                    **child.metadata.budgets.dict(exclude_none=True),
+                }
+            ),
+        ),
+        variables={**base.variables, **child.variables},
+    )
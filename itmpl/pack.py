@@ -0,0 +1,551 @@
+"""Precompiled template packs.
+
+`itmpl pack <template>` writes a template, merged with the templates it
+extends and without its ignored files, to a single `.itmplpack` file that
+`itmpl new` can render from. Everything a render would otherwise work out for
+each file is done once, when packing:
+
+- which files and names are templated, and which are copied as they are,
+- whether each templated file is text, and whether it renders to itself, and
+- the compiled Jinja code of each templated file and name, and the bytecode of
+  `.itmpl.py`.
+
+A pack starts with `MAGIC` and the length of a JSON header describing every
+entry, followed by the header and then the contents of the files, each at an
+8-byte aligned offset. Identical files are stored once. Rendering
+memory-maps the pack and reads each file from its slice of it, so the
+template directory is never walked, and nothing is stat'ed or parsed.
+
+Files copied as they are carry the SHA-256 of their contents, so they can be
+linked from the blob store without being hashed again.
+
+Compiled code is only used by the Python and Jinja versions that wrote it.
+Otherwise the stored sources are compiled instead, so packs still work, only
+more slowly. Text in packs is UTF-8, and only the executable bits of file
+modes are kept.
+"""
+import enum
+import hashlib
+import importlib.util
+import io
+import marshal
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from pathlib import Path
+from types import CodeType
+from typing import Dict, List, Optional, Tuple, Type
+
+import jinja2
+from pydantic import BaseModel
+
+from itmpl import client, global_vars, profiling, templating
+from itmpl.blobstore import BlobStore, LinkMode
+from itmpl.budgets import BudgetError, Budgets, render_limited, strictest
+from itmpl.durability import Durability, OutputWriter
+from itmpl.metadata import ItmplToml
+
+MAGIC = b"ITMPLPK\x01"
+PACK_SUFFIX = client.PACK_SUFFIX
+ALIGNMENT = 8
+
+_HEADER_SIZE = struct.Struct("<Q")
+_JINJA_MARKERS = ("{{", "{%", "{#")
+HOOK_FILE = ".itmpl.py"
+
+
+class EntryKind(str, enum.Enum):
+    """How an entry in a pack is rendered."""
+
+    DIRECTORY = "directory"
+    # Text with Jinja in it
+    TEXT = "text"
+    # Not text, so copied as it is
+    BINARY = "binary"
+    # Text that renders to itself, or is excluded from templating
+    VERBATIM = "verbatim"
+    SYMLINK = "symlink"
+
+
+class Blob(BaseModel):
+    """A slice of the data section of a pack."""
+
+    offset: int
+    size: int
+
+
+class PackEntry(BaseModel):
+    # Relative to the template directory, before templating
+    path: str
+    kind: EntryKind
+    data: Optional[Blob] = None
+    # Compiled Jinja code of the contents, for text
+    code: Optional[Blob] = None
+    # Compiled Jinja code of the name, if it is templated
+    name_code: Optional[Blob] = None
+    # Set for executable files
+    mode: Optional[int] = None
+    # For symlinks
+    target: Optional[str] = None
+    # SHA-256 of the contents of files copied as they are, for the blob store
+    digest: Optional[str] = None
+
+
+class PackHeader(BaseModel):
+    template: str
+    # The merged .itmpl.toml
+    toml: ItmplToml
+    # Compiled code is only loaded by the versions that wrote it
+    cache_tag: Optional[str]
+    jinja_version: str
+    # .itmpl.py compiled to a .pyc file
+    hook_pyc: Optional[Blob] = None
+    # Parents before children
+    entries: List[PackEntry] = []
+
+
+def _padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def _is_templated(text: str) -> bool:
+    return any(marker in text for marker in _JINJA_MARKERS)
+
+
+def _decode(raw: bytes) -> str:
+    # The same newline handling as when rendering a template directory
+    return io.TextIOWrapper(io.BytesIO(raw), encoding="utf-8").read()
+
+
+class _Blobs:
+    """The data section of a pack being written."""
+
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+        self.size = 0
+        self._stored: Dict[bytes, Blob] = {}
+
+    def add(self, data: bytes) -> Blob:
+        digest = hashlib.sha256(data).digest()
+        if digest in self._stored:
+            return self._stored[digest]
+
+        blob = Blob(offset=self.size, size=len(data))
+        padding = _padding(len(data))
+        self.parts.extend([data, b"\0" * padding])
+        self.size += len(data) + padding
+        self._stored[digest] = blob
+        return blob
+
+
+def _compile(source: str, relative: str) -> bytes:
+    environment = templating.jinja_environment(jinja2.Undefined)
+    try:
+        return marshal.dumps(environment.compile(source))
+    except jinja2.TemplateSyntaxError as e:
+        raise templating.TemplatingException(
+            f"Error when compiling {relative}: {e.message}, on line {e.lineno}. "
+            f"Run `itmpl check` for details."
+        ) from e
+
+
+def _hook_pyc(source: bytes, path: Path) -> bytes:
+    """Compile .itmpl.py to an unchecked hash-based .pyc (PEP 552), which the
+    import system loads without comparing it to the source's mtime."""
+    code = compile(source, str(path), "exec", dont_inherit=True)
+    return b"".join(
+        [
+            importlib.util.MAGIC_NUMBER,
+            struct.pack("<I", 0b01),
+            importlib.util.source_hash(source),
+            marshal.dumps(code),
+        ]
+    )
+
+
+def _pack_entry(
+    path: Path,
+    relative: str,
+    templated: bool,
+    blobs: _Blobs,
+) -> PackEntry:
+    name_code = None
+    if templated and _is_templated(path.name):
+        name_code = blobs.add(_compile(path.name, relative))
+
+    if path.is_symlink():
+        return PackEntry(
+            path=relative,
+            kind=EntryKind.SYMLINK,
+            name_code=name_code,
+            target=os.readlink(path),
+        )
+    if path.is_dir():
+        return PackEntry(path=relative, kind=EntryKind.DIRECTORY, name_code=name_code)
+
+    raw = path.read_bytes()
+    mode = path.stat().st_mode & 0o777
+    entry = PackEntry(
+        path=relative,
+        kind=EntryKind.VERBATIM,
+        data=blobs.add(raw),
+        name_code=name_code,
+        mode=mode if mode & 0o111 else None,
+        digest=hashlib.sha256(raw).hexdigest(),
+    )
+    if not templated:
+        return entry
+
+    try:
+        source = _decode(raw)
+    except UnicodeDecodeError:
+        entry.kind = EntryKind.BINARY
+        return entry
+    if (
+        _is_templated(source)
+        or templating.encode_like_write_text(source, "utf-8") != raw
+    ):
+        entry.kind = EntryKind.TEXT
+        entry.code = blobs.add(_compile(source, relative))
+        entry.digest = None
+    return entry
+
+
+def write_pack(template_path: Path, output: Path) -> PackHeader:
+    """Pack a template into a single file. Raises a TemplatingException if the
+    template can't be read, or has a Jinja syntax error."""
+    layers, toml = templating.resolve_template(template_path)
+    blobs = _Blobs()
+    header = PackHeader(
+        template=template_path.name,
+        toml=toml,
+        cache_tag=sys.implementation.cache_tag,
+        jinja_version=jinja2.__version__,
+    )
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        # Pack exactly what a render would see, after overlaying the
+        # templates it extends and leaving out ignored files
+        directory = Path(tempdir) / template_path.name
+        templating.copy_template(
+            layers,
+            directory,
+            symlinks=toml.metadata.symlinks,
+            copy_excludes=toml.metadata.copy_excludes,
+        )
+        directory = directory.resolve()
+        files, directories = templating.find_paths_to_template(
+            directory, toml.metadata.templating_excludes
+        )
+        templated = set(files).union(directories)
+
+        for root, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            root_path = Path(root)
+            for name in [*dirnames, *sorted(filenames)]:
+                path = root_path / name
+                relative = path.relative_to(directory).as_posix()
+                header.entries.append(
+                    _pack_entry(path, relative, path in templated, blobs)
+                )
+
+        hook_file = directory / HOOK_FILE
+        if hook_file.is_file() and header.cache_tag is not None:
+            try:
+                header.hook_pyc = blobs.add(
+                    _hook_pyc(hook_file.read_bytes(), hook_file)
+                )
+            except SyntaxError as e:
+                raise templating.TemplatingException(
+                    f"Error when compiling {HOOK_FILE}: {e}"
+                ) from e
+
+    encoded = header.json().encode("utf-8")
+    start = len(MAGIC) + _HEADER_SIZE.size + len(encoded)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    try:
+        with temp_path.open("wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_SIZE.pack(len(encoded)))
+            f.write(encoded)
+            f.write(b"\0" * _padding(start))
+            f.writelines(blobs.parts)
+        os.replace(temp_path, output)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return header
+
+
+class Pack:
+    """A memory-mapped pack file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        try:
+            with path.open("rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise templating.TemplatingException(
+                f"Error when opening pack {path}: {e}"
+            ) from e
+
+        start = len(MAGIC) + _HEADER_SIZE.size
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise templating.TemplatingException(f"{path} is not an iTmpl pack")
+        (size,) = _HEADER_SIZE.unpack_from(self._mmap, len(MAGIC))
+        self.header = PackHeader.parse_raw(self._mmap[start : start + size])
+        self._data_start = start + size + _padding(start + size)
+        self.compiled = (
+            self.header.cache_tag == sys.implementation.cache_tag
+            and self.header.jinja_version == jinja2.__version__
+        )
+
+    def __enter__(self) -> "Pack":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def read(self, blob: Blob) -> bytes:
+        start = self._data_start + blob.offset
+        return self._mmap[start : start + blob.size]
+
+    def template(
+        self,
+        code: Optional[Blob],
+        source: str,
+        undefined: Type[jinja2.Undefined],
+    ) -> jinja2.Template:
+        """Load a compiled template, or compile its source if the compiled
+        code can't be used."""
+        if code is None or not self.compiled:
+            return templating.compile_template(source, undefined)
+        environment = templating.jinja_environment(undefined)
+        compiled: CodeType = marshal.loads(self.read(code))
+        return environment.template_class.from_code(
+            environment, compiled, environment.make_globals(None)
+        )
+
+    def write_hook_files(self, directory: Path) -> None:
+        """Write the .itmpl files at the root of the template, and the
+        bytecode of .itmpl.py, to a directory."""
+        for entry in self.header.entries:
+            if "/" not in entry.path and entry.path.startswith(".itmpl"):
+                if entry.data is not None:
+                    (directory / entry.path).write_bytes(self.read(entry.data))
+        self.write_hook_bytecode(directory)
+
+    def write_hook_bytecode(self, directory: Path) -> None:
+        """Write the bytecode of .itmpl.py where importing it from a
+        directory will find it, so it isn't compiled again."""
+        if self.header.hook_pyc is None or not self.compiled:
+            return
+        pyc_path = Path(importlib.util.cache_from_source(str(directory / HOOK_FILE)))
+        pyc_path.parent.mkdir(parents=True, exist_ok=True)
+        pyc_path.write_bytes(self.read(self.header.hook_pyc))
+
+
+# Rendered path, entry, and rendered contents for text
+_Output = Tuple[str, PackEntry, Optional[bytes]]
+
+
+def _render_entries(
+    pack: Pack,
+    variables: Dict[str, object],
+    profiler: profiling.Profiler,
+    budgets: Budgets,
+) -> List[_Output]:
+    rendered_paths: Dict[str, str] = {}
+    outputs: List[_Output] = []
+
+    for entry in pack.header.entries:
+        parent, _, name = entry.path.rpartition("/")
+        if entry.name_code is not None:
+            name = pack.template(entry.name_code, name, jinja2.Undefined).render(
+                **variables
+            )
+        path = f"{rendered_paths[parent]}/{name}" if parent else name
+        rendered_paths[entry.path] = path
+
+        contents = None
+        if entry.kind == EntryKind.TEXT and entry.data is not None:
+            with profiler.file(Path(path)) as file_stats:
+                raw = pack.read(entry.data)
+                file_stats.bytes_read = len(raw)
+                template = pack.template(
+                    entry.code, _decode(raw), templating.IgnoreUndefined
+                )
+                try:
+                    rendered = render_limited(
+                        lambda: template.generate(**variables), budgets
+                    )
+                except BudgetError as e:
+                    raise templating.TemplatingException(
+                        f"Rendering {entry.path} {e}"
+                    ) from e
+                contents = templating.encode_like_write_text(rendered, "utf-8")
+                file_stats.written = contents != raw
+                if file_stats.written:
+                    file_stats.bytes_written = len(contents)
+        outputs.append((path, entry, contents))
+
+    return outputs
+
+
+def _copy_outputs(
+    pack: Pack,
+    outputs: List[_Output],
+    destination: Path,
+    writer: OutputWriter,
+    profiler: profiling.Profiler,
+) -> int:
+    destination.mkdir(parents=True, exist_ok=True)
+    copied = 0
+    # Entries are in order, so each parent directory already exists
+    for path, entry, contents in outputs:
+        target = destination / path
+        if entry.kind == EntryKind.DIRECTORY:
+            target.mkdir(exist_ok=True)
+            continue
+        if entry.kind == EntryKind.SYMLINK and entry.target is not None:
+            if target.is_symlink() or target.is_file():
+                target.unlink()
+            os.symlink(entry.target, target)
+            continue
+        if (
+            writer.blobs is not None
+            and entry.digest is not None
+            and entry.data is not None
+            and not templating.is_hook_file(target)
+        ):
+            name = BlobStore.blob_name(entry.digest, entry.mode is not None)
+            if not writer.blobs.path(name).exists():
+                writer.blobs.add_bytes(
+                    pack.read(entry.data), entry.mode is not None, entry.digest
+                )
+            writer.link_blob(name, target)
+            copied += entry.data.size
+            if profiler.observers:
+                profiler.copied(target, entry.data.size)
+            continue
+        if contents is None and entry.data is not None:
+            contents = pack.read(entry.data)
+        if contents is None:
+            continue
+
+        writer.write_bytes(target, contents)
+        if entry.mode is not None:
+            os.chmod(target, entry.mode)
+        copied += len(contents)
+        if profiler.observers:
+            profiler.copied(target, len(contents))
+    return copied
+
+
+def render_pack(
+    project_name: str,
+    pack_path: Path,
+    destination: Path,
+    prompt_if_duplicates: bool = True,
+    profiler: Optional[profiling.Profiler] = None,
+    durability: Durability = Durability.NONE,
+    budgets: Optional[Budgets] = None,
+    links: LinkMode = LinkMode.NONE,
+) -> str:
+    """Render a pack into the destination directory, the same way
+    render_template renders the template it was made from. Returns the name
+    of the template.
+
+    Files are rendered in memory from the memory-mapped pack, and written
+    straight to the destination. Only the hook files are written to a
+    temporary directory, for get_variables to run in.
+    """
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with Pack(pack_path) as pack:
+        header = pack.header
+        with profiler.render(header.template, destination):
+            _render_pack(
+                project_name,
+                pack,
+                destination,
+                prompt_if_duplicates,
+                profiler,
+                durability,
+                budgets,
+                links,
+            )
+    return header.template
+
+
+def _render_pack(
+    project_name: str,
+    pack: Pack,
+    destination: Path,
+    prompt_if_duplicates: bool,
+    profiler: profiling.Profiler,
+    durability: Durability,
+    budgets: Optional[Budgets],
+    links: LinkMode,
+) -> None:
+    profiler.report.durability = durability
+    blobs = BlobStore(links) if links != LinkMode.NONE else None
+    writer = OutputWriter(durability, blobs)
+    toml = pack.header.toml
+    limits = strictest(toml.metadata.budgets, budgets or Budgets())
+    default_variables = {
+        **templating.get_default_variables(project_name=project_name),
+        **global_vars.VARIABLES,
+    }
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        with profiler.phase("get_variables"):
+            hook_directory = Path(tempdir)
+            pack.write_hook_files(hook_directory)
+            python_variables = templating.get_python_variables(
+                temp_directory=hook_directory,
+                project_name=project_name,
+                destination=destination,
+                variables={**default_variables, **toml.variables},
+                budgets=limits,
+                profiler=profiler,
+            )
+
+    variables = {**default_variables, **toml.variables, **python_variables}
+    with profiler.phase("render"):
+        outputs = _render_entries(pack, variables, profiler, limits)
+
+    with profiler.phase("find duplicates"):
+        duplicates = [
+            destination / path
+            for path, entry, _ in outputs
+            if entry.kind != EntryKind.DIRECTORY and (destination / path).exists()
+        ]
+
+    if duplicates and prompt_if_duplicates:
+        templating.confirm_overwrite(duplicates)
+
+    with profiler.phase("copy to destination") as stats:
+        stats.bytes_written = _copy_outputs(
+            pack, outputs, destination, writer, profiler
+        )
+        pack.write_hook_bytecode(destination)
+
+    templating.finish_render(
+        project_name,
+        destination,
+        variables,
+        toml.metadata.templating_excludes,
+        profiler,
+        writer,
+        limits,
+    )
+    if blobs:
+        blobs.record(destination, writer.shared)
@@ -0,0 +1,333 @@
+import contextlib
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence
+
+from pydantic import BaseModel
+from rich.table import Table
+
+from itmpl import events
+from itmpl.durability import Durability
+
+
+class PhaseStats(BaseModel):
+    """Resource usage recorded for a single phase of a render."""
+
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    files_written: int = 0
+    files_unchanged: int = 0
+    sync_calls: int = 0
+    memory_peak: Optional[int] = None
+
+
+class FileStats(BaseModel):
+    """Resource usage recorded for rendering a single file."""
+
+    path: Path
+    wall_time: float = 0.0
+    bytes_read: int = 0
+    bytes_written: int = 0
+    # False if rendering left the file's contents unchanged
+    written: bool = True
+
+
+class ProfileReport(BaseModel):
+    """A full profiling report for a render."""
+
+    phases: List[PhaseStats] = []
+    files: List[FileStats] = []
+    durability: Durability = Durability.NONE
+
+    @property
+    def total_wall_time(self) -> float:
+        return sum(phase.wall_time for phase in self.phases)
+
+    @property
+    def total_cpu_time(self) -> float:
+        return sum(phase.cpu_time for phase in self.phases)
+
+
+class Profiler:
+    """Record wall time, CPU time, bytes read and written and memory peaks for
+    each phase of a render, and send render events to observers.
+
+    A disabled profiler still hands out stats objects, so callers can record
+    into them unconditionally, but nothing is kept. Nothing is timed either,
+    unless there are observers to send events to.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        observers: Sequence[events.RenderObserver] = (),
+    ) -> None:
+        self.enabled = enabled
+        self.observers = list(observers)
+        self.report = ProfileReport()
+        self._current_phase: Optional[PhaseStats] = None
+        self._current_render: Optional[events.RenderFinished] = None
+        self._started_tracemalloc = False
+        # Files may be rendered from several threads by the async renderer
+        self._lock = threading.Lock()
+
+    @property
+    def timed(self) -> bool:
+        return self.enabled or bool(self.observers)
+
+    def emit(self, event: events.RenderEvent) -> None:
+        """Send an event to every observer."""
+        if self._current_render is not None and event.template is None:
+            event.template = self._current_render.template
+        for observer in self.observers:
+            observer.on_event(event)
+
+    def start(self) -> None:
+        """Start tracing memory allocations, if not already tracing."""
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self) -> None:
+        """Stop tracing memory allocations, if this profiler started it."""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def __enter__(self) -> "Profiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @contextlib.contextmanager
+    def render(
+        self,
+        template: str,
+        destination: Path,
+    ) -> Iterator[events.RenderFinished]:
+        """Send events for the start and end of a render. The yielded event
+        is sent when the render finishes, with the files and bytes recorded
+        during the render added to it."""
+        summary = events.RenderFinished(template=template, destination=destination)
+        if not self.observers:
+            yield summary
+            return
+
+        outer_render, self._current_render = self._current_render, summary
+        self.emit(events.RenderStarted(template=template, destination=destination))
+        start = time.perf_counter()
+        try:
+            yield summary
+        except BaseException as e:
+            summary.ok = False
+            summary.error = str(e) or type(e).__name__
+            raise
+        finally:
+            summary.duration = time.perf_counter() - start
+            self._current_render = outer_render
+            self.emit(summary)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[PhaseStats]:
+        """Record a phase. The yielded stats object can be used to record the
+        number of bytes read and written during the phase. Bytes recorded for
+        files within the phase are added to it automatically."""
+        stats = PhaseStats(name=name)
+
+        if not self.timed:
+            yield stats
+            return
+
+        tracing = self.enabled and tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, "reset_peak"):
+            # Python 3.9+. On 3.8, the peak is cumulative across phases.
+            tracemalloc.reset_peak()
+
+        outer_phase, self._current_phase = self._current_phase, stats
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stats
+        finally:
+            stats.wall_time = time.perf_counter() - wall_start
+            stats.cpu_time = time.process_time() - cpu_start
+            if tracing:
+                stats.memory_peak = tracemalloc.get_traced_memory()[1]
+            self._current_phase = outer_phase
+            if self.enabled:
+                self.report.phases.append(stats)
+            if self.observers:
+                self.emit(events.PhaseFinished(phase=name, duration=stats.wall_time))
+
+    @contextlib.contextmanager
+    def file(self, path: Path) -> Iterator[FileStats]:
+        """Record rendering a single file."""
+        stats = FileStats(path=path)
+
+        if not self.timed:
+            yield stats
+            return
+
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.wall_time = time.perf_counter() - start
+            with self._lock:
+                if self.enabled:
+                    self.report.files.append(stats)
+                if self._current_phase is not None:
+                    self._current_phase.bytes_read += stats.bytes_read
+                    self._current_phase.bytes_written += stats.bytes_written
+                    if stats.written:
+                        self._current_phase.files_written += 1
+                    else:
+                        self._current_phase.files_unchanged += 1
+                if self.observers:
+                    self._count_file(stats)
+            if self.observers:
+                self._file_event(stats)
+
+    def _count_file(self, stats: FileStats) -> None:
+        summary = self._current_render
+        if summary is None:
+            return
+        if stats.written:
+            summary.files_rendered += 1
+            summary.bytes_written += stats.bytes_written
+        else:
+            summary.files_skipped += 1
+
+    def _file_event(self, stats: FileStats) -> None:
+        if stats.written:
+            self.emit(
+                events.FileRendered(
+                    path=stats.path,
+                    duration=stats.wall_time,
+                    bytes_read=stats.bytes_read,
+                    bytes_written=stats.bytes_written,
+                )
+            )
+        else:
+            self.emit(events.FileSkipped(path=stats.path, duration=stats.wall_time))
+
+    def copied(self, path: Path, size: int) -> None:
+        """Record a file copied into the destination."""
+        with self._lock:
+            summary = self._current_render
+            if summary is not None:
+                summary.files_copied += 1
+                summary.bytes_written += size
+        self.emit(events.FileCopied(path=path, size=size))
+
+    @contextlib.contextmanager
+    def hook(self, name: str) -> Iterator[None]:
+        """Send events for the start and end of running an .itmpl.py hook."""
+        if not self.observers:
+            yield
+            return
+
+        self.emit(events.HookStarted(hook=name))
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.emit(
+                events.HookFinished(
+                    hook=name, duration=time.perf_counter() - start, ok=ok
+                )
+            )
+
+
+def format_bytes(num: Optional[int]) -> str:
+    """Format a number of bytes for people to read, e.g. 1.5 MiB, or - if it
+    is None."""
+    if num is None:
+        return "-"
+
+    size = float(num)
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def construct_table_from_report(report: ProfileReport, slowest: int = 10) -> Table:
+    """Construct a Rich table summarising a profiling report."""
+    table = Table(
+        title=f"Durability: {report.durability.value}",
+        show_header=True,
+        header_style="bold",
+        show_footer=True,
+    )
+    table.add_column("Phase", "Total", justify="left", header_style="blue")
+    table.add_column("Wall (s)", f"{report.total_wall_time:.3f}", justify="right")
+    table.add_column("CPU (s)", f"{report.total_cpu_time:.3f}", justify="right")
+    table.add_column(
+        "Read",
+        format_bytes(sum(phase.bytes_read for phase in report.phases)),
+        justify="right",
+    )
+    table.add_column(
+        "Written",
+        format_bytes(sum(phase.bytes_written for phase in report.phases)),
+        justify="right",
+    )
+    table.add_column(
+        "Files written",
+        str(sum(phase.files_written for phase in report.phases)),
+        justify="right",
+    )
+    table.add_column(
+        "Unchanged",
+        str(sum(phase.files_unchanged for phase in report.phases)),
+        justify="right",
+    )
+    table.add_column("Memory peak", justify="right")
+
+    for phase in report.phases:
+        name = phase.name
+        if phase.sync_calls:
+            name = f"{name} ({phase.sync_calls} sync calls)"
+        table.add_row(
+            name,
+            f"{phase.wall_time:.3f}",
+            f"{phase.cpu_time:.3f}",
+            format_bytes(phase.bytes_read),
+            format_bytes(phase.bytes_written),
+            str(phase.files_written),
+            str(phase.files_unchanged),
+            format_bytes(phase.memory_peak),
+        )
+
+    if report.files and slowest:
+        table.add_section()
+        files = sorted(report.files, key=lambda f: f.wall_time, reverse=True)
+        for file in files[:slowest]:
+            table.add_row(
+                f"  {file.path}",
+                f"{file.wall_time:.3f}",
+                "",
+                format_bytes(file.bytes_read),
+                format_bytes(file.bytes_written),
+                "",
+                "",
+                "",
+            )
+
+    return table
+
+
+def write_report(report: ProfileReport, path: Path) -> None:
+    """Write a profiling report to a JSON file."""
+    path.write_text(report.json(indent=4), encoding="utf-8")
@@ -0,0 +1,124 @@
+"""Full-text search over template metadata.
+
+Each template's name, `template_description`, `template_requirements` and
+variable names, merged with those of the templates it extends, are split into
+lowercase terms, weighted by where they appear.
+The terms are stored with each template in the template index, along with an
+inverted index from each term to the templates containing it. Both are updated
+whenever the template index is, so searching only reads the stored indexes and
+never parses a `.itmpl.toml`.
+"""
+import bisect
+import math
+import re
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+from itmpl.metadata import ItmplToml
+
+# Terms in some fields say more about a template than others
+NAME_WEIGHT = 3.0
+REQUIREMENT_WEIGHT = 2.0
+VARIABLE_WEIGHT = 1.5
+DESCRIPTION_WEIGHT = 1.0
+
+# How much a query term is worth when it is only a prefix of a term
+PREFIX_FACTOR = 0.5
+
+TERM_REGEX = re.compile(r"[a-z0-9]+")
+
+# term -> {template name: weight}
+Postings = Dict[str, Dict[str, float]]
+
+
+class SearchResult(NamedTuple):
+    name: str
+    score: float
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric terms."""
+    return TERM_REGEX.findall(text.lower())
+
+
+def template_terms(name: str, toml: ItmplToml) -> Dict[str, float]:
+    """The weighted terms of a template. A term appearing in several fields
+    takes the highest weight."""
+    terms: Dict[str, float] = {}
+
+    def add(text: str, weight: float) -> None:
+        for term in tokenize(text):
+            terms[term] = max(terms.get(term, 0.0), weight)
+
+    add(name, NAME_WEIGHT)
+    for requirement in toml.metadata.template_requirements:
+        add(requirement, REQUIREMENT_WEIGHT)
+    for variable in toml.variables:
+        add(variable, VARIABLE_WEIGHT)
+    add(toml.metadata.template_description or "", DESCRIPTION_WEIGHT)
+    return terms
+
+
+def add_postings(postings: Postings, name: str, terms: Dict[str, float]) -> None:
+    """Add a template's terms to an inverted index."""
+    for term, weight in terms.items():
+        postings.setdefault(term, {})[name] = weight
+
+
+def remove_postings(postings: Postings, name: str, terms: Iterable[str]) -> None:
+    """Remove a template's terms from an inverted index."""
+    for term in terms:
+        templates = postings.get(term)
+        if templates is None:
+            continue
+        templates.pop(name, None)
+        if not templates:
+            del postings[term]
+
+
+def _matching_terms(
+    vocabulary: List[str],
+    query_term: str,
+) -> Iterable[Tuple[str, float]]:
+    """Find the terms in a sorted vocabulary that start with a query term,
+    with how much each match is worth."""
+    start = bisect.bisect_left(vocabulary, query_term)
+    for term in vocabulary[start:]:
+        if not term.startswith(query_term):
+            break
+        yield term, 1.0 if term == query_term else PREFIX_FACTOR
+
+
+def rank(postings: Postings, query: str) -> List[SearchResult]:
+    """Rank the templates in an inverted index against a query. Every query
+    term must match a term of the template, or be a prefix of one. Terms that
+    few templates have count for more."""
+    query_terms = tokenize(query)
+    if not query_terms:
+        return []
+
+    vocabulary = sorted(postings)
+    template_count = len({name for names in postings.values() for name in names})
+    scores: Dict[str, float] = {}
+    for i, query_term in enumerate(query_terms):
+        term_scores: Dict[str, float] = {}
+        for term, factor in _matching_terms(vocabulary, query_term):
+            templates = postings[term]
+            idf = math.log(1 + template_count / len(templates))
+            for name, weight in templates.items():
+                term_scores[name] = max(
+                    term_scores.get(name, 0.0), weight * idf * factor
+                )
+
+        if i == 0:
+            scores = term_scores
+        else:
+            scores = {
+                name: score + term_scores[name]
+                for name, score in scores.items()
+                if name in term_scores
+            }
+
+    return sorted(
+        (SearchResult(name, score) for name, score in scores.items()),
+        key=lambda result: (-result.score, result.name),
+    )
@@ -0,0 +1,241 @@
+"""Run the steps of a post script concurrently, respecting their dependencies.
+
+Example usage in a `.itmpl.py` file:
+
+```python
+from itmpl.tasks import TaskGraph
+
+def post_script(project_name, final_directory, variables):
+    graph = TaskGraph(cwd=final_directory)
+    graph.add("install", ["poetry", "install"])
+    graph.add("hooks", ["pre-commit", "install"], depends_on=["install"])
+    graph.add("git", ["git", "init"])
+    graph.run()
+```
+"""
+import asyncio
+import enum
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel
+from rich import print
+from rich.markup import escape
+from rich.table import Table
+
+
+class TaskStatus(str, enum.Enum):
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+class TaskResult(BaseModel):
+    """The outcome of running a task."""
+
+    name: str
+    status: TaskStatus
+    duration: float = 0.0
+    returncode: Optional[int] = None
+    value: Any = None
+    error: Optional[str] = None
+
+
+class TaskError(Exception):
+    """Exception raised when one or more tasks fail."""
+
+    def __init__(self, results: Dict[str, TaskResult]) -> None:
+        self.results = results
+        failed = [r for r in results.values() if r.status == TaskStatus.FAILED]
+        super().__init__(
+            "; ".join(f"task {r.name!r} failed: {r.error}" for r in failed),
+        )
+
+
+class Task:
+    """A step in a task graph. Either runs a command as a subprocess, or calls
+    a function in a worker thread."""
+
+    def __init__(
+        self,
+        name: str,
+        command: Optional[List[str]] = None,
+        function: Optional[Callable[[], Any]] = None,
+        depends_on: Iterable[str] = (),
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+        stream: bool = True,
+    ) -> None:
+        if (command is None) == (function is None):
+            raise ValueError(f"Task {name!r} needs exactly one of command or function")
+
+        self.name = name
+        self.command = command
+        self.function = function
+        self.depends_on = list(depends_on)
+        self.cwd = cwd
+        self.env = env
+        self.stream = stream
+
+    async def _run_command(self) -> int:
+        assert self.command is not None
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            cwd=self.cwd,
+            env={**os.environ, **self.env} if self.env else None,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+        assert process.stdout is not None
+        async for line in process.stdout:
+            if self.stream:
+                text = line.decode(errors="replace").rstrip()
+                print(f"[dim]\\[{escape(self.name)}][/dim] {escape(text)}")
+
+        return await process.wait()
+
+    async def run(self) -> TaskResult:
+        start = time.perf_counter()
+        try:
+            if self.function is not None:
+                loop = asyncio.get_running_loop()
+                value = await loop.run_in_executor(None, self.function)
+                return TaskResult(
+                    name=self.name,
+                    status=TaskStatus.SUCCEEDED,
+                    duration=time.perf_counter() - start,
+                    value=value,
+                )
+
+            returncode = await self._run_command()
+        except Exception as e:
+            return TaskResult(
+                name=self.name,
+                status=TaskStatus.FAILED,
+                duration=time.perf_counter() - start,
+                error=str(e) or type(e).__name__,
+            )
+
+        return TaskResult(
+            name=self.name,
+            status=TaskStatus.SUCCEEDED if returncode == 0 else TaskStatus.FAILED,
+            duration=time.perf_counter() - start,
+            returncode=returncode,
+            error=None if returncode == 0 else f"exited with code {returncode}",
+        )
+
+
+class TaskGraph:
+    """A set of tasks with dependencies between them. Tasks whose dependencies
+    have all succeeded are run concurrently. If a task fails, the tasks that
+    depend on it are skipped, but independent tasks still run."""
+
+    def __init__(self, cwd: Optional[Path] = None, report: bool = True) -> None:
+        self.cwd = cwd
+        self.report = report
+        self.tasks: Dict[str, Task] = {}
+
+    def add(
+        self,
+        name: str,
+        command: Optional[List[str]] = None,
+        function: Optional[Callable[[], Any]] = None,
+        depends_on: Iterable[str] = (),
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+        stream: bool = True,
+    ) -> Task:
+        """Add a task to the graph. Commands run in the graph's working
+        directory unless cwd is given."""
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task {name!r}")
+
+        task = Task(
+            name,
+            command=command,
+            function=function,
+            depends_on=depends_on,
+            cwd=cwd or self.cwd,
+            env=env,
+            stream=stream,
+        )
+        self.tasks[name] = task
+        return task
+
+    def _validate(self) -> None:
+        for task in self.tasks.values():
+            for dependency in task.depends_on:
+                if dependency not in self.tasks:
+                    raise ValueError(
+                        f"Task {task.name!r} depends on unknown task {dependency!r}"
+                    )
+
+        visited: Dict[str, bool] = {}
+
+        def visit(name: str, path: List[str]) -> None:
+            if visited.get(name):
+                return
+            if name in path:
+                cycle = " -> ".join([*path[path.index(name) :], name])
+                raise ValueError(f"Dependency cycle between tasks: {cycle}")
+            for dependency in self.tasks[name].depends_on:
+                visit(dependency, [*path, name])
+            visited[name] = True
+
+        for name in self.tasks:
+            visit(name, [])
+
+    async def run_async(self) -> Dict[str, TaskResult]:
+        """Run every task in the graph. Returns the result of each task, and
+        raises a TaskError if any failed."""
+        self._validate()
+        results: Dict[str, "asyncio.Future[TaskResult]"] = {}
+
+        async def run_task(task: Task) -> TaskResult:
+            dependencies = [await results[d] for d in task.depends_on]
+            if any(d.status != TaskStatus.SUCCEEDED for d in dependencies):
+                return TaskResult(name=task.name, status=TaskStatus.SKIPPED)
+            return await task.run()
+
+        for task in self.tasks.values():
+            results[task.name] = asyncio.ensure_future(run_task(task))
+
+        completed = {name: await result for name, result in results.items()}
+
+        if self.report:
+            print(construct_table_from_results(completed.values()))
+
+        if any(r.status == TaskStatus.FAILED for r in completed.values()):
+            raise TaskError(completed)
+
+        return completed
+
+    def run(self) -> Dict[str, TaskResult]:
+        """Run every task in the graph in a new event loop. See run_async."""
+        return asyncio.run(self.run_async())
+
+
+def construct_table_from_results(results: Iterable[TaskResult]) -> Table:
+    """Construct a Rich table from a list of task results."""
+    table = Table(show_header=True, header_style="bold")
+    table.add_column("Task", justify="left", no_wrap=True, header_style="blue")
+    table.add_column("Status")
+    table.add_column("Duration (s)", justify="right")
+
+    colours = {
+        TaskStatus.SUCCEEDED: "green",
+        TaskStatus.FAILED: "red",
+        TaskStatus.SKIPPED: "yellow",
+    }
+    for result in results:
+        colour = colours[result.status]
+        table.add_row(
+            result.name,
+            f"[{colour}]{result.status.value}[/{colour}]",
+            f"{result.duration:.2f}",
+        )
+
+    return table
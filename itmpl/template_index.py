@@ -0,0 +1,208 @@
+"""A cached index of the templates in each template root.
+
+Listing a template root and reading every `.itmpl.toml` in it can be slow,
+particularly on network mounts. The index of each root is stored in
+`INDEX_DIR`, and only rebuilt when the root directory's mtime, or the mtime of
+one of its `.itmpl.toml` files, has changed. When it is rebuilt, only the
+`.itmpl.toml` files that changed are read again.
+
+The index also holds the search terms of each template, and an inverted index
+of them for `itmpl search`, and the resolved layers and merged metadata of
+templates that extend others. The search terms of a template that extends
+others come from its merged metadata, and are updated whenever it is resolved
+again.
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from itmpl import global_vars, metadata, search
+from itmpl.metadata import ItmplToml
+
+INDEX_DIR: Path = global_vars.APP_DIR / "index"
+
+# Bumped whenever the format of the stored index changes
+INDEX_VERSION = 8
+
+# An index isn't stored if anything in it was modified more recently than
+# this, as a second change within the filesystem's timestamp granularity
+# would leave the mtime the same
+RACY_WINDOW_NS = 2_000_000_000
+
+
+class IndexedTemplate(BaseModel):
+    """A template in a root's index."""
+
+    path: Path
+    # None if the template has no .itmpl.toml
+    toml_mtime_ns: Optional[int] = None
+    toml: ItmplToml = ItmplToml()
+    # The weighted search terms of the template, from its merged metadata once
+    # it has been resolved
+    terms: Dict[str, float] = {}
+    # For a template that extends others, its layers, base first, and merged
+    # .itmpl.toml, as resolved against the template roots with roots_key
+    resolved_key: Optional[str] = None
+    layers: List[Path] = []
+    merged: Optional[ItmplToml] = None
+
+
+class RootIndex(BaseModel):
+    """The templates in a template root, as of the root's mtime."""
+
+    version: int = INDEX_VERSION
+    root: Path
+    mtime_ns: int
+    templates: Dict[str, IndexedTemplate] = {}
+    # Each search term, and the templates it appears in with its weight
+    postings: search.Postings = {}
+
+
+def _toml_mtime_ns(template_path: Path) -> Optional[int]:
+    try:
+        return (template_path / ".itmpl.toml").stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _index_path(root: Path) -> Path:
+    digest = hashlib.sha256(str(root.resolve()).encode()).hexdigest()[:16]
+    return INDEX_DIR / f"{digest}.json"
+
+
+def scan_root(root: Path, previous: Optional[RootIndex] = None) -> RootIndex:
+    """Build the index of a template root by reading every template in it.
+    Templates in a previous index of the root whose .itmpl.toml hasn't changed
+    are reused without reading it again."""
+    if previous is not None and (
+        previous.version != INDEX_VERSION or previous.root != root
+    ):
+        previous = None
+
+    index = RootIndex(root=root, mtime_ns=root.stat().st_mtime_ns)
+    if previous is not None:
+        index.postings = {
+            term: dict(templates) for term, templates in previous.postings.items()
+        }
+    for path in root.iterdir():
+        if not path.is_dir():
+            continue
+
+        toml_mtime_ns = _toml_mtime_ns(path)
+        old = previous.templates.get(path.name) if previous is not None else None
+        if old is not None and old.toml_mtime_ns == toml_mtime_ns:
+            index.templates[path.name] = old
+            continue
+
+        toml = metadata.read_itmpl_toml(path / ".itmpl.toml")
+        index.templates[path.name] = IndexedTemplate(
+            path=path,
+            toml_mtime_ns=toml_mtime_ns,
+            toml=toml,
+            terms=search.template_terms(path.name, toml),
+        )
+        if old is not None:
+            search.remove_postings(index.postings, path.name, old.terms)
+        search.add_postings(index.postings, path.name, index.templates[path.name].terms)
+
+    if previous is not None:
+        for name in previous.templates.keys() - index.templates.keys():
+            search.remove_postings(index.postings, name, previous.templates[name].terms)
+
+    return index
+
+
+def update_terms(index: RootIndex, name: str, terms: Dict[str, float]) -> None:
+    """Replace the search terms of a template in a root's index."""
+    template = index.templates[name]
+    search.remove_postings(index.postings, name, template.terms)
+    template.terms = terms
+    search.add_postings(index.postings, name, terms)
+
+
+def _is_fresh(index: RootIndex, root: Path) -> bool:
+    if index.version != INDEX_VERSION or index.root != root:
+        return False
+    if index.mtime_ns != root.stat().st_mtime_ns:
+        return False
+    return all(
+        _toml_mtime_ns(template.path) == template.toml_mtime_ns
+        for template in index.templates.values()
+    )
+
+
+def _is_racy(index: RootIndex) -> bool:
+    cutoff = time.time_ns() - RACY_WINDOW_NS
+    return index.mtime_ns > cutoff or any(
+        template.toml_mtime_ns is not None and template.toml_mtime_ns > cutoff
+        for template in index.templates.values()
+    )
+
+
+def _read_index(root: Path) -> Optional[RootIndex]:
+    try:
+        return RootIndex.parse_file(_index_path(root))
+    except (OSError, ValueError, ValidationError):
+        return None
+
+
+def _write_index(index: RootIndex) -> None:
+    path = _index_path(index.root)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(
+            f".{path.name}.{os.getpid()}.{threading.get_ident()}",
+        )
+        temp_path.write_text(index.json(), encoding="utf-8")
+        os.replace(temp_path, path)
+    except OSError:
+        # The index is only a cache, so carry on without it
+        pass
+
+
+def get_root_index(root: Path) -> RootIndex:
+    """Get the index of a template root, re-scanning it only if it has changed
+    since it was last indexed."""
+    index = _read_index(root)
+    if index is not None and _is_fresh(index, root):
+        return index
+
+    index = scan_root(root, index)
+    if not _is_racy(index):
+        _write_index(index)
+    return index
+
+
+def get_templates_in_root(root: Path) -> Dict[str, Tuple[Path, ItmplToml]]:
+    """Return the templates in a root with their metadata, using the cached
+    index where possible."""
+    return {
+        name: (template.path, template.toml)
+        for name, template in get_root_index(root).templates.items()
+    }
+
+
+def roots_key(indexes: Sequence[RootIndex]) -> str:
+    """Return a key for the templates in a list of roots, which changes when a
+    template is added to or removed from any of them, or its .itmpl.toml
+    changes."""
+    digest = hashlib.sha256()
+    for index in indexes:
+        digest.update(f"{index.root}\0{index.mtime_ns}\n".encode())
+        for name, template in sorted(index.templates.items()):
+            digest.update(f"{name}\0{template.toml_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def save_resolved(changed: Iterable[RootIndex], indexes: Sequence[RootIndex]) -> None:
+    """Store indexes with newly resolved templates, unless anything in the
+    roots they were resolved against is too recent to be sure of."""
+    if any(_is_racy(index) for index in indexes):
+        return
+    for index in changed:
+        _write_index(index)
@@ -6,6 +6,9 @@ from typing import Any, Dict, List, Optional
 
 import typer
 
+from itmpl import config, utils
+from itmpl.tasks import TaskGraph
+
 
 class DependencyManager(Enum):
     POETRY = "poetry"
@@ -44,30 +47,10 @@ def _add_dependencies_poetry(
     dependencies: List[str],
     final_directory: Path,
 ) -> None:
-    print("Adding Poetry dev dependencies...", end=" ", flush=True)
-    subprocess.run(
-        [
-            "poetry",
-            "add",
-            "-G",
-            "dev",
-            *dependencies,
-        ],
-        cwd=final_directory,
-        check=True,
-        stdout=subprocess.DEVNULL,
-    )
-    print("done!")
-
-    # Install dependencies
-    print("Installing Poetry dev dependencies...", end=" ", flush=True)
-    subprocess.run(
-        ["poetry", "install"],
-        cwd=final_directory,
-        check=True,
-        stdout=subprocess.DEVNULL,
-    )
-    print("done!")
+    graph = TaskGraph(cwd=final_directory)
+    graph.add("add dev dependencies", ["poetry", "add", "-G", "dev", *dependencies])
+    graph.add("install", ["poetry", "install"], depends_on=["add dev dependencies"])
+    graph.run()
 
 
 def _add_dependencies_requirements(
@@ -75,12 +58,14 @@ def _add_dependencies_requirements(
     final_directory: Path,
 ) -> None:
     print("Adding dependencies...", end=" ", flush=True)
+    wheelhouse = config.read_config().wheelhouse_dir
     subprocess.run(
         [
             sys.executable,
             "-m",
             "pip",
             "install",
+            *utils.wheelhouse_pip_args(wheelhouse),
             *dependencies,
         ],
         cwd=final_directory,
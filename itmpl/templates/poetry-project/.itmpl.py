@@ -1,4 +1,4 @@
-import json
+import shutil
 import subprocess
 import sys
 from pathlib import Path
@@ -7,6 +7,9 @@ from typing import Any, Dict, List, Optional
 import typer
 import yaml
 
+from itmpl import config, utils, virtualenvs
+from itmpl.tasks import TaskGraph
+
 
 def get_variables(
     project_name: str,
@@ -25,73 +28,128 @@ def get_variables(
     }
 
 
-def _add_dev_dependencies(final_directory: Path) -> None:
-    dev_dependencies = final_directory / ".itmpl.requirements.dev.txt"
+def _read_requirements_file(path: Path) -> List[str]:
+    if not path.exists():
+        return []
+    return path.read_text().splitlines()
+
+
+def _read_requirements(final_directory: Path) -> List[str]:
+    return [
+        *_read_requirements_file(final_directory / ".itmpl.requirements.txt"),
+        *_read_requirements_file(final_directory / ".itmpl.requirements.dev.txt"),
+    ]
+
 
-    if not dev_dependencies.exists():
+def _prepare_virtualenv(final_directory: Path, python_version: str) -> None:
+    """Seed the project's virtual environment with a clone of a prebuilt one, or
+    build it from the wheelhouse, so Poetry only has to install what differs
+    from it."""
+    c = config.read_config()
+    venv = final_directory / ".venv"
+
+    if not (c.golden_virtualenvs or c.wheelhouse_dir) or venv.exists():
         return
 
-    print("Adding dev dependencies...", end=" ", flush=True)
-    subprocess.run(
-        [
-            "poetry",
-            "add",
-            "-G",
-            "dev",
-            *dev_dependencies.read_text().splitlines(),
-        ],
-        cwd=final_directory,
-        check=True,
-        stdout=subprocess.DEVNULL,
-    )
+    # The virtualenv is built with iTmpl's interpreter, so it can only be used
+    # if that satisfies the project's Python version constraint
+    major, minor = (int(part) for part in python_version.split(".")[:2])
+    if sys.version_info[0] != major or sys.version_info[1] < minor:
+        return
+
+    print("Preparing virtual environment...", end=" ", flush=True)
+    requirements = _read_requirements(final_directory)
+    try:
+        if c.golden_virtualenvs:
+            golden = virtualenvs.get_golden_virtualenv(
+                "poetry-project",
+                requirements,
+                wheelhouse=c.wheelhouse_dir,
+            )
+            virtualenvs.clone_virtualenv(
+                golden, venv, hardlink=c.golden_virtualenv_hardlinks
+            )
+        else:
+            virtualenvs.create_virtualenv(
+                venv, requirements, wheelhouse=c.wheelhouse_dir
+            )
+    except Exception:
+        # Don't leave Poetry a half-built environment
+        shutil.rmtree(venv, ignore_errors=True)
+        raise
     print("done!")
 
 
-def _add_dependencies(final_directory: Path) -> None:
-    dependencies = final_directory / ".itmpl.requirements.txt"
+def _try_prepare_virtualenv(final_directory: Path, python_version: str) -> None:
+    try:
+        _prepare_virtualenv(final_directory, python_version)
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print(f"failed ({e}), continuing without it.")
+
+
+def _pin_requirements(requirements: List[str]) -> List[str]:
+    """Pin requirements to the versions in the wheelhouse, if there is one. The
+    virtual environment was built from the wheelhouse, so Poetry then finds
+    them already installed rather than downloading them again."""
+    wheelhouse = config.read_config().wheelhouse_dir
+    if wheelhouse is None:
+        return requirements
+    return utils.pin_to_wheelhouse(requirements, wheelhouse)
+
 
-    if not dependencies.exists():
+def _ensure_poetry() -> None:
+    """Install Poetry if it is not already installed."""
+    try:
+        subprocess.run(["poetry", "--version"], check=True, stdout=subprocess.DEVNULL)
         return
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        pass
 
-    print("Adding dependencies...", end=" ", flush=True)
+    print("Poetry is not installed, installing Poetry...", end=" ", flush=True)
+    wheelhouse = config.read_config().wheelhouse_dir
     subprocess.run(
         [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            *utils.wheelhouse_pip_args(wheelhouse),
             "poetry",
-            "add",
-            *dependencies.read_text().splitlines(),
         ],
-        cwd=final_directory,
         check=True,
         stdout=subprocess.DEVNULL,
     )
     print("done!")
 
 
-def _get_package_versions(package_names: List[str], cwd: Path) -> Dict[str, str]:
-    """Get installed package versions."""
-    installed_packages_json = subprocess.run(
-        ["poetry", "run", "pip", "list", "--format=json"],
-        capture_output=True,
-        text=True,
-        check=True,
-        cwd=cwd,
-    ).stdout
+def _get_virtualenv(cwd: Path) -> Path:
+    """Get the path to the project's virtual environment."""
+    in_project_virtualenv = cwd / ".venv"
+    if in_project_virtualenv.is_dir():
+        return in_project_virtualenv
 
-    installed_packages = json.loads(installed_packages_json)
+    return Path(
+        subprocess.run(
+            ["poetry", "env", "info", "--path"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=cwd,
+        ).stdout.strip()
+    )
 
-    return {
-        package["name"]: package["version"]
-        for package in installed_packages
-        if package["name"] in package_names
-    }
+
+def _get_package_versions(package_names: List[str], cwd: Path) -> Dict[str, str]:
+    """Get installed package versions."""
+    return utils.get_virtualenv_package_versions(_get_virtualenv(cwd), package_names)
 
 
-def _get_pre_commit_config_package_versions(directory: Path) -> Dict[str, str]:
-    """Get package versions from the pre-commit config file."""
+def _get_pre_commit_config_package_names(directory: Path) -> List[str]:
+    """Get the names of the packages used in the pre-commit config file."""
     pre_commit_config = directory / ".pre-commit-config.yaml"
 
     if not pre_commit_config.exists():
-        return {}
+        return []
 
     with pre_commit_config.open() as f:
         config = yaml.safe_load(f)
@@ -102,7 +160,7 @@ def _get_pre_commit_config_package_versions(directory: Path) -> Dict[str, str]:
         for hook in repo["hooks"]:
             package_names.append(hook["name"])
 
-    return _get_package_versions(package_names, directory)
+    return package_names
 
 
 def post_script(
@@ -116,35 +174,53 @@ def post_script(
     except (subprocess.CalledProcessError, FileNotFoundError):
         pass
 
-    # Check if poetry is installed
-    try:
-        subprocess.run(["poetry", "--version"], check=True, stdout=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        # Install poetry
-        print("Poetry is not installed, installing Poetry...", end=" ", flush=True)
-        subprocess.run(
-            [sys.executable, "-m", "pip", "install", "poetry"],
-            check=True,
-            stdout=subprocess.DEVNULL,
-        )
-        print("done!")
+    # Steps that don't depend on each other run concurrently
+    graph = TaskGraph(cwd=final_directory)
+    graph.add("poetry", function=_ensure_poetry)
+    graph.add(
+        "virtualenv",
+        function=lambda: _try_prepare_virtualenv(
+            final_directory,
+            variables["python_version"],
+        ),
+    )
+    graph.add(
+        "pre-commit config",
+        function=lambda: _get_pre_commit_config_package_names(final_directory),
+    )
 
-    # Add dependencies
-    _add_dependencies(final_directory)
-    _add_dev_dependencies(final_directory)
+    # Each poetry add modifies pyproject.toml, so they run one after the other
+    previous_steps = ["poetry", "virtualenv"]
+    dependencies = _pin_requirements(
+        _read_requirements_file(final_directory / ".itmpl.requirements.txt"),
+    )
+    if dependencies:
+        graph.add(
+            "add dependencies",
+            ["poetry", "add", *dependencies],
+            depends_on=previous_steps,
+        )
+        previous_steps = ["add dependencies"]
 
-    # Install dependencies
-    print("Installing dependencies...", end=" ", flush=True)
-    subprocess.run(
-        ["poetry", "install"],
-        cwd=final_directory,
-        check=True,
-        stdout=subprocess.DEVNULL,
+    dev_dependencies = _pin_requirements(
+        _read_requirements_file(final_directory / ".itmpl.requirements.dev.txt"),
     )
-    print("done!")
+    if dev_dependencies:
+        graph.add(
+            "add dev dependencies",
+            ["poetry", "add", "-G", "dev", *dev_dependencies],
+            depends_on=previous_steps,
+        )
+        previous_steps = ["add dev dependencies"]
+
+    graph.add("install", ["poetry", "install"], depends_on=previous_steps)
+    results = graph.run()
 
     # Get package versions of packages used in pre-commit config
-    package_versions = _get_pre_commit_config_package_versions(final_directory)
+    package_versions = _get_package_versions(
+        results["pre-commit config"].value,
+        final_directory,
+    )
 
     # Add package versions to variables
     version_template_strings = {
@@ -1,15 +1,48 @@
+import asyncio
+import contextlib
+import functools
+import hashlib
+import inspect
+import io
 import os
 import tempfile
 from pathlib import Path
 from types import ModuleType
-from typing import Any, Dict, List, Optional, Tuple
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
 
 import jinja2
+import jinja2.meta
 import typer
 from pydantic import ValidationError
 from rich import print
 
-from itmpl import config, global_vars, metadata, tree_utils, utils
+from itmpl import (
+    config,
+    git_templates,
+    global_vars,
+    ignore,
+    metadata,
+    profiling,
+    search,
+    template_index,
+    tree_utils,
+    utils,
+)
+from itmpl.blobstore import BlobStore, LinkMode
+from itmpl.budgets import BudgetError, Budgets, render_limited, run_limited, strictest
+from itmpl.durability import Durability, OutputWriter
 from itmpl.metadata import ItmplToml
 
 
@@ -37,6 +70,101 @@ class TemplatingException(Exception):
     """Exception raised when there is an error with the templating."""
 
 
+# Sources longer than this aren't kept in the compiled template cache, so one
+# large file can't hold on to lots of memory
+MAX_CACHED_TEMPLATE_LENGTH = 64 * 1024
+
+# Imported .itmpl.py modules, keyed by a hash of their source. Disabled by
+# default, as each render normally imports its hooks only once.
+_hook_cache: Optional[Dict[str, ModuleType]] = None
+
+
+def enable_hook_cache() -> None:
+    """Reuse imported .itmpl.py modules across renders when their source is
+    unchanged. Useful for long-running processes that render many times."""
+    global _hook_cache
+    if _hook_cache is None:
+        _hook_cache = {}
+
+
+# Compiled templates stored by `itmpl check`, so later processes can load them
+# rather than compiling again
+COMPILED_DIR: Path = global_vars.APP_DIR / "compiled"
+
+
+@functools.lru_cache(maxsize=None)
+def jinja_environment(undefined: Type[jinja2.Undefined]) -> jinja2.Environment:
+    """Return the Jinja environment templates are rendered with, shared by
+    every render using the same Undefined type."""
+    # The same settings jinja2.Template uses, apart from keep_trailing_newline
+    return jinja2.Environment(undefined=undefined, keep_trailing_newline=True)
+
+
+def _bucket(
+    environment: jinja2.Environment,
+    source: str,
+) -> Tuple[jinja2.FileSystemBytecodeCache, jinja2.bccache.Bucket]:
+    cache = jinja2.FileSystemBytecodeCache(str(COMPILED_DIR), "%s.jinja")
+    name = hashlib.sha256(source.encode("utf-8", "surrogatepass")).hexdigest()
+    return cache, cache.get_bucket(environment, name, None, source)
+
+
+def _compile(source: str, undefined: Type[jinja2.Undefined]) -> jinja2.Template:
+    environment = jinja_environment(undefined)
+    _, bucket = _bucket(environment, source)
+    code = bucket.code
+    if code is None:
+        code = environment.compile(source)
+    return environment.template_class.from_code(
+        environment, code, environment.make_globals(None)
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_cached(source: str, undefined: Type[jinja2.Undefined]) -> jinja2.Template:
+    return _compile(source, undefined)
+
+
+def compile_cache_info() -> Any:
+    """Statistics for the cache of compiled templates: hits, misses, maxsize
+    and currsize."""
+    return _compile_cached.cache_info()
+
+
+def clear_compile_cache() -> None:
+    """Forget every compiled template, so the next renders compile them
+    again."""
+    _compile_cached.cache_clear()
+
+
+def compile_template(
+    source: str,
+    undefined: Type[jinja2.Undefined] = jinja2.Undefined,
+) -> jinja2.Template:
+    """Compile a Jinja template. Compiled templates are cached, so identical
+    sources, such as the same file across renders, are only compiled once.
+    Templates stored by store_compiled_template are loaded rather than
+    compiled."""
+    if len(source) > MAX_CACHED_TEMPLATE_LENGTH:
+        return _compile(source, undefined)
+    return _compile_cached(source, undefined)
+
+
+def store_compiled_template(source: str) -> jinja2.nodes.Template:
+    """Compile a Jinja template and store the compiled code in COMPILED_DIR,
+    so compile_template can load it in later processes. Returns the parsed
+    template. Raises a jinja2.TemplateSyntaxError if the template is
+    invalid."""
+    environment = jinja_environment(jinja2.Undefined)
+    parsed = environment.parse(source)
+    cache, bucket = _bucket(environment, source)
+    if bucket.code is None:
+        bucket.code = environment.compile(parsed)
+        COMPILED_DIR.mkdir(parents=True, exist_ok=True)
+        cache.set_bucket(bucket)
+    return parsed
+
+
 def get_templates_in_dir(directory: Path) -> Dict[str, Tuple[Path, ItmplToml]]:
     """Return a list of templates in a directory with their descriptions."""
     templates = {}
@@ -50,12 +178,33 @@ def get_templates_in_dir(directory: Path) -> Dict[str, Tuple[Path, ItmplToml]]:
     return templates
 
 
-def get_template_options() -> Dict[str, Tuple[Path, ItmplToml]]:
-    """Return a list of template options and their descriptions."""
+def get_template_roots() -> List[Path]:
+    """Return the directories templates are read from, highest precedence
+    first."""
     c = config.read_config()
-    default_template_options = get_templates_in_dir(global_vars.TEMPLATES_DIR)
-    extra_template_options = get_templates_in_dir(c.extra_templates_dir)
+    repo_roots = []
+    for spec in c.template_repos:
+        try:
+            repo_roots.append(
+                git_templates.get_repo_root(spec, c.git_refresh_interval),
+            )
+        except git_templates.GitTemplateError as e:
+            print(f"[yellow]Skipping template repository {spec}: {e}[/yellow]")
+
+    return [
+        *c.template_dirs,
+        *repo_roots,
+        c.extra_templates_dir,
+        global_vars.TEMPLATES_DIR,
+    ]
 
+
+def _check_duplicates(
+    default_template_options: Dict[str, Tuple[Path, ItmplToml]],
+    extra_template_options: Dict[str, Tuple[Path, ItmplToml]],
+) -> None:
+    """Raise a DuplicateTemplateError if any templates in the
+    extra_templates_dir have the same name as a built-in template."""
     # Find the intersection of the two sets of templates
     duplicate_template_keys = (
         default_template_options.keys() & extra_template_options.keys()
@@ -69,7 +218,195 @@ def get_template_options() -> Dict[str, Tuple[Path, ItmplToml]]:
     if duplicate_templates:
         raise DuplicateTemplateError(duplicate_templates)
 
-    return {**default_template_options, **extra_template_options}
+
+class _TemplateRoots:
+    """The template roots, each indexed at most once, so that every template
+    extending another is resolved without reading the config, the template
+    repositories or the indexes again."""
+
+    def __init__(self, roots: Optional[List[Path]] = None):
+        self.roots = get_template_roots() if roots is None else roots
+        self._indexes: Dict[Path, template_index.RootIndex] = {}
+        self._changed: Dict[Path, template_index.RootIndex] = {}
+        self._key: Optional[str] = None
+
+    def index(self, root: Path) -> template_index.RootIndex:
+        if root not in self._indexes:
+            # Template roots may be on mounts that aren't always available
+            self._indexes[root] = (
+                template_index.get_root_index(root)
+                if root.is_dir()
+                else template_index.RootIndex(root=root, mtime_ns=0)
+            )
+        return self._indexes[root]
+
+    def templates(self, root: Path) -> Dict[str, Tuple[Path, ItmplToml]]:
+        return {
+            name: (template.path, template.toml)
+            for name, template in self.index(root).templates.items()
+        }
+
+    def find_base(
+        self,
+        name: str,
+        exclude: List[Path],
+    ) -> Optional[Tuple[Path, ItmplToml]]:
+        """Find the highest precedence template with a name, skipping the
+        given template directories, so a template can extend one it
+        shadows."""
+        for root in self.roots:
+            template = self.index(root).templates.get(name)
+            if template is not None and template.path.resolve() not in exclude:
+                return template.path, template.toml
+        return None
+
+    def resolve(
+        self,
+        template_path: Path,
+        toml: ItmplToml,
+    ) -> Tuple[List[Path], ItmplToml]:
+        """Resolve a template, reusing the layers stored in its root's index
+        if no template in any root has changed since. Otherwise its search
+        terms are updated from the newly merged metadata."""
+        if not toml.metadata.extends:
+            return [template_path], toml
+
+        indexed = None
+        if template_path.parent in self.roots:
+            index = self.index(template_path.parent)
+            indexed = index.templates.get(template_path.name)
+        if indexed is None or indexed.path != template_path:
+            return _resolve_layers(template_path, toml, self.find_base)
+
+        if self._key is None:
+            self._key = template_index.roots_key(
+                [self.index(root) for root in self.roots],
+            )
+        if indexed.resolved_key == self._key and indexed.merged is not None:
+            return list(indexed.layers), indexed.merged
+
+        self._changed[template_path.parent] = index
+        try:
+            layers, merged = _resolve_layers(template_path, toml, self.find_base)
+        except TemplatingException:
+            indexed.resolved_key = None
+            indexed.merged = None
+            template_index.update_terms(
+                index,
+                template_path.name,
+                search.template_terms(template_path.name, toml),
+            )
+            raise
+
+        indexed.resolved_key = self._key
+        indexed.layers = layers
+        indexed.merged = merged
+        template_index.update_terms(
+            index, template_path.name, search.template_terms(template_path.name, merged)
+        )
+        return layers, merged
+
+    def merge_extends(self, path: Path, toml: ItmplToml) -> ItmplToml:
+        """Combine the metadata of a template with the templates it
+        extends."""
+        try:
+            return self.resolve(path, toml)[1]
+        except TemplatingException:
+            # Reported when the template is rendered
+            return toml
+
+    def save(self) -> None:
+        """Store the templates resolved since the indexes were read."""
+        if self._changed:
+            template_index.save_resolved(
+                self._changed.values(),
+                [self.index(root) for root in self.roots],
+            )
+            self._changed.clear()
+
+
+def get_template_options() -> Dict[str, Tuple[Path, ItmplToml]]:
+    """Return a list of template options and their descriptions.
+
+    Templates in the template_dirs and template_repos config options shadow
+    templates with the same name in later template roots, the
+    extra_templates_dir and the built-in templates. Templates in the
+    extra_templates_dir with the same name as a built-in template are an error.
+    """
+    roots = _TemplateRoots()
+    default_template_options = roots.templates(roots.roots[-1])
+    extra_template_options = roots.templates(roots.roots[-2])
+    _check_duplicates(default_template_options, extra_template_options)
+
+    template_options = {**default_template_options, **extra_template_options}
+    # The configured roots come before the extra_templates_dir and the built-in
+    # templates, highest precedence first
+    for root in reversed(roots.roots[:-2]):
+        template_options.update(roots.templates(root))
+
+    merged = {
+        name: (path, roots.merge_extends(path, toml))
+        for name, (path, toml) in template_options.items()
+    }
+    roots.save()
+    return merged
+
+
+def iter_template_options() -> Iterator[Tuple[str, Path, ItmplToml]]:
+    """Yield the same templates as get_template_options, one template root at
+    a time in order of precedence, so the first templates are available before
+    every root has been read. Templates shadowed by an earlier root are
+    skipped.
+
+    Duplicate templates raise a DuplicateTemplateError when this is called,
+    before anything is yielded, so callers can report them before writing any
+    output.
+    """
+    roots = _TemplateRoots()
+    default_template_options = roots.templates(roots.roots[-1])
+    extra_template_options = roots.templates(roots.roots[-2])
+    _check_duplicates(default_template_options, extra_template_options)
+    return _iter_template_options(roots)
+
+
+def _iter_template_options(
+    roots: _TemplateRoots,
+) -> Iterator[Tuple[str, Path, ItmplToml]]:
+    seen: Set[str] = set()
+    for root in roots.roots:
+        for name, (path, toml) in roots.templates(root).items():
+            if name in seen:
+                continue
+            seen.add(name)
+            yield name, path, roots.merge_extends(path, toml)
+    roots.save()
+
+
+def search_templates(query: str) -> List[Tuple[search.SearchResult, Path, ItmplToml]]:
+    """Search the templates in every template root, best match first, by their
+    metadata merged with the templates they extend. Only the stored template
+    indexes are read. Templates shadowed by an earlier root are left out."""
+    roots = _TemplateRoots()
+    postings: search.Postings = {}
+    templates: Dict[str, Tuple[Path, ItmplToml]] = {}
+    for root in roots.roots:
+        index = roots.index(root)
+        # Merging updates the terms of templates whose bases have changed
+        current = {
+            name: (template.path, roots.merge_extends(template.path, template.toml))
+            for name, template in index.templates.items()
+            if name not in templates
+        }
+        for term, names in index.postings.items():
+            for name, weight in names.items():
+                if name in current:
+                    postings.setdefault(term, {})[name] = weight
+        templates.update(current)
+    roots.save()
+
+    return [
+        (result, *templates[result.name]) for result in search.rank(postings, query)
+    ]
 
 
 def _setup_itmpl_module(directory: Path) -> Optional[ModuleType]:
@@ -80,7 +417,13 @@ def _setup_itmpl_module(directory: Path) -> Optional[ModuleType]:
         return None
 
     try:
-        return utils.import_external_module(itmpl_file)
+        if _hook_cache is None:
+            return utils.import_external_module(itmpl_file)
+
+        key = hashlib.sha256(itmpl_file.read_bytes()).hexdigest()
+        if key not in _hook_cache:
+            _hook_cache[key] = utils.import_external_module(itmpl_file)
+        return _hook_cache[key]
     except Exception as e:
         raise TemplatingException(f"Error when importing .itmpl.py: {e}") from e
 
@@ -94,16 +437,145 @@ def get_default_variables(project_name: str) -> Dict[str, Any]:
     }
 
 
-def get_toml_variables(temp_directory: Path) -> Dict[str, Any]:
-    """Get extra variables from the .itmpl.toml file in the template directory."""
+def _read_toml(directory: Path) -> ItmplToml:
     try:
-        meta = metadata.read_itmpl_toml(temp_directory / ".itmpl.toml")
+        return metadata.read_itmpl_toml(directory / ".itmpl.toml")
     except ValidationError as e:
         raise TemplatingException(f"Error when validating .itmpl.toml: {e}") from e
     except Exception as e:
         raise TemplatingException(f"Error when reading .itmpl.toml: {e}") from e
 
-    return meta.variables
+
+def get_toml_variables(temp_directory: Path) -> Dict[str, Any]:
+    """Get extra variables from the .itmpl.toml file in the template directory."""
+    return _read_toml(temp_directory).variables
+
+
+def _resolve_layers(
+    template_path: Path,
+    toml: ItmplToml,
+    find_base: Callable[[str, List[Path]], Optional[Tuple[Path, ItmplToml]]],
+) -> Tuple[List[Path], ItmplToml]:
+    layers = [template_path]
+    tomls = [toml]
+    while toml.metadata.extends:
+        base = find_base(
+            toml.metadata.extends,
+            [layer.resolve() for layer in layers],
+        )
+        if base is None:
+            raise TemplatingException(
+                f"Template {layers[-1].name} extends {toml.metadata.extends}, "
+                f"which was not found or would create a cycle"
+            )
+        layers.append(base[0])
+        toml = base[1]
+        tomls.append(toml)
+
+    merged = tomls[-1]
+    for child in reversed(tomls[:-1]):
+        merged = metadata.merge_itmpl_toml(merged, child)
+    return list(reversed(layers)), merged
+
+
+def resolve_template(
+    template_path: Path,
+    roots: Optional[List[Path]] = None,
+) -> Tuple[List[Path], ItmplToml]:
+    """Resolve the chain of templates a template extends. Returns the template
+    directories to overlay, base first, and the merged .itmpl.toml.
+
+    The template roots are read from the config unless given, and only if the
+    template extends another.
+    """
+    toml = _read_toml(template_path)
+    if not toml.metadata.extends:
+        return [template_path], toml
+
+    template_roots = _TemplateRoots(roots)
+    layers, merged = template_roots.resolve(template_path, toml)
+    template_roots.save()
+    return layers, merged
+
+
+def copy_template(
+    layers: List[Path],
+    destination: Path,
+    only: Optional[List[str]] = None,
+    symlinks: Optional[tree_utils.SymlinkPolicy] = None,
+    copy_excludes: Sequence[str] = (),
+) -> int:
+    """Copy a template's layers into destination, later layers overriding
+    files in earlier ones. Paths excluded by copy_excludes or an .itmplignore
+    file are left out. Returns the number of bytes copied."""
+    symlinks = symlinks or tree_utils.SymlinkPolicy.COPY
+    rules = ignore.read_ignore_rules(layers, copy_excludes)
+    try:
+        if not only:
+            if len(layers) == 1:
+                return tree_utils.copy_tree(
+                    layers[0], destination, symlinks=symlinks, rules=rules
+                )
+            return tree_utils.copy_overlay(
+                layers, destination, symlinks=symlinks, rules=rules
+            )
+
+        copied = 0
+        for layer in layers:
+            copied += tree_utils.copy_matching(
+                layer, destination, only, symlinks, rules
+            )
+        if not any(not p.name.startswith(".itmpl") for p in destination.glob("*")):
+            raise TemplatingException(
+                f"No paths in the template match {', '.join(only)}"
+            )
+        for layer in layers:
+            copied += tree_utils.copy_matching(layer, destination, [".itmpl*"])
+        return copied
+    except tree_utils.SymlinkLoopError as e:
+        raise TemplatingException(
+            f"{e}. Set symlinks to preserve or skip in .itmpl.toml."
+        ) from e
+
+
+def get_hook(directory: Path, name: str) -> Optional[Callable[..., Any]]:
+    """Get a function from the .itmpl.py file in a directory, if it exists."""
+    module = _setup_itmpl_module(directory)
+
+    if not module or not hasattr(module, name):
+        return None
+
+    return getattr(module, name)
+
+
+def run_hook(hook: Callable[..., Any], *args: Any) -> Any:
+    """Call a hook. Hooks defined with async def are run in a new event loop."""
+    result = hook(*args)
+    if inspect.isawaitable(result):
+        return asyncio.run(_await(result))
+    return result
+
+
+async def _await(awaitable: Awaitable[Any]) -> Any:
+    return await awaitable
+
+
+_HOOK_ERRORS = {
+    "get_variables": "Error when getting extra variables from .itmpl.py",
+    "post_script": "Error when running post script from .itmpl.py",
+}
+
+
+@contextlib.contextmanager
+def hook_errors(name: str) -> Iterator[None]:
+    """Turn errors raised by the get_variables or post_script hook, including
+    exceeding a budget, into TemplatingExceptions."""
+    try:
+        yield
+    except BudgetError as e:
+        raise TemplatingException(f"{name} in .itmpl.py {e}") from e
+    except Exception as e:
+        raise TemplatingException(f"{_HOOK_ERRORS[name]}: {e}") from e
 
 
 def get_python_variables(
@@ -111,56 +583,55 @@ def get_python_variables(
     project_name: str,
     destination: Path,
     variables: Dict[str, Any],
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
 ) -> Dict[str, str]:
-    """Get extra variables from the .itmpl.py file in the template directory."""
-    module = _setup_itmpl_module(temp_directory)
+    """Get extra variables from the .itmpl.py file in the template directory,
+    within the hook budgets."""
+    hook = get_hook(temp_directory, "get_variables")
 
-    if not module or not hasattr(module, "get_variables"):
+    if hook is None:
         return {}
 
-    try:
-        return module.get_variables(
-            project_name,
-            destination,
-            variables,
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with hook_errors("get_variables"), profiler.hook("get_variables"):
+        return run_limited(
+            run_hook,
+            (hook, project_name, destination, variables),
+            budgets or Budgets(),
         )
-    except Exception as e:
-        raise TemplatingException(
-            f"Error when getting extra variables from .itmpl.py: {e}"
-        ) from e
 
 
 def run_post_script(
     project_name: str,
     final_directory: Path,
     variables: Dict[str, str],
+    budgets: Optional[Budgets] = None,
+    profiler: Optional[profiling.Profiler] = None,
 ) -> Dict[str, str]:
-    """Run the post script in the .itmpl.py file in the template directory."""
-    module = _setup_itmpl_module(final_directory)
+    """Run the post script in the .itmpl.py file in the template directory,
+    within the hook budgets."""
+    hook = get_hook(final_directory, "post_script")
 
-    if not module or not hasattr(module, "post_script"):
+    if hook is None:
         return {}
 
-    try:
-        return module.post_script(
-            project_name,
-            final_directory,
-            variables,
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with hook_errors("post_script"), profiler.hook("post_script"):
+        return run_limited(
+            run_hook,
+            (hook, project_name, final_directory, variables),
+            budgets or Budgets(),
         )
-    except Exception as e:
-        raise TemplatingException(
-            f"Error when running post script from .itmpl.py: {e}"
-        ) from e
 
 
-def template_directory(
+def find_paths_to_template(
     dir_path: Path,
-    variables: Dict[str, Any],
-    ignore_undefined: bool = False,
     exclude: Optional[List[str]] = None,
-) -> None:
-    """Template the contents of a directory using Jinja. Both file contents and
-    filenames are templated."""
+) -> Tuple[List[Path], List[Path]]:
+    """Find the files and directories in a directory that should be templated.
+    Directories are returned parents first."""
+    files_to_template = []
     directories_to_rename = []
 
     exclusions = []
@@ -192,35 +663,373 @@ def template_directory(
             if file_path.name.startswith(".itmpl"):
                 continue
 
-            # Template the file's contents
-            try:
-                contents_template = jinja2.Template(
-                    Path(file_path).read_text(),
-                    undefined=(
-                        IgnoreUndefined if ignore_undefined else jinja2.StrictUndefined
-                    ),
-                    keep_trailing_newline=True,
-                )
-            except UnicodeDecodeError:
-                # Not a unicode file, so skip it
-                continue
+            files_to_template.append(file_path)
+
+    return files_to_template, directories_to_rename
+
+
+def find_undefined_variables(
+    dir_path: Path,
+    variables: Dict[str, Any],
+    exclude: Optional[List[str]] = None,
+) -> Set[str]:
+    """Find the variables that the templated files and names in a directory
+    use, but that aren't defined, without rendering them."""
+    environment = jinja_environment(jinja2.Undefined)
+    known = {*variables, *environment.globals}
+    files, directories = find_paths_to_template(dir_path, exclude)
+    sources = [path.name for path in [*files, *directories]]
+    for path in files:
+        if path.is_symlink():
+            continue
+        try:
+            # Decoded the same way as when rendering
+            sources.append(io.TextIOWrapper(io.BytesIO(path.read_bytes())).read())
+        except UnicodeDecodeError:
+            continue
+
+    undefined: Set[str] = set()
+    for source in sources:
+        try:
+            parsed = environment.parse(source)
+        except jinja2.TemplateSyntaxError:
+            # Reported when the file is rendered
+            continue
+        undefined.update(jinja2.meta.find_undeclared_variables(parsed) - known)
+    return undefined
+
+
+def encode_like_write_text(text: str, encoding: str) -> bytes:
+    """Encode text the way Path.write_text would write it."""
+    if os.linesep != "\n":
+        text = text.replace("\n", os.linesep)
+    return text.encode(encoding)
+
+
+def template_file(
+    file_path: Path,
+    variables: Dict[str, Any],
+    ignore_undefined: bool,
+    profiler: profiling.Profiler,
+    writer: Optional[OutputWriter] = None,
+    budgets: Optional[Budgets] = None,
+) -> bool:
+    """Template a file's contents and name. The contents of symlinks are left
+    alone, as they belong to the file linked to. A file is only rewritten if
+    rendering changed its contents. Rendering is limited by the render
+    budgets, if given.
+
+    Returns True if the file's contents were written.
+    """
+    writer = writer or OutputWriter()
+    if file_path.is_symlink():
+        writer.rename(
+            file_path,
+            file_path.parent / compile_template(file_path.name).render(**variables),
+        )
+        return False
+
+    with profiler.file(file_path) as file_stats:
+        # Template the file's contents
+        try:
+            raw = file_path.read_bytes()
+            # Decoded the same way as Path.read_text
+            reader = io.TextIOWrapper(io.BytesIO(raw))
+            source = reader.read()
+            file_stats.bytes_read = len(raw)
+            contents_template = compile_template(
+                source,
+                IgnoreUndefined if ignore_undefined else jinja2.StrictUndefined,
+            )
+        except UnicodeDecodeError:
+            # Not a unicode file, so skip it
+            file_stats.written = False
+            return False
+        if budgets is None:
             rendered = contents_template.render(**variables)
-            Path(file_path).write_text(rendered)
+        else:
+            rendered = render_limited(
+                lambda: contents_template.generate(**variables), budgets
+            )
+        output = encode_like_write_text(rendered, reader.encoding)
+        # Comparing lengths first means most changed files are never compared
+        # byte by byte
+        written = len(output) != len(raw) or output != raw
+        if written:
+            writer.write_bytes(file_path, output)
+            file_stats.bytes_written = len(output)
+        file_stats.written = written
+
+    # Rename the file
+    filename_template = compile_template(file_path.name)
+    rendered = filename_template.render(**variables)
+    if rendered != file_path.name:
+        writer.rename(file_path, file_path.parent / rendered)
+    return written
 
-            # Rename the file
-            filename_template = jinja2.Template(file)
-            rendered = filename_template.render(**variables)
-            file_path.rename(root / rendered)
 
-    # Rename directories
+def rename_directories(
+    directories_to_rename: List[Path],
+    variables: Dict[str, Any],
+    writer: Optional[OutputWriter] = None,
+) -> None:
+    """Render the names of directories found by find_paths_to_template."""
     # Note: we have to reverse the list of directories to rename because
     # otherwise we might rename a parent directory, and then try to rename its
     # children using an incorrect path.
     for directory in reversed(directories_to_rename):
         root = directory.parent
-        dirname_template = jinja2.Template(directory.name)
+        dirname_template = compile_template(directory.name)
         rendered = dirname_template.render(**variables)
-        directory.rename(root / rendered)
+        (writer or OutputWriter()).rename(directory, root / rendered)
+
+
+def template_directory(
+    dir_path: Path,
+    variables: Dict[str, Any],
+    ignore_undefined: bool = False,
+    exclude: Optional[List[str]] = None,
+    profiler: Optional[profiling.Profiler] = None,
+    writer: Optional[OutputWriter] = None,
+    budgets: Optional[Budgets] = None,
+) -> int:
+    """Template the contents of a directory using Jinja. Both file contents and
+    filenames are templated. Files that render to exactly their existing
+    contents are left untouched.
+
+    If a profiler is given, the time taken and bytes read and written are
+    recorded for each file. If a writer is given, files are written and
+    renamed with it. If budgets are given, a file that takes too long to render
+    or renders too much output raises a TemplatingException.
+
+    Returns the number of files written.
+    """
+    profiler = profiler or profiling.Profiler(enabled=False)
+    files_to_template, directories_to_rename = find_paths_to_template(
+        dir_path,
+        exclude,
+    )
+
+    written = 0
+    for file_path in files_to_template:
+        written += template_directory_file(
+            dir_path, file_path, variables, ignore_undefined, profiler, writer, budgets
+        )
+
+    rename_directories(directories_to_rename, variables, writer)
+    return written
+
+
+def template_directory_file(
+    dir_path: Path,
+    file_path: Path,
+    variables: Dict[str, Any],
+    ignore_undefined: bool,
+    profiler: profiling.Profiler,
+    writer: Optional[OutputWriter] = None,
+    budgets: Optional[Budgets] = None,
+) -> bool:
+    """Template a file found in a directory by find_paths_to_template, as in
+    template_file. A file that exceeds a budget raises a TemplatingException
+    naming it relative to the directory."""
+    try:
+        return template_file(
+            file_path, variables, ignore_undefined, profiler, writer, budgets
+        )
+    except BudgetError as e:
+        raise TemplatingException(
+            f"Rendering {file_path.relative_to(dir_path)} {e}"
+        ) from e
+
+
+def is_hook_file(path: Path) -> bool:
+    """Whether a path is only used while rendering, and so is removed from the
+    rendered project."""
+    return path.name.startswith(".itmpl") or path.name == "__pycache__"
+
+
+def shared_files(rendered: Set[Path]) -> Callable[[Path], bool]:
+    """Which files in a rendered temporary directory can be linked from the
+    blob store, given the files rendering wrote: those it left unchanged,
+    other than the files only used while rendering."""
+    return lambda path: not (
+        path in rendered or is_hook_file(path) or is_hook_file(path.parent)
+    )
+
+
+def _sync_output(
+    writer: OutputWriter,
+    destination: Path,
+    profiler: profiling.Profiler,
+) -> None:
+    """Flush the rendered project to disk, if the durability mode asks for
+    it."""
+    if writer.durability != Durability.DURABLE:
+        return
+    with profiler.phase("sync") as stats:
+        stats.sync_calls = writer.sync(destination)
+
+
+def confirm_overwrite(duplicates: List[Path]) -> None:
+    """List files that are about to be overwritten, and ask to continue."""
+    print(
+        "[red]The following files already exist and will be overwritten:[/red]",
+    )
+    print("\n".join([str(d.resolve()) for d in duplicates]))
+
+    typer.confirm("Continue?", abort=True)
+
+
+@contextlib.contextmanager
+def profile_render(
+    profiler: profiling.Profiler,
+    template: str,
+    destination: Path,
+) -> Iterator[None]:
+    """Send events for a render to the profiler's observers, including how
+    many templates came from the compile cache."""
+    cache_hits = compile_cache_info().hits
+    with profiler.render(template, destination) as summary:
+        try:
+            yield
+        finally:
+            # Approximate when renders run concurrently, as the cache is shared
+            summary.compile_cache_hits = compile_cache_info().hits - cache_hits
+
+
+def output_writers(
+    durability: Durability,
+    links: LinkMode,
+) -> Tuple[Optional[BlobStore], OutputWriter, Optional[OutputWriter]]:
+    """The blob store for a render, unless links is none, the writer for its
+    destination, and, when there is a blob store, a writer for the temporary
+    directory that keeps track of the files rendering writes, so the rest can
+    be shared."""
+    blobs = BlobStore(links) if links != LinkMode.NONE else None
+    temp_writer = OutputWriter(track=True) if blobs else None
+    return blobs, OutputWriter(durability, blobs), temp_writer
+
+
+def copy_to_temp(
+    template_path: Path,
+    temp_project_dir: Path,
+    profiler: profiling.Profiler,
+    only: Optional[List[str]] = None,
+) -> ItmplToml:
+    """Copy a template, merged with the templates it extends, to a temporary
+    directory to render it in. Returns the merged metadata."""
+    with profiler.phase("copy to temp") as stats:
+        layers, toml = resolve_template(template_path)
+        stats.bytes_read = stats.bytes_written = copy_template(
+            layers,
+            temp_project_dir,
+            only,
+            toml.metadata.symlinks,
+            toml.metadata.copy_excludes,
+        )
+    return toml
+
+
+def find_duplicate_files(
+    temp_project_dir: Path,
+    destination: Path,
+    profiler: profiling.Profiler,
+    ignore: Optional[Callable[[Path], bool]] = None,
+) -> List[Path]:
+    """Find the files of a rendered project that already exist in the
+    destination."""
+    with profiler.phase("find duplicates"):
+        return list(
+            tree_utils.find_duplicates(temp_project_dir, destination, ignore=ignore)
+        )
+
+
+def copy_to_destination(
+    temp_project_dir: Path,
+    destination: Path,
+    profiler: profiling.Profiler,
+    writer: OutputWriter,
+    temp_writer: Optional[OutputWriter] = None,
+    ignore: Optional[Callable[[Path], bool]] = None,
+) -> None:
+    """Copy a rendered project to its destination with the writer. If
+    temp_writer kept track of the files rendering wrote, the rest are linked
+    from the blob store."""
+    # Any symlinks left in the temporary directory are meant to be kept
+    with profiler.phase("copy to destination") as stats:
+        stats.bytes_read = stats.bytes_written = tree_utils.copy_tree(
+            temp_project_dir,
+            destination,
+            ignore=ignore,
+            symlinks=tree_utils.SymlinkPolicy.PRESERVE,
+            writer=writer,
+            on_copy=profiler.copied if profiler.observers else None,
+            shared=shared_files(temp_writer.files) if temp_writer else None,
+        )
+
+
+@contextlib.contextmanager
+def second_render(profiler: profiling.Profiler) -> Iterator[None]:
+    """Record rendering a project again with the variables its post script
+    returned. Undefined variables raise a TemplatingException."""
+    with profiler.phase("second render"):
+        try:
+            yield
+        except jinja2.exceptions.UndefinedError as e:
+            raise TemplatingException(f"Error when templating directory: {e}") from e
+
+
+def clean_up(
+    destination: Path,
+    profiler: profiling.Profiler,
+    writer: OutputWriter,
+) -> None:
+    """Remove the hook files from a rendered project, and flush it to disk if
+    the durability mode asks for it."""
+    with profiler.phase("cleanup"):
+        tree_utils.recursive_delete(destination, ".itmpl*")
+        tree_utils.recursive_delete(destination, "__pycache__")
+
+    _sync_output(writer, destination, profiler)
+
+
+def finish_render(
+    project_name: str,
+    destination: Path,
+    variables: Dict[str, Any],
+    exclude: Optional[List[str]],
+    profiler: profiling.Profiler,
+    writer: OutputWriter,
+    budgets: Budgets,
+) -> None:
+    """Run the post script of a project copied to its destination, render it
+    again with any variables the post script returns, and remove the hook
+    files."""
+    with profiler.phase("post_script"):
+        new_variables = run_post_script(
+            project_name=project_name,
+            final_directory=destination,
+            variables=variables.copy(),
+            budgets=budgets,
+            profiler=profiler,
+        )
+
+    # If the post script returns new variables, template the directory again with
+    # the new variables. This time, we don't ignore undefined variables, so that
+    # any extraneous Jinja is ignored.
+    if new_variables:
+        with second_render(profiler):
+            template_directory(
+                destination,
+                new_variables,
+                exclude=exclude,
+                ignore_undefined=False,
+                profiler=profiler,
+                writer=writer,
+                budgets=budgets,
+            )
+
+    clean_up(destination, profiler, writer)
 
 
 def render_template(
@@ -230,7 +1039,65 @@ def render_template(
     template_path: Path,
     exclude: Optional[List[str]] = None,
     prompt_if_duplicates: bool = True,
+    profiler: Optional[profiling.Profiler] = None,
+    only: Optional[List[str]] = None,
+    durability: Durability = Durability.NONE,
+    budgets: Optional[Budgets] = None,
+    links: LinkMode = LinkMode.NONE,
 ):
+    """Render a template into the destination directory.
+
+    If a profiler is given, each phase of the render is recorded in it.
+
+    If only is given, just the paths in the template matching one of its glob
+    patterns are rendered and copied, for adding part of a template to an
+    existing project. Paths are matched before their names are templated. The
+    post script is not run for a partial render, so if the matching paths use
+    variables that only it would define, a TemplatingException listing them
+    is raised before anything is written.
+
+    The durability mode controls how files in the destination are written.
+
+    The budgets are combined with those of the template, and the stricter
+    limits apply. Exceeding one raises a TemplatingException.
+
+    Unless links is none, files that rendering leaves unchanged are stored in
+    the blob store and linked into the destination with the given link mode.
+
+    Events for the render are sent to the profiler's observers.
+    """
+    profiler = profiler or profiling.Profiler(enabled=False)
+    with profile_render(profiler, template, destination):
+        _render_template(
+            project_name,
+            template,
+            destination,
+            template_path,
+            exclude,
+            prompt_if_duplicates,
+            profiler,
+            only,
+            durability,
+            budgets,
+            links,
+        )
+
+
+def _render_template(
+    project_name: str,
+    template: str,
+    destination: Path,
+    template_path: Path,
+    exclude: Optional[List[str]],
+    prompt_if_duplicates: bool,
+    profiler: profiling.Profiler,
+    only: Optional[List[str]],
+    durability: Durability,
+    budgets: Optional[Budgets],
+    links: LinkMode,
+) -> None:
+    profiler.report.durability = durability
+    blobs, writer, temp_writer = output_writers(durability, links)
     default_variables = {
         **get_default_variables(project_name=project_name),
         **global_vars.VARIABLES,
@@ -238,64 +1105,74 @@ def render_template(
 
     with tempfile.TemporaryDirectory() as tempdir:
         temp_project_dir = Path(tempdir) / template
-        tree_utils.copy_tree(
-            template_path,
-            temp_project_dir,
-        )
+        toml = copy_to_temp(template_path, temp_project_dir, profiler, only)
+        limits = strictest(toml.metadata.budgets, budgets or Budgets())
 
-        toml_variables = get_toml_variables(temp_project_dir)
-        python_variables = get_python_variables(
-            temp_directory=temp_project_dir,
-            project_name=project_name,
-            destination=destination,
-            variables={**default_variables, **toml_variables},
-        )
+        with profiler.phase("get_variables"):
+            toml_variables = toml.variables
+            python_variables = get_python_variables(
+                temp_directory=temp_project_dir,
+                project_name=project_name,
+                destination=destination,
+                variables={**default_variables, **toml_variables},
+                budgets=limits,
+                profiler=profiler,
+            )
 
         variables = {**default_variables, **toml_variables, **python_variables}
-        template_directory(
-            temp_project_dir,
-            variables,
-            exclude=exclude,
-            ignore_undefined=True,
-        )
+        if only:
+            undefined = find_undefined_variables(temp_project_dir, variables, exclude)
+            if undefined:
+                raise TemplatingException(
+                    "The post script isn't run for a partial render, so these "
+                    f"variables would be left undefined: {', '.join(sorted(undefined))}"
+                )
 
-        duplicates = list(
-            tree_utils.find_duplicates(
+        with profiler.phase("render"):
+            template_directory(
                 temp_project_dir,
-                destination,
-            ),
-        )
-
-        if duplicates and prompt_if_duplicates:
-            print(
-                "[red]The following files already exist and will be overwritten:[/red]",
+                variables,
+                exclude=exclude,
+                ignore_undefined=True,
+                profiler=profiler,
+                writer=temp_writer,
+                budgets=limits,
             )
-            print("\n".join([str(d.resolve()) for d in duplicates]))
-
-            typer.confirm("Continue?", abort=True)
 
-        tree_utils.copy_tree(temp_project_dir, destination)
-        new_variables = run_post_script(
-            project_name=project_name,
-            final_directory=destination,
-            variables=variables.copy(),
+        duplicates = find_duplicate_files(
+            temp_project_dir,
+            destination,
+            profiler,
+            ignore=is_hook_file if only else None,
         )
+        if duplicates and prompt_if_duplicates:
+            confirm_overwrite(duplicates)
 
-        # If the post script returns new variables, template the directory again with
-        # the new variables. This time, we don't ignore undefined variables, so that
-        # any extraneous Jinja is ignored.
-        if new_variables:
-            try:
-                template_directory(
-                    destination,
-                    new_variables,
-                    exclude=exclude,
-                    ignore_undefined=False,
-                )
-            except jinja2.exceptions.UndefinedError as e:
-                raise TemplatingException(
-                    f"Error when templating directory: {e}"
-                ) from e
+        if only:
+            # Leave the rest of the existing project alone: no hook files are
+            # copied, so there's nothing to clean up afterwards
+            copy_to_destination(
+                temp_project_dir,
+                destination,
+                profiler,
+                writer,
+                temp_writer,
+                ignore=is_hook_file,
+            )
+            _sync_output(writer, destination, profiler)
+        else:
+            copy_to_destination(
+                temp_project_dir, destination, profiler, writer, temp_writer
+            )
+            finish_render(
+                project_name,
+                destination,
+                variables,
+                exclude,
+                profiler,
+                writer,
+                limits,
+            )
 
-        tree_utils.recursive_delete(destination, ".itmpl*")
-        tree_utils.recursive_delete(destination, "__pycache__")
+        if blobs:
+            blobs.record(destination, writer.shared)
@@ -1,6 +1,11 @@
+import enum
+import os
 import shutil
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Callable, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from itmpl.durability import OutputWriter
+from itmpl.ignore import IgnoreRules
 
 
 def find_duplicates(
@@ -22,33 +27,245 @@ def find_duplicates(
         elif not (destination / item.name).exists():
             # Item does not exist in destination
             continue
-        elif item.is_dir():
+        elif item.is_dir() and not item.is_symlink():
             # Item is a directory, so recurse
-            yield from find_duplicates(item, destination / item.name)
+            yield from find_duplicates(item, destination / item.name, ignore)
         elif (destination / item.name).exists():
             # Item is a file and exists in destination
             yield destination / item.name
 
 
+class SymlinkPolicy(str, enum.Enum):
+    """How symlinks in a template are copied."""
+
+    # Copy the file or directory the symlink points to
+    COPY = "copy"
+    # Copy the symlink itself
+    PRESERVE = "preserve"
+    # Leave the symlink out
+    SKIP = "skip"
+
+
+class SymlinkLoopError(Exception):
+    """Exception raised when following symlinks leads back to a directory that
+    is already being copied."""
+
+
+def copy_symlink(link: Path, destination: Path, root: Path) -> None:
+    """Recreate a symlink at destination. Relative links to paths outside root
+    are made absolute, so they still point at the same place."""
+    target = os.readlink(link)
+    if not os.path.isabs(target):
+        resolved = (link.parent / target).resolve()
+        try:
+            resolved.relative_to(root.resolve())
+        except ValueError:
+            target = str(resolved)
+
+    if destination.is_symlink() or destination.is_file():
+        destination.unlink()
+    os.symlink(target, destination)
+
+
+def _copy_tree(
+    source: Path,
+    destination: Path,
+    ignore: Callable[[Path], bool],
+    symlinks: SymlinkPolicy,
+    root: Path,
+    ancestors: FrozenSet[Tuple[int, int]],
+    copied_paths: Optional[Set[Path]],
+    rules: Optional[IgnoreRules] = None,
+    relative: str = "",
+    writer: Optional[OutputWriter] = None,
+    on_copy: Optional[Callable[[Path, int], None]] = None,
+    shared: Optional[Callable[[Path], bool]] = None,
+) -> int:
+    stat = source.stat()
+    key = (stat.st_dev, stat.st_ino)
+    if key in ancestors:
+        raise SymlinkLoopError(f"Symlink loop at {source}")
+    ancestors = ancestors | {key}
+    copied = 0
+
+    with os.scandir(source) as entries:
+        for entry in entries:
+            item = Path(entry.path)
+            target = destination / entry.name
+            item_relative = f"{relative}{entry.name}"
+            if rules and rules.is_ignored(item_relative, entry.is_dir()):
+                # Ignored directories are never entered
+                continue
+            elif ignore(item):
+                continue
+            elif copied_paths is not None and target in copied_paths:
+                # Already copied from a source that takes precedence
+                continue
+            elif entry.is_symlink() and symlinks != SymlinkPolicy.COPY:
+                if symlinks == SymlinkPolicy.PRESERVE:
+                    destination.mkdir(parents=True, exist_ok=True)
+                    copy_symlink(item, target, root)
+                    if copied_paths is not None:
+                        copied_paths.add(target)
+            elif entry.is_dir():
+                copied += _copy_tree(
+                    item,
+                    target,
+                    ignore,
+                    symlinks,
+                    root,
+                    ancestors,
+                    copied_paths,
+                    rules,
+                    f"{item_relative}/",
+                    writer,
+                    on_copy,
+                    shared,
+                )
+            else:
+                destination.mkdir(parents=True, exist_ok=True)
+                if writer is None:
+                    shutil.copy2(item, target)
+                else:
+                    writer.copy_file(
+                        item, target, shared=shared is not None and shared(item)
+                    )
+                size = entry.stat().st_size
+                copied += size
+                if on_copy is not None:
+                    on_copy(target, size)
+                if copied_paths is not None:
+                    copied_paths.add(target)
+
+    return copied
+
+
 def copy_tree(
     source: Path,
     destination: Path,
     ignore: Optional[Callable[[Path], bool]] = None,
-):
+    symlinks: SymlinkPolicy = SymlinkPolicy.COPY,
+    rules: Optional[IgnoreRules] = None,
+    writer: Optional[OutputWriter] = None,
+    on_copy: Optional[Callable[[Path, int], None]] = None,
+    shared: Optional[Callable[[Path], bool]] = None,
+) -> int:
     """Copy a tree of files from source to destination. Unlike shutil.copytree,
     this function will not overwrite existing files and will create the
     destination directory if it does not exist.
+
+    Symlinks are handled according to the symlink policy. When they are
+    followed, a symlink loop raises a SymlinkLoopError rather than recursing
+    forever. Paths matching the ignore rules, relative to source, are skipped
+    without being read. If a writer is given, files are copied with it.
+    on_copy is called with the destination path and size of each file copied.
+    Files in source for which shared returns True are copied as shared files
+    by the writer, linking them from its blob store if it has one.
+
+    Returns the number of bytes copied.
     """
-    ignore = ignore or (lambda p: False)
+    return _copy_tree(
+        source,
+        destination,
+        ignore or (lambda p: False),
+        symlinks,
+        source,
+        frozenset(),
+        None,
+        rules,
+        writer=writer,
+        on_copy=on_copy,
+        shared=shared,
+    )
 
-    for item in source.iterdir():
-        if ignore(item):
+
+def copy_overlay(
+    sources: List[Path],
+    destination: Path,
+    symlinks: SymlinkPolicy = SymlinkPolicy.COPY,
+    rules: Optional[IgnoreRules] = None,
+) -> int:
+    """Copy several trees into destination, with files in later sources
+    replacing files at the same path in earlier ones. Each file is only copied
+    once, from the last source that has it. Symlinks and ignore rules are
+    handled as in copy_tree.
+
+    Returns the number of bytes copied.
+    """
+    copied = 0
+    copied_paths: Set[Path] = set()
+
+    for source in reversed(sources):
+        copied += _copy_tree(
+            source,
+            destination,
+            lambda p: False,
+            symlinks,
+            source,
+            frozenset(),
+            copied_paths,
+            rules,
+        )
+
+    return copied
+
+
+def copy_matching(
+    source: Path,
+    destination: Path,
+    patterns: Iterable[str],
+    symlinks: SymlinkPolicy = SymlinkPolicy.COPY,
+    rules: Optional[IgnoreRules] = None,
+) -> int:
+    """Copy the items in source matching any of the glob patterns to the same
+    paths relative to destination. Matching directories are copied with all of
+    their contents. Only the parts of source that the patterns can match are
+    searched. Symlinks and ignore rules are handled as in copy_tree.
+
+    Returns the number of bytes copied. Items matched by several patterns, or
+    inside a matching directory, are copied once.
+    """
+    copied = 0
+    copied_directories: Set[Path] = set()
+    # Sorted so directories come before their contents
+    matches = sorted({item for pattern in patterns for item in source.glob(pattern)})
+    for item in matches:
+        relative = item.relative_to(source)
+        target = destination / relative
+        if any(parent in copied_directories for parent in relative.parents):
+            continue
+        elif rules and any(
+            rules.is_ignored(parent.as_posix(), True)
+            for parent in list(relative.parents)[:-1]
+        ):
             continue
+        elif rules and rules.is_ignored(relative.as_posix(), item.is_dir()):
+            continue
+        elif item.is_symlink() and symlinks != SymlinkPolicy.COPY:
+            # Nothing is copied through the link
+            copied_directories.add(relative)
+            if symlinks == SymlinkPolicy.PRESERVE:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                copy_symlink(item, target, source)
         elif item.is_dir():
-            copy_tree(item, destination / item.name)
+            copied_directories.add(relative)
+            copied += _copy_tree(
+                item,
+                target,
+                lambda p: False,
+                symlinks,
+                source,
+                frozenset(),
+                None,
+                rules,
+                f"{relative.as_posix()}/",
+            )
         else:
-            destination.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(item, destination / item.name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(item, target)
+            copied += item.stat().st_size
+
+    return copied
 
 
 def recursive_delete(directory: Path, glob: str) -> None:
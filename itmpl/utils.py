@@ -1,11 +1,21 @@
+import enum
+import fnmatch
+import importlib.metadata
 import importlib.util
+import json
+import re
 import subprocess
 import sys
 from datetime import datetime
 from pathlib import Path
 from types import ModuleType
-from typing import Iterable, List, Tuple
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
 
+from packaging.markers import UndefinedComparison, UndefinedEnvironmentName
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import InvalidWheelFilename, parse_wheel_filename
+from packaging.version import Version
+from rich import print
 from rich.table import Table
 
 from itmpl.metadata import ItmplToml
@@ -50,13 +60,321 @@ def construct_table_from_templates(
     return table
 
 
-def install_dependencies(dependencies: List[str]):
-    """Install dependencies."""
+class ListFormat(str, enum.Enum):
+    """Output formats for `itmpl list`."""
+
+    TABLE = "table"
+    JSON = "json"
+    JSONL = "jsonl"
+    PLAIN = "plain"
+
+
+# The template fields that `itmpl list --filter` can match
+FILTER_FIELDS = ("name", "description", "requirements")
+
+
+def parse_template_filter(expression: str) -> Tuple[Optional[str], str]:
+    """Parse a filter of the form FIELD=GLOB into its field and pattern. A
+    filter without a field matches any field containing the text."""
+    field, separator, pattern = expression.partition("=")
+    if not separator:
+        return None, f"*{expression}*"
+    field = field.strip().lower()
+    if field not in FILTER_FIELDS:
+        raise ValueError(
+            f"Unknown filter field {field}, expected one of {', '.join(FILTER_FIELDS)}"
+        )
+    return field, pattern
+
+
+def template_matches(
+    name: str,
+    toml_obj: ItmplToml,
+    filters: Iterable[Tuple[Optional[str], str]],
+) -> bool:
+    """Check whether a template matches every filter. Patterns are matched
+    case-insensitively, and a requirements filter matches if any requirement
+    does."""
+    values = {
+        "name": [name],
+        "description": [toml_obj.metadata.template_description or ""],
+        "requirements": toml_obj.metadata.template_requirements,
+    }
+    for field, pattern in filters:
+        pattern = pattern.lower()
+        candidates = (
+            values[field] if field else [v for vs in values.values() for v in vs]
+        )
+        if not any(fnmatch.fnmatchcase(c.lower(), pattern) for c in candidates):
+            return False
+    return True
+
+
+def template_to_dict(name: str, path: Path, toml_obj: ItmplToml) -> Dict[str, Any]:
+    """The fields of a template shown by `itmpl list` in JSON formats."""
+    return {
+        "name": name,
+        "path": str(path),
+        "description": toml_obj.metadata.template_description,
+        "requirements": toml_obj.metadata.template_requirements,
+    }
+
+
+def write_templates(
+    templates: Iterable[Tuple[str, Path, ItmplToml]],
+    output_format: ListFormat,
+    stream: TextIO,
+) -> None:
+    """Write templates to a stream as each is read, rather than waiting for
+    the whole list. The table format can't be streamed, so isn't supported."""
+    if output_format == ListFormat.JSON:
+        stream.write("[")
+    for i, (name, path, toml_obj) in enumerate(templates):
+        if output_format == ListFormat.PLAIN:
+            description = toml_obj.metadata.template_description or ""
+            stream.write(f"{name}\t{' '.join(description.split())}\n")
+        else:
+            line = json.dumps(template_to_dict(name, path, toml_obj))
+            if output_format == ListFormat.JSON:
+                line = f"{',' if i else ''}\n  {line}"
+            else:
+                line = f"{line}\n"
+            stream.write(line)
+        stream.flush()
+    if output_format == ListFormat.JSON:
+        stream.write("\n]\n")
+
+
+def get_site_packages_dirs(virtualenv: Path) -> List[Path]:
+    """Get the site-packages directories of a virtual environment."""
+    return [
+        *virtualenv.glob("lib/python*/site-packages"),
+        *virtualenv.glob("Lib/site-packages"),
+    ]
+
+
+def get_virtualenv_package_versions(
+    virtualenv: Path,
+    package_names: Iterable[str],
+) -> Dict[str, str]:
+    """Get the versions of packages installed in a virtual environment, read
+    directly from their dist-info metadata. Only the requested packages are
+    looked up, and packages that are not installed are left out."""
+    path = [str(d) for d in get_site_packages_dirs(virtualenv)]
+    versions = {}
+
+    for name in package_names:
+        # dist-info directories use underscores in place of any separator
+        distributions = importlib.metadata.distributions(
+            name=canonicalise_name(name).replace("-", "_"),
+            path=path,
+        )
+        for distribution in distributions:
+            versions[name] = distribution.version
+            break
+
+    return versions
+
+
+def wheelhouse_pip_args(wheelhouse: Optional[Path]) -> List[str]:
+    """Get the pip arguments needed to install from a wheelhouse without
+    accessing a package index. Returns no arguments if wheelhouse is None."""
+    if wheelhouse is None:
+        return []
+    return ["--no-index", "--find-links", str(wheelhouse)]
+
+
+def install_dependencies(
+    dependencies: List[str],
+    wheelhouse: Optional[Path] = None,
+):
+    """Install dependencies. If a wheelhouse is given, install from it without
+    accessing a package index."""
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            *wheelhouse_pip_args(wheelhouse),
+            *dependencies,
+        ],
+    )
+
+
+def build_wheelhouse(dependencies: List[str], wheelhouse: Path):
+    """Build wheels for dependencies, and everything they depend on, into the
+    wheelhouse. Wheels already in the wheelhouse are reused."""
+    wheelhouse.mkdir(parents=True, exist_ok=True)
     subprocess.check_call(
-        [sys.executable, "-m", "pip", "install", *dependencies],
+        [
+            sys.executable,
+            "-m",
+            "pip",
+            "wheel",
+            "--wheel-dir",
+            str(wheelhouse),
+            "--find-links",
+            str(wheelhouse),
+            *dependencies,
+        ],
     )
 
 
+def read_template_requirements_files(template_path: Path) -> List[str]:
+    """Read the requirements from the .itmpl.requirements*.txt files in a
+    template directory."""
+    requirements = []
+
+    for path in sorted(template_path.glob(".itmpl.requirements*.txt")):
+        for line in path.read_text(encoding="utf-8").splitlines():
+            line = line.split("#", 1)[0].strip()
+            if line:
+                requirements.append(line)
+
+    return requirements
+
+
+def parse_requirement(requirement: str) -> Optional[Requirement]:
+    """Parse a PEP 508 requirement, or return None if it is invalid."""
+    try:
+        return Requirement(requirement)
+    except InvalidRequirement:
+        return None
+
+
+def canonicalise_name(name: str) -> str:
+    """Normalise a distribution name as described in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def get_installed_version(name: str) -> Optional[str]:
+    """Get the version of a distribution installed in the current environment,
+    or None if it is not installed."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def is_requirement_satisfied(requirement: str) -> bool:
+    """Check whether a requirement is satisfied by the current environment,
+    without spawning pip.
+
+    Requirements that cannot be checked, such as URLs, are assumed to be
+    unsatisfied. So are requirements that cannot be parsed, with a warning.
+    """
+    parsed = parse_requirement(requirement)
+    if parsed is None:
+        print(
+            f"[yellow]Can't parse requirement [white]{requirement}[/white], "
+            f"so assuming it needs installing.[/yellow]"
+        )
+        return False
+
+    if parsed.marker is not None:
+        try:
+            if not parsed.marker.evaluate():
+                # Not required on this platform
+                return True
+        except (UndefinedComparison, UndefinedEnvironmentName):
+            return False
+
+    version = get_installed_version(parsed.name)
+    if version is None or parsed.url is not None:
+        return False
+    return parsed.specifier.contains(version, prereleases=True)
+
+
+def pin_to_wheelhouse(requirements: List[str], wheelhouse: Path) -> List[str]:
+    """Pin each requirement to the newest version in the wheelhouse that
+    satisfies it, so tools that resolve against a package index, like Poetry,
+    choose the version that was installed from the wheelhouse. Requirements
+    with markers, or with no wheel in the wheelhouse, are left as they are."""
+    versions: Dict[str, List[Version]] = {}
+    for wheel in wheelhouse.glob("*.whl"):
+        try:
+            name, version, _, _ = parse_wheel_filename(wheel.name)
+        except InvalidWheelFilename:
+            continue
+        versions.setdefault(name, []).append(version)
+
+    pinned = []
+    for requirement in requirements:
+        parsed = parse_requirement(requirement)
+        if parsed is None or parsed.marker is not None or parsed.url is not None:
+            pinned.append(requirement)
+            continue
+
+        candidates = list(
+            parsed.specifier.filter(versions.get(canonicalise_name(parsed.name), [])),
+        )
+        if not candidates:
+            pinned.append(requirement)
+            continue
+
+        extras = f"[{','.join(sorted(parsed.extras))}]" if parsed.extras else ""
+        pinned.append(f"{parsed.name}{extras}=={max(candidates)}")
+
+    return pinned
+
+
+def _requirement_key(requirement: str) -> Tuple[str, str]:
+    parsed = parse_requirement(requirement)
+    if parsed is None:
+        return "", requirement.strip()
+    # str() normalises whitespace and the order of extras and specifiers
+    parsed.name = canonicalise_name(parsed.name)
+    return parsed.name, str(parsed)
+
+
+def deduplicate_requirements(requirements: Iterable[str]) -> List[str]:
+    """De-duplicate requirements, treating requirements that only differ in the
+    spelling of the name or in whitespace as equal. Order is preserved."""
+    unique: Dict[Tuple[str, str], str] = {}
+
+    for requirement in requirements:
+        unique.setdefault(_requirement_key(requirement), requirement.strip())
+
+    return list(unique.values())
+
+
+def check_requirements(requirements: Iterable[str]) -> Dict[str, bool]:
+    """Check whether each requirement is satisfied by the current environment.
+    Requirements that are duplicates of each other are only checked once."""
+    checked: Dict[Tuple[str, str], bool] = {}
+    satisfied = {}
+
+    for requirement in requirements:
+        key = _requirement_key(requirement)
+        if key not in checked:
+            checked[key] = is_requirement_satisfied(requirement)
+        satisfied[requirement] = checked[key]
+
+    return satisfied
+
+
+def construct_dependency_table(
+    templates_with_dependencies: Iterable[Tuple[str, List[str]]],
+    satisfied: Dict[str, bool],
+) -> Table:
+    """Construct a Rich table showing which of each template's requirements are
+    already satisfied, and which need installing."""
+    table = Table(show_header=True, header_style="bold")
+    table.add_column("Template", justify="left", no_wrap=True, header_style="blue")
+    table.add_column("Satisfied", header_style="green")
+    table.add_column("To install", header_style="yellow")
+
+    for template, dependencies in templates_with_dependencies:
+        table.add_row(
+            template,
+            ", ".join(d for d in dependencies if satisfied.get(d)),
+            ", ".join(d for d in dependencies if not satisfied.get(d)),
+        )
+
+    return table
+
+
 def get_current_year() -> str:
     """Get the current year."""
     return str(datetime.now().year)
@@ -0,0 +1,215 @@
+import errno
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from itmpl import global_vars, utils
+
+GOLDEN_VIRTUALENVS_DIR: Path = global_vars.APP_DIR / "virtualenvs"
+
+# Written into a golden virtualenv once it is fully built. Contains the path the
+# virtualenv was built at, which is baked into its scripts.
+COMPLETE_MARKER = ".itmpl-complete"
+
+# Requirements that aren't pinned to one version are resolved when a golden
+# virtualenv is built, so it is rebuilt this often, in seconds, to pick up new
+# releases
+GOLDEN_VIRTUALENV_MAX_AGE = 7 * 24 * 60 * 60
+
+# Linux ioctl to share the data blocks of one file with another (copy-on-write)
+FICLONE = 0x40049409
+
+
+def _is_pinned(requirement: str) -> bool:
+    """Whether a requirement allows exactly one version."""
+    parsed = utils.parse_requirement(requirement)
+    if parsed is None or parsed.url is not None or len(parsed.specifier) != 1:
+        return False
+    (specifier,) = parsed.specifier
+    return specifier.operator in ("==", "===") and "*" not in specifier.version
+
+
+def requirements_key(requirements: Iterable[str]) -> str:
+    """Hash a set of requirements, together with the current Python version, to
+    key a golden virtualenv. Unless every requirement is pinned to one version,
+    the key also changes every GOLDEN_VIRTUALENV_MAX_AGE seconds, so the
+    versions resolved when it was built aren't used forever."""
+    unique = utils.deduplicate_requirements(requirements)
+    normalised = sorted("".join(r.split()).lower() for r in unique)
+    digest = hashlib.sha256()
+    digest.update(f"{sys.implementation.name}-{sys.version}\n".encode())
+    if not all(_is_pinned(r) for r in unique):
+        digest.update(f"{int(time.time() // GOLDEN_VIRTUALENV_MAX_AGE)}\n".encode())
+    digest.update("\n".join(normalised).encode())
+    return digest.hexdigest()[:16]
+
+
+def _scripts_dir(virtualenv: Path) -> Path:
+    if (virtualenv / "Scripts").is_dir():
+        return virtualenv / "Scripts"
+    return virtualenv / "bin"
+
+
+def create_virtualenv(
+    path: Path,
+    requirements: List[str],
+    wheelhouse: Optional[Path] = None,
+) -> None:
+    """Create a virtualenv at path and install requirements into it."""
+    subprocess.run(
+        [sys.executable, "-m", "venv", str(path)],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    if not requirements:
+        return
+
+    subprocess.run(
+        [
+            str(_scripts_dir(path) / "python"),
+            "-m",
+            "pip",
+            "install",
+            "--disable-pip-version-check",
+            *utils.wheelhouse_pip_args(wheelhouse),
+            *requirements,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def get_golden_virtualenv(
+    template: str,
+    requirements: List[str],
+    wheelhouse: Optional[Path] = None,
+) -> Path:
+    """Get the golden virtualenv for a template with the given requirements
+    installed, building it if it does not exist yet. With a wheelhouse, the
+    requirements are pinned to the versions in it first, so the golden
+    virtualenv is rebuilt when newer wheels are added."""
+    if wheelhouse is not None:
+        requirements = utils.pin_to_wheelhouse(requirements, wheelhouse)
+    template_dir = GOLDEN_VIRTUALENVS_DIR / template
+    golden = template_dir / requirements_key(requirements)
+
+    if (golden / COMPLETE_MARKER).exists():
+        return golden
+
+    # Build in a temporary directory next to the final location, then move it
+    # into place, so a half-built virtualenv is never used.
+    template_dir.mkdir(parents=True, exist_ok=True)
+    build_dir = Path(tempfile.mkdtemp(prefix=f".{golden.name}-", dir=template_dir))
+    try:
+        create_virtualenv(build_dir, requirements, wheelhouse=wheelhouse)
+        (build_dir / COMPLETE_MARKER).write_text(str(build_dir), encoding="utf-8")
+        try:
+            build_dir.rename(golden)
+        except OSError:
+            if not (golden / COMPLETE_MARKER).exists():
+                raise
+            # Another process built the same virtualenv first
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    return golden
+
+
+def _reflink(source: Path, destination: Path) -> bool:
+    """Try to clone a file with a copy-on-write reflink. Returns False if the
+    platform or filesystem does not support it."""
+    if not sys.platform.startswith("linux"):
+        return False
+
+    import fcntl
+
+    with source.open("rb") as src, destination.open("wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            cloned = False
+        else:
+            cloned = True
+
+    if not cloned:
+        destination.unlink()
+        return False
+
+    shutil.copystat(source, destination)
+    return True
+
+
+def _hardlink(source: Path, destination: Path) -> bool:
+    """Try to hardlink a file. Returns False if the filesystem does not support
+    it, or source and destination are on different devices."""
+    try:
+        os.link(source, destination)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        return False
+    return True
+
+
+def _rewrite_paths(path: Path, old: bytes, new: bytes) -> None:
+    """Replace old with new in a file, writing a new file rather than modifying
+    it in place, so files linked to it are left untouched."""
+    contents = path.read_bytes()
+    if old not in contents:
+        return
+
+    stat = path.stat()
+    path.unlink()
+    path.write_bytes(contents.replace(old, new))
+    os.chmod(path, stat.st_mode)
+
+
+def clone_virtualenv(source: Path, destination: Path, hardlink: bool = False) -> None:
+    """Clone a golden virtualenv to destination. File data is shared with the
+    golden virtualenv where possible: reflinks are tried first, as they are
+    copy-on-write, then plain copies. The paths baked into the virtualenv's
+    scripts and configuration are rewritten to point at the destination.
+
+    If hardlink is True, files are hard linked rather than copied where
+    reflinks aren't supported. A hard linked file is the golden virtualenv's
+    own file, so writing to it in place, e.g. patching an installed package,
+    changes it for every project cloned from it."""
+    marker = source / COMPLETE_MARKER
+    built_at = marker.read_text(encoding="utf-8") if marker.exists() else str(source)
+
+    # Stop trying each method after its first failure, as it will fail for
+    # every other file on the same filesystem too
+    reflink = True
+
+    for root, dirs, files in os.walk(source):
+        root_path = Path(root)
+        target = destination / root_path.relative_to(source)
+        target.mkdir(parents=True, exist_ok=True)
+
+        for name in [*dirs, *files]:
+            item = root_path / name
+            if item.is_symlink():
+                os.symlink(os.readlink(item), target / name)
+                if name in dirs:
+                    dirs.remove(name)
+            elif name in files and name != COMPLETE_MARKER:
+                reflink = reflink and _reflink(item, target / name)
+                if reflink:
+                    continue
+                hardlink = hardlink and _hardlink(item, target / name)
+                if not hardlink:
+                    shutil.copy2(item, target / name)
+
+    old = built_at.encode()
+    new = str(destination.resolve()).encode()
+    scripts = _scripts_dir(destination)
+    for path in [destination / "pyvenv.cfg", *scripts.iterdir()]:
+        if path.is_file() and not path.is_symlink():
+            _rewrite_paths(path, old, new)
@@ -0,0 +1,299 @@
+"""Render a template repeatedly while it is being written.
+
+`itmpl dev <template> <name> --watch` renders the template once, then polls
+the template directory, and the templates it extends, for changes. Only the
+files that changed are rendered again, and unchanged files are never
+recompiled. Post scripts are not run, so
+the output shows exactly what the template itself produces.
+"""
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import jinja2
+
+from itmpl import global_vars, ignore, templating, tree_utils
+from itmpl.ignore import IgnoreRules
+from itmpl.tree_utils import SymlinkPolicy
+
+# The (mtime, size) of every file in a tree, keyed by path relative to the root
+Snapshot = Dict[str, Tuple[int, int]]
+
+
+def snapshot_tree(
+    root: Path,
+    symlinks: SymlinkPolicy = SymlinkPolicy.COPY,
+    rules: Optional[IgnoreRules] = None,
+) -> Snapshot:
+    """Record the modification time and size of every file under root.
+    Symlinks are followed, recorded themselves or left out according to the
+    symlink policy. Directories that link back to one of their parents, and
+    paths matching the ignore rules, are left out."""
+    snapshot: Snapshot = {}
+    root_stat = root.stat()
+    stack = [(root, "", frozenset([(root_stat.st_dev, root_stat.st_ino)]))]
+    while stack:
+        directory, prefix, ancestors = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name == "__pycache__":
+                    continue
+
+                relative = f"{prefix}{entry.name}"
+                follow = symlinks == SymlinkPolicy.COPY
+                is_dir = entry.is_dir(follow_symlinks=follow)
+                if entry.is_symlink() and symlinks == SymlinkPolicy.SKIP:
+                    continue
+                elif rules and rules.is_ignored(relative, is_dir):
+                    continue
+                elif is_dir:
+                    stat = entry.stat()
+                    key = (stat.st_dev, stat.st_ino)
+                    if key not in ancestors:
+                        stack.append(
+                            (Path(entry.path), f"{relative}/", ancestors | {key})
+                        )
+                else:
+                    try:
+                        stat = entry.stat(follow_symlinks=follow)
+                    except FileNotFoundError:
+                        # A broken symlink
+                        continue
+                    snapshot[relative] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def diff_snapshots(old: Snapshot, new: Snapshot) -> Tuple[Set[str], Set[str]]:
+    """Return the files that were added or modified, and the files that were
+    removed, between two snapshots."""
+    changed = {path for path, stat in new.items() if old.get(path) != stat}
+    removed = set(old) - set(new)
+    return changed, removed
+
+
+def _remove_file(path: Path) -> None:
+    if path.is_symlink() or path.exists():
+        path.unlink()
+
+
+class DevRenderer:
+    """Render a template into an output directory, and keep the output up to
+    date as the template changes."""
+
+    def __init__(
+        self,
+        project_name: str,
+        template_path: Path,
+        destination: Path,
+        exclude: Optional[List[str]] = None,
+    ) -> None:
+        self.project_name = project_name
+        self.template_path = template_path.resolve()
+        self.destination = destination
+        self.exclude = exclude
+        # The template and the templates it extends, base first
+        self.layers = [self.template_path]
+        self.symlinks = SymlinkPolicy.COPY
+        self.rules = IgnoreRules()
+        self.snapshot: Snapshot = {}
+        # The layer each template file is read from
+        self.sources: Dict[str, Path] = {}
+        # The output file written for each template file
+        self.outputs: Dict[str, Path] = {}
+        self._toml_variables: Dict[str, Any] = {}
+        self._python_variables: Dict[str, Any] = {}
+        self._files_to_template: Set[str] = set()
+        self._directories_to_rename: Set[str] = set()
+
+    @property
+    def variables(self) -> Dict[str, Any]:
+        return {
+            **templating.get_default_variables(project_name=self.project_name),
+            **global_vars.VARIABLES,
+            **self._toml_variables,
+            **self._python_variables,
+        }
+
+    def _snapshot(self) -> Snapshot:
+        """Snapshot every layer, with files in later layers hiding files at
+        the same path in earlier ones."""
+        snapshot: Snapshot = {}
+        self.sources = {}
+        for layer in self.layers:
+            layer_snapshot = snapshot_tree(layer, self.symlinks, self.rules)
+            snapshot.update(layer_snapshot)
+            self.sources.update({relative: layer for relative in layer_snapshot})
+        return snapshot
+
+    def _load_toml_variables(self) -> bool:
+        """Load the merged variables and copy exclusions of every layer.
+        Returns True if the layers, symlink policy or exclusions have
+        changed."""
+        layers, toml = templating.resolve_template(self.template_path)
+        layers = [layer.resolve() for layer in layers]
+        symlinks = toml.metadata.symlinks or SymlinkPolicy.COPY
+        rules = ignore.read_ignore_rules(layers, toml.metadata.copy_excludes)
+        self._toml_variables = toml.variables
+        if layers == self.layers and symlinks == self.symlinks and rules == self.rules:
+            return False
+        self.layers = layers
+        self.symlinks = symlinks
+        self.rules = rules
+        return True
+
+    def _load_python_variables(self) -> None:
+        self._python_variables = templating.get_python_variables(
+            temp_directory=self.sources.get(".itmpl.py", self.template_path),
+            project_name=self.project_name,
+            destination=self.destination,
+            variables={
+                **templating.get_default_variables(project_name=self.project_name),
+                **global_vars.VARIABLES,
+                **self._toml_variables,
+            },
+        )
+
+    def _find_paths_to_template(self) -> None:
+        self._files_to_template = set()
+        self._directories_to_rename = set()
+        for layer in self.layers:
+            files, directories = templating.find_paths_to_template(
+                layer,
+                self.exclude,
+            )
+            self._files_to_template.update(
+                f.relative_to(layer).as_posix() for f in files
+            )
+            self._directories_to_rename.update(
+                d.relative_to(layer).as_posix() for d in directories
+            )
+
+    def _output_path(
+        self,
+        relative: str,
+        variables: Dict[str, Any],
+        render_name: bool,
+    ) -> Path:
+        """Render the path of a template file the same way render_template
+        renames files and directories."""
+        output = self.destination
+        for parent in reversed(list(Path(relative).parents)[:-1]):
+            name = parent.name
+            if parent.as_posix() in self._directories_to_rename:
+                name = templating.compile_template(name).render(**variables)
+            output = output / name
+
+        name = Path(relative).name
+        if render_name:
+            name = templating.compile_template(name).render(**variables)
+        return output / name
+
+    def _render_file(self, relative: str, variables: Dict[str, Any]) -> None:
+        source = self.sources[relative] / relative
+        preserve = source.is_symlink() and self.symlinks == SymlinkPolicy.PRESERVE
+        contents = None
+        if relative in self._files_to_template and not preserve:
+            try:
+                contents = source.read_text()
+            except UnicodeDecodeError:
+                # Binary files are copied as they are, without renaming
+                pass
+
+        if preserve:
+            output = self._output_path(relative, variables, render_name=True)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            tree_utils.copy_symlink(source, output, self.sources[relative])
+        elif contents is None:
+            output = self._output_path(relative, variables, render_name=False)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, output)
+        else:
+            output = self._output_path(relative, variables, render_name=True)
+            rendered = templating.compile_template(
+                contents,
+                templating.IgnoreUndefined,
+            ).render(**variables)
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_text(rendered)
+
+        previous = self.outputs.get(relative)
+        if previous is not None and previous != output:
+            _remove_file(previous)
+        self.outputs[relative] = output
+
+    def _remove_output(self, relative: str) -> None:
+        output = self.outputs.pop(relative, None)
+        if output is not None:
+            _remove_file(output)
+
+    def update(self, changed: Set[str], removed: Set[str]) -> int:
+        """Bring the output up to date with changes to the template. Returns
+        the number of files rendered."""
+        everything = False
+        if {".itmpl.toml", ignore.IGNORE_FILE} & (changed | removed):
+            if self._load_toml_variables():
+                # The template now extends a different template, handles
+                # symlinks differently or excludes different paths
+                snapshot = self._snapshot()
+                removed = removed | (set(self.snapshot) - set(snapshot))
+                self.snapshot = snapshot
+            everything = True
+        if ".itmpl.py" in changed | removed:
+            self._load_python_variables()
+            everything = True
+
+        # Adding or removing files can change which paths the exclude globs
+        # match
+        if everything or removed or not changed.issubset(self.outputs):
+            self._find_paths_to_template()
+
+        to_render = set(self.snapshot) if everything else set(changed)
+        to_render = {
+            relative
+            for relative in to_render
+            if not relative.split("/")[-1].startswith(".itmpl")
+        }
+
+        for relative in removed:
+            self._remove_output(relative)
+
+        variables = self.variables
+        for relative in sorted(to_render):
+            try:
+                self._render_file(relative, variables)
+            except jinja2.TemplateError as e:
+                raise templating.TemplatingException(
+                    f"Error when templating {relative}: {e}"
+                ) from e
+
+        return len(to_render)
+
+    def render(self) -> int:
+        """Render the whole template. Returns the number of files rendered."""
+        self._load_toml_variables()
+        self.snapshot = self._snapshot()
+        return self.update(set(self.snapshot), set())
+
+    def poll(self) -> Optional[Tuple[int, float]]:
+        """Check the template for changes and render them. Returns the number
+        of files rendered and the time taken, or None if nothing changed."""
+        snapshot = self._snapshot()
+        changed, removed = diff_snapshots(self.snapshot, snapshot)
+        if not changed and not removed:
+            return None
+
+        start = time.perf_counter()
+        self.snapshot = snapshot
+        count = self.update(changed, removed)
+        return count, time.perf_counter() - start
+
+    def watch(self, interval: float = 0.25) -> Iterator[Tuple[int, float]]:
+        """Poll for changes forever, yielding the number of files rendered and
+        the time taken after each change."""
+        while True:
+            time.sleep(interval)
+            result = self.poll()
+            if result is not None:
+                yield result
@@ -1,10 +1,12 @@
 import json
+import os
 import tempfile
+import threading
 from pathlib import Path
 
 import pytest
 
-from itmpl import config
+from itmpl import blobstore, config, daemon, global_vars, template_index, templating
 
 
 @pytest.fixture
@@ -49,3 +51,74 @@ def tempdir():
         destination.mkdir()
 
         yield path, source, destination
+
+
+@pytest.fixture
+def write_template():
+    """Return a function that writes a template's files, given the template
+    directory and each file's path and contents, as text or bytes. Parent
+    directories are created, and the files in executable are made
+    executable."""
+
+    def write(path, files, executable=()):
+        for name, contents in files.items():
+            (path / name).parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(contents, bytes):
+                (path / name).write_bytes(contents)
+            else:
+                (path / name).write_text(contents)
+        for name in executable:
+            os.chmod(path / name, 0o755)
+        return path
+
+    return write
+
+
+@pytest.fixture
+def running_daemon(tempdir, monkeypatch):
+    """Start a daemon in a background thread, serving templates from a
+    temporary directory."""
+    path, source, _ = tempdir
+    extra_templates_dir = path / "extra"
+    extra_templates_dir.mkdir()
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(extra_templates_dir=extra_templates_dir).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+
+    socket_path = path / "itmpl.sock"
+    server = daemon.ItmplDaemon(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield socket_path, server
+
+    server.shutdown()
+    server.server_close()
+    monkeypatch.setattr(templating, "_hook_cache", None)
+
+
+@pytest.fixture(autouse=True)
+def index_dir(monkeypatch, tmp_path):
+    """Keep template indexes out of the real app directory."""
+    path = tmp_path / "index"
+    monkeypatch.setattr(template_index, "INDEX_DIR", path)
+    yield path
+
+
+@pytest.fixture(autouse=True)
+def compiled_dir(monkeypatch, tmp_path):
+    """Keep stored compiled templates out of the real app directory."""
+    path = tmp_path / "compiled"
+    monkeypatch.setattr(templating, "COMPILED_DIR", path)
+    yield path
+
+
+@pytest.fixture(autouse=True)
+def blob_dir(monkeypatch, tmp_path):
+    """Keep the blob store out of the real app directory."""
+    path = tmp_path / "blobs"
+    monkeypatch.setattr(blobstore, "BLOB_DIR", path)
+    yield path
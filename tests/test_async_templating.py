@@ -0,0 +1,201 @@
+import asyncio
+import time
+
+import pytest
+
+from itmpl import async_templating, templating, tree_utils
+from itmpl.budgets import Budgets
+
+
+def _template(hooks):
+    return {
+        "{{ project_name }}.txt": "{{ greeting }} {{ project_title }}\n",
+        ".itmpl.py": hooks,
+    }
+
+
+ASYNC_HOOKS = """
+import asyncio
+
+
+async def get_variables(project_name, destination, variables):
+    await asyncio.sleep(0)
+    return {"greeting": "Hello"}
+
+
+async def post_script(project_name, final_directory, variables):
+    await asyncio.sleep(0)
+    return {}
+"""
+
+
+def test_template_directory_async(template_dirs):
+    """Test that template_directory_async templates the same way as
+    template_directory."""
+    source, destination = template_dirs
+    variables = {
+        **templating.get_default_variables("test-project"),
+        "project_description": "Test project description",
+    }
+
+    tree_utils.copy_tree(source / "test-template-complete", destination / "sync")
+    tree_utils.copy_tree(source / "test-template-complete", destination / "async")
+    templating.template_directory(destination / "sync", variables)
+    asyncio.run(
+        async_templating.template_directory_async(destination / "async", variables),
+    )
+
+    sync_files = sorted(
+        p.relative_to(destination / "sync") for p in (destination / "sync").rglob("*")
+    )
+    async_files = sorted(
+        p.relative_to(destination / "async") for p in (destination / "async").rglob("*")
+    )
+    assert sync_files == async_files
+    assert (destination / "async" / "test-project.txt").read_text() == (
+        destination / "sync" / "test-project.txt"
+    ).read_text()
+
+
+def test_render_template_async_with_async_hooks(tempdir, write_template):
+    """Test that async get_variables and post_script hooks are awaited."""
+    tempdir, source, destination = tempdir
+    write_template(source / "async-template", _template(ASYNC_HOOKS))
+
+    asyncio.run(
+        async_templating.render_template_async(
+            project_name="my-project",
+            template="async-template",
+            destination=destination / "my-project",
+            template_path=source / "async-template",
+        ),
+    )
+
+    rendered = destination / "my-project" / "my-project.txt"
+    assert rendered.read_text() == "Hello My Project\n"
+    assert not (destination / "my-project" / ".itmpl.py").exists()
+
+
+def test_render_template_with_async_hooks(tempdir, write_template):
+    """Test that the synchronous render_template also supports async hooks."""
+    tempdir, source, destination = tempdir
+    write_template(source / "async-template", _template(ASYNC_HOOKS))
+
+    templating.render_template(
+        project_name="my-project",
+        template="async-template",
+        destination=destination / "my-project",
+        template_path=source / "async-template",
+        prompt_if_duplicates=False,
+    )
+
+    rendered = destination / "my-project" / "my-project.txt"
+    assert rendered.read_text() == "Hello My Project\n"
+
+
+def test_render_template_async_fail_if_duplicates(tempdir, write_template):
+    """Test that existing files raise an error when fail_if_duplicates is
+    set."""
+    tempdir, source, destination = tempdir
+    write_template(source / "async-template", _template(ASYNC_HOOKS))
+    (destination / "my-project.txt").write_text("existing")
+
+    with pytest.raises(templating.TemplatingException):
+        asyncio.run(
+            async_templating.render_template_async(
+                project_name="my-project",
+                template="async-template",
+                destination=destination,
+                template_path=source / "async-template",
+                fail_if_duplicates=True,
+            ),
+        )
+
+    assert (destination / "my-project.txt").read_text() == "existing"
+
+
+def test_render_pool_limits_concurrent_renders(monkeypatch, tempdir, write_template):
+    """Test that a render pool runs many renders with bounded concurrency."""
+    tempdir, source, destination = tempdir
+    write_template(source / "async-template", _template(ASYNC_HOOKS))
+
+    render_template_async = async_templating.render_template_async
+    running = 0
+    peak = 0
+
+    async def counting_render_template_async(**kwargs):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        try:
+            await render_template_async(**kwargs)
+        finally:
+            running -= 1
+
+    monkeypatch.setattr(
+        async_templating,
+        "render_template_async",
+        counting_render_template_async,
+    )
+
+    async def render_all():
+        async with async_templating.RenderPool(max_renders=2) as pool:
+            await asyncio.gather(
+                *(
+                    pool.render_template(
+                        project_name=f"project-{i}",
+                        template="async-template",
+                        destination=destination / f"project-{i}",
+                        template_path=source / "async-template",
+                    )
+                    for i in range(6)
+                )
+            )
+
+    asyncio.run(render_all())
+
+    assert peak == 2
+    for i in range(6):
+        assert (destination / f"project-{i}" / f"project-{i}.txt").exists()
+
+
+@pytest.mark.parametrize("hook", ["time.sleep(5)", "await asyncio.sleep(5)"])
+def test_render_template_async_budgets(tempdir, hook):
+    """Test that the template's budgets are enforced for plain and async hooks,
+    and for rendering files."""
+    _, source, destination = tempdir
+    (source / ".itmpl.toml").write_text(
+        "[metadata.budgets]\nhook_timeout = 0.1\nmax_output_kb = 1\n"
+    )
+    (source / ".itmpl.py").write_text(
+        "import asyncio\nimport time\n\n"
+        f"{'async ' if 'await' in hook else ''}"
+        "def get_variables(name, destination, variables):\n"
+        f"    {hook}\n"
+        "    return {}\n"
+    )
+
+    start = time.monotonic()
+    with pytest.raises(templating.TemplatingException, match="get_variables"):
+        asyncio.run(
+            async_templating.render_template_async(
+                project_name="test-project",
+                template="source",
+                destination=destination / "out",
+                template_path=source,
+            ),
+        )
+    assert time.monotonic() - start < 4
+
+    (source / ".itmpl.py").unlink()
+    (source / "big.txt").write_text("{{ 'x' * 4096 }}")
+    with pytest.raises(templating.TemplatingException, match="big.txt"):
+        asyncio.run(
+            async_templating.render_template_async(
+                project_name="test-project",
+                template="source",
+                destination=destination / "out",
+                template_path=source,
+                budgets=Budgets(max_output_kb=100),
+            ),
+        )
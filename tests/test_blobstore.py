@@ -0,0 +1,166 @@
+import os
+import stat
+
+import pytest
+
+from itmpl import blobstore, pack, templating
+from itmpl.blobstore import BlobStore, LinkMode
+from itmpl.durability import Durability
+
+TEMPLATE = {
+    ".itmpl.toml": '[variables]\nauthor = "me"\n',
+    "rendered.txt": "{{ author }}\n",
+    "plain.txt": "No templating here\n",
+    "run.sh": "#!/bin/sh\necho hello\n",
+}
+
+
+def _render(source, destination, links, durability=Durability.NONE):
+    templating.render_template(
+        project_name="test-project",
+        template="source",
+        destination=destination,
+        template_path=source,
+        prompt_if_duplicates=False,
+        durability=durability,
+        links=links,
+    )
+
+
+def test_add_file_dedupes(tempdir, blob_dir):
+    """Test that files with the same contents are stored once, and executable
+    files separately."""
+    path, _, _ = tempdir
+    (path / "a.txt").write_text("same")
+    (path / "b.txt").write_text("same")
+    (path / "c.sh").write_text("same")
+    os.chmod(path / "c.sh", 0o755)
+    store = BlobStore(LinkMode.HARDLINK)
+
+    names = [store.add_file(path / name) for name in ("a.txt", "b.txt", "c.sh")]
+
+    assert names[0] == names[1]
+    assert names[2] == names[0] + blobstore.EXECUTABLE_SUFFIX
+    assert len(list((blob_dir / "objects").glob("*/*"))) == 2
+    assert not os.access(store.path(names[0]), os.W_OK) or os.geteuid() == 0
+
+
+def test_materialize_hardlink(tempdir):
+    """Test that hard linked files share the stored file."""
+    path, _, destination = tempdir
+    (path / "a.txt").write_text("contents")
+    store = BlobStore(LinkMode.HARDLINK)
+    name = store.add_file(path / "a.txt")
+
+    store.materialize(name, destination / "a.txt")
+
+    assert (destination / "a.txt").stat().st_nlink == 2
+    assert (destination / "a.txt").stat().st_ino == store.path(name).stat().st_ino
+
+
+def test_materialize_reflink_is_writable(tempdir, monkeypatch):
+    """Test that reflinked files, or the copies made where reflinks aren't
+    supported, are independent writable files."""
+    path, _, destination = tempdir
+    (path / "run.sh").write_text("#!/bin/sh\n")
+    os.chmod(path / "run.sh", 0o755)
+    store = BlobStore(LinkMode.REFLINK)
+    name = store.add_file(path / "run.sh")
+
+    for supported in (True, False):
+        if not supported:
+            monkeypatch.setattr(blobstore, "_reflink", lambda *args: False)
+        target = destination / f"run-{supported}.sh"
+        store.materialize(name, target)
+
+        mode = target.stat().st_mode
+        assert mode & stat.S_IWUSR and mode & stat.S_IXUSR
+        assert target.stat().st_ino != store.path(name).stat().st_ino
+        assert target.read_text() == "#!/bin/sh\n"
+
+
+@pytest.mark.parametrize("durability", list(Durability))
+def test_render_links_unchanged_files(tempdir, blob_dir, durability, write_template):
+    """Test that files rendering leaves unchanged are linked from the store,
+    and rendered and hook files aren't."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+
+    _render(source, destination / "one", LinkMode.HARDLINK, durability)
+    _render(source, destination / "two", LinkMode.HARDLINK, durability)
+
+    for project in ("one", "two"):
+        assert (destination / project / "plain.txt").stat().st_nlink == 3
+        assert (destination / project / "rendered.txt").stat().st_nlink == 1
+        assert (destination / project / "rendered.txt").read_text() == "me\n"
+        assert os.access(destination / project / "run.sh", os.X_OK)
+    assert not (destination / "one" / ".itmpl.toml").exists()
+    assert len(list((blob_dir / "objects").glob("*/*"))) == 2
+    assert len(list((blob_dir / "refs").glob("*.json"))) == 2
+
+
+def test_writing_breaks_hardlink(tempdir, write_template):
+    """Test that rendering over a linked file replaces it rather than changing
+    the stored file."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    _render(source, destination / "one", LinkMode.HARDLINK)
+    _render(source, destination / "two", LinkMode.HARDLINK)
+    stored = BlobStore(LinkMode.HARDLINK).add_file(source / "plain.txt")
+
+    (source / "plain.txt").write_text("{{ author }}\n")
+    _render(source, destination / "one", LinkMode.HARDLINK)
+
+    assert (destination / "one" / "plain.txt").read_text() == "me\n"
+    assert (destination / "two" / "plain.txt").read_text() == "No templating here\n"
+    assert BlobStore(LinkMode.HARDLINK).path(stored).read_text() == (
+        "No templating here\n"
+    )
+
+
+def test_render_pack_links_verbatim_files(tempdir, write_template):
+    """Test that files a pack copies as they are are linked from the store."""
+    path, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    pack.write_pack(source, path / "test.itmplpack")
+
+    pack.render_pack(
+        project_name="test-project",
+        pack_path=path / "test.itmplpack",
+        destination=destination / "packed",
+        prompt_if_duplicates=False,
+        links=LinkMode.HARDLINK,
+    )
+    _render(source, destination / "unpacked", LinkMode.HARDLINK)
+
+    for name in ("plain.txt", "run.sh"):
+        assert (destination / "packed" / name).stat().st_ino == (
+            destination / "unpacked" / name
+        ).stat().st_ino
+    assert (destination / "packed" / "rendered.txt").stat().st_nlink == 1
+
+
+def test_gc(tempdir, blob_dir, write_template):
+    """Test that gc only removes stored files no recorded project uses."""
+    path, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    _render(source, destination / "kept", LinkMode.REFLINK)
+    _render(source, destination / "removed", LinkMode.REFLINK)
+    (source / "plain.txt").write_text("Only in removed\n")
+    _render(source, destination / "removed", LinkMode.REFLINK)
+    (path / "unused.txt").write_text("unused")
+    store = BlobStore(LinkMode.REFLINK)
+    store.add_file(path / "unused.txt")
+    (destination / "removed" / "plain.txt").unlink()
+
+    assert store.gc(dry_run=True) == (2, 22, 0)
+    assert len(list((blob_dir / "objects").glob("*/*"))) == 4
+
+    assert store.gc() == (2, 22, 0)
+    assert len(list((blob_dir / "objects").glob("*/*"))) == 2
+
+    for project in ("kept", "removed"):
+        for name in ("plain.txt", "run.sh"):
+            (destination / project / name).unlink(missing_ok=True)
+    assert store.gc() == (2, 40, 2)
+    assert not any((blob_dir / "objects").glob("*/*"))
@@ -0,0 +1,151 @@
+import os
+import subprocess
+import time
+
+import jinja2
+import pytest
+
+from itmpl import budgets, templating
+from itmpl.budgets import BudgetError, Budgets
+
+needs_fork = pytest.mark.skipif(
+    budgets.resource is None, reason="needs fork and the resource module"
+)
+needs_process_groups = pytest.mark.skipif(
+    not hasattr(os, "killpg"), reason="needs fork and process groups"
+)
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return "done"
+
+
+def _allocate(size):
+    return len(bytearray(size))
+
+
+def _fail():
+    raise ValueError("broken hook")
+
+
+def test_strictest():
+    assert budgets.strictest(
+        Budgets(hook_timeout=5, render_timeout=1),
+        Budgets(hook_timeout=2, max_output_kb=10),
+    ) == Budgets(hook_timeout=2, render_timeout=1, max_output_kb=10)
+
+
+@needs_process_groups
+def test_run_limited_timeout():
+    """Test that a hook running past its timeout is killed."""
+    start = time.monotonic()
+    with pytest.raises(BudgetError, match="timed out"):
+        budgets.run_limited(_sleep, (5,), Budgets(hook_timeout=0.1))
+    assert time.monotonic() - start < 2
+
+    assert budgets.run_limited(_sleep, (0,), Budgets(hook_timeout=5)) == "done"
+
+
+@needs_process_groups
+def test_run_limited_timeout_kills_commands(tmp_path):
+    """Test that commands started by a hook that runs out of time are killed
+    with it, so they can't keep writing after the render fails."""
+    marker = tmp_path / "written"
+
+    def post_script():
+        subprocess.Popen(["sh", "-c", f"sleep 0.5 && touch {marker}"])
+        time.sleep(5)
+
+    with pytest.raises(BudgetError, match="timed out"):
+        budgets.run_limited(post_script, (), Budgets(hook_timeout=0.1))
+
+    time.sleep(1)
+    assert not marker.exists()
+
+
+@needs_fork
+def test_run_limited_memory():
+    """Test that a hook using too much memory fails, without affecting this
+    process, and results and exceptions come back from the child."""
+    with pytest.raises(BudgetError, match="MiB"):
+        budgets.run_limited(
+            _allocate, (4 * 1024**3,), Budgets(hook_memory_mb=2 * 1024)
+        )
+
+    assert budgets.run_limited(_allocate, (1024,), Budgets(hook_memory_mb=4096)) == 1024
+    with pytest.raises(ValueError, match="broken hook"):
+        budgets.run_limited(_fail, (), Budgets(hook_memory_mb=4096))
+
+
+@needs_fork
+def test_run_limited_memory_timeout():
+    """Test that a child process running past its timeout is killed."""
+    with pytest.raises(BudgetError, match="timed out"):
+        budgets.run_limited(
+            _sleep, (5,), Budgets(hook_timeout=0.1, hook_memory_mb=4096)
+        )
+
+
+def test_render_limited_max_output():
+    template = jinja2.Template("{% for i in range(10000) %}0123456789{% endfor %}")
+    with pytest.raises(BudgetError, match="1 KiB"):
+        budgets.render_limited(template.generate, Budgets(max_output_kb=1))
+
+    assert (
+        budgets.render_limited(
+            jinja2.Template("{{ 1 + 1 }}").generate, Budgets(max_output_kb=1)
+        )
+        == "2"
+    )
+
+
+@pytest.mark.skipif(not hasattr(budgets.signal, "setitimer"), reason="needs SIGALRM")
+def test_render_limited_timeout_without_output():
+    """Test that a loop that produces no output is still stopped."""
+    template = jinja2.Template("{% for i in range(10**9) %}{% endfor %}")
+    with pytest.raises(BudgetError, match="timed out"):
+        budgets.render_limited(template.generate, Budgets(render_timeout=0.2))
+
+
+def test_render_template_budgets(tempdir):
+    """Test that budgets in .itmpl.toml are enforced, and reported with the
+    hook or file that exceeded them."""
+    _, source, destination = tempdir
+    (source / ".itmpl.toml").write_text(
+        "[metadata.budgets]\nhook_timeout = 0.1\nmax_output_kb = 1\n"
+    )
+    (source / ".itmpl.py").write_text(
+        "import time\n\n"
+        "def get_variables(name, destination, variables):\n"
+        "    time.sleep(5)\n"
+        "    return {}\n"
+    )
+
+    with pytest.raises(templating.TemplatingException, match="get_variables"):
+        templating.render_template(
+            project_name="test-project",
+            template="test-template",
+            destination=destination / "out",
+            template_path=source,
+        )
+
+    (source / ".itmpl.py").unlink()
+    (source / "big.txt").write_text("{{ 'x' * 4096 }}")
+    with pytest.raises(templating.TemplatingException, match="big.txt"):
+        templating.render_template(
+            project_name="test-project",
+            template="test-template",
+            destination=destination / "out",
+            template_path=source,
+        )
+
+    # Looser command line budgets don't override the template's
+    with pytest.raises(templating.TemplatingException, match="big.txt"):
+        templating.render_template(
+            project_name="test-project",
+            template="test-template",
+            destination=destination / "out",
+            template_path=source,
+            budgets=Budgets(max_output_kb=100),
+        )
@@ -0,0 +1,116 @@
+import jinja2
+
+from itmpl import check, templating
+
+HOOK = "def get_variables(project_name, destination, variables):\n    {}\n"
+
+TEMPLATE = {
+    ".itmpl.toml": '[variables]\nauthor = "me"\n',
+    ".itmpl.py": HOOK.format("return {'greeting': 'hello'}"),
+    "ok.txt": "{{ greeting }} {{ author }} {{ project_name }}\n",
+}
+
+
+def test_check_valid_template(tempdir, write_template):
+    """Test that a template using only defined variables has no problems."""
+    _, source, _ = tempdir
+    write_template(source, TEMPLATE)
+    (source / "{{ project_name }}").mkdir()
+    (source / "loop.txt").write_text("{% for i in range(3) %}{{ i }}{% endfor %}\n")
+
+    assert check.check_template(source) == []
+
+
+def test_check_reports_problems(tempdir, write_template):
+    """Test that syntax errors and undefined variables are reported with the
+    file and line they are on."""
+    _, source, _ = tempdir
+    write_template(source, TEMPLATE)
+    (source / "broken.txt").write_text("line one\n{% if %}\n")
+    (source / "undefined.txt").write_text("\n\n{{ missing }}\n")
+    (source / "{{ other }}.txt").write_text("")
+
+    problems = check.check_template(source)
+
+    assert [(p.path, p.line, p.error) for p in problems] == [
+        ("broken.txt", 2, True),
+        ("undefined.txt", 3, True),
+        ("{{ other }}.txt", 1, True),
+    ]
+    assert "missing" in problems[1].message
+    assert "other" in problems[2].message
+
+
+def test_check_respects_templating_excludes(tempdir, write_template):
+    """Test that files excluded from templating are not checked."""
+    _, source, _ = tempdir
+    write_template(source, TEMPLATE)
+    (source / ".itmpl.toml").write_text(
+        '[metadata]\ntemplating_excludes = ["raw.txt"]\n'
+    )
+    (source / "raw.txt").write_text("{% if %}\n")
+
+    assert [p.path for p in check.check_template(source)] == ["ok.txt"]
+
+
+def test_check_warns_when_hook_variables_are_unknown(tempdir, write_template):
+    """Test that undefined variables are only warnings when a hook returns
+    variables that can't be found without running it."""
+    _, source, _ = tempdir
+    write_template(
+        source,
+        {**TEMPLATE, ".itmpl.py": HOOK.format("return dict(**variables)")},
+    )
+
+    problems = check.check_template(source)
+
+    assert [p.message for p in problems] == [
+        "Contents uses undefined variable greeting"
+    ]
+    assert not problems[0].error
+
+
+def test_hook_variables():
+    """Test that variables are found in the dicts hooks return."""
+    source = (
+        "def get_variables(project_name, destination, variables):\n"
+        "    def helper():\n"
+        "        return compute()\n"
+        "    if project_name:\n"
+        "        return {'a': 1}\n"
+        "    return dict(b=2)\n"
+        "async def post_script(project_name, destination, variables):\n"
+        "    return None\n"
+        "def other():\n"
+        "    return {'c': 3}\n"
+    )
+
+    assert check.hook_variables(source) == ({"a", "b"}, True)
+    assert check.hook_variables("def post_script(*args):\n    return x\n") == (
+        set(),
+        False,
+    )
+
+
+def test_check_stores_compiled_templates(
+    tempdir, compiled_dir, monkeypatch, write_template
+):
+    """Test that templates compiled by check are loaded rather than compiled
+    again."""
+    _, source, _ = tempdir
+    write_template(source, TEMPLATE)
+    check.check_template(source)
+    assert any(compiled_dir.iterdir())
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Template was compiled again")
+
+    templating.clear_compile_cache()
+    monkeypatch.setattr(jinja2.Environment, "compile", fail)
+    template = templating.compile_template(
+        "{{ greeting }} {{ author }} {{ project_name }}\n"
+    )
+
+    assert template.render(greeting="hi", author="me", project_name="p") == (
+        "hi me p\n"
+    )
@@ -0,0 +1,96 @@
+import subprocess
+import sys
+
+from itmpl import blobstore, client, global_vars, tree_utils
+from itmpl.durability import Durability
+
+
+def test_import_only_standard_library():
+    """Test that the client doesn't import the rest of iTmpl or its
+    dependencies."""
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, itmpl.client; print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    for module in ["typer", "click", "jinja2", "pydantic", "rich", "itmpl.main"]:
+        assert module not in modules
+
+
+def test_modes_match_enums():
+    """Test that the options accepted by the client match the full CLI's."""
+    assert client.DURABILITY_MODES == tuple(mode.value for mode in Durability)
+    assert client.LINK_MODES == tuple(mode.value for mode in blobstore.LinkMode)
+
+
+def test_forward_new(running_daemon, template_dirs, capsys):
+    """Test that `itmpl new` is rendered by a running daemon."""
+    socket_path, _ = running_daemon
+    templates, destination = template_dirs
+    tree_utils.copy_tree(
+        templates / "test-template-empty-files",
+        global_vars.TEMPLATES_DIR / "test-template-empty-files",
+    )
+
+    exit_code = client.forward_new(
+        [
+            "test-template-empty-files",
+            "test-project",
+            "--path",
+            str(destination),
+            "--socket",
+            str(socket_path),
+            "--durability",
+            "ATOMIC",
+        ],
+    )
+
+    assert exit_code == 0
+    assert (destination / "test-project").is_dir()
+    assert f"project at {destination / 'test-project'}" in capsys.readouterr().out
+
+
+def test_forward_new_error(running_daemon, tempdir, capsys):
+    """Test that errors from the daemon are reported without falling back."""
+    socket_path, _ = running_daemon
+    _, _, destination = tempdir
+
+    exit_code = client.forward_new(
+        [
+            "missing",
+            "test-project",
+            "-p",
+            str(destination),
+            "--socket",
+            str(socket_path),
+        ]
+    )
+
+    assert exit_code == 1
+    assert "Template missing not found" in capsys.readouterr().out
+
+
+def test_forward_new_falls_back(running_daemon, tempdir):
+    """Test that the full CLI renders what the daemon can't."""
+    socket_path, _ = running_daemon
+    path, _, destination = tempdir
+    new = ["template", "test-project", "--path", str(destination)]
+    socket = ["--socket", str(socket_path)]
+
+    assert client.forward_new(new + ["--socket", str(path / "missing.sock")]) is None
+    assert client.forward_new(new + socket + ["--no-daemon"]) is None
+    assert client.forward_new(new + socket + ["--profile"]) is None
+    assert client.forward_new(new + socket + ["--hook-timeout", "-1"]) is None
+    assert client.forward_new(new + socket + ["--links", "copy"]) is None
+    assert client.forward_new(new + socket + ["--help"]) is None
+    assert client.forward_new(["template.itmplpack", "test-project"] + socket) is None
+    assert (
+        client.forward_new(["template", "test-project", "-p", str(path / "x")] + socket)
+        is None
+    )
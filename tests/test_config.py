@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from typer.testing import CliRunner
@@ -81,3 +82,22 @@ def test_reset_config(monkeypatch, mock_config_file):
 
     c = config.read_config()
     assert c.extra_templates_dir == global_vars.APP_DIR / "templates"
+
+
+def test_set_template_dirs(monkeypatch, mock_config_file, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    result = runner.invoke(
+        config.app,
+        ["set", "template_dirs", f"{tmp_path / 'a'}{os.pathsep}{tmp_path / 'b'}"],
+    )
+    assert result.exit_code == 0
+
+    c = config.read_config()
+    assert c.template_dirs == [tmp_path / "a", tmp_path / "b"]
+
+    result = runner.invoke(
+        config.app,
+        ["set", "template_dirs", str(tmp_path / "missing")],
+    )
+    assert result.exit_code == 2
@@ -0,0 +1,117 @@
+import os
+
+from itmpl import daemon, global_vars, templating, tree_utils
+
+
+def test_ping(running_daemon):
+    """Test that a running daemon is detected."""
+    socket_path, _ = running_daemon
+    assert daemon.is_running(socket_path)
+    assert not daemon.is_running(socket_path.parent / "missing.sock")
+
+
+def test_render(running_daemon, template_dirs):
+    """Test that the daemon renders templates, and picks up new templates
+    without restarting."""
+    socket_path, _ = running_daemon
+    templates, destination = template_dirs
+    tree_utils.copy_tree(
+        templates / "test-template-empty-files",
+        global_vars.TEMPLATES_DIR / "test-template-empty-files",
+    )
+
+    response = daemon.render(
+        socket_path,
+        daemon.RenderRequest(
+            template="test-template-empty-files",
+            name="test-project",
+            destination=destination / "test-project",
+        ),
+    )
+
+    assert response.ok, response.error
+    assert response.destination == destination / "test-project"
+    assert (destination / "test-project").is_dir()
+    assert not list((destination / "test-project").glob(".itmpl*"))
+
+
+def test_render_with_client_environment(running_daemon, tempdir, monkeypatch):
+    """Test that hooks run with the client's environment variables and working
+    directory, and the daemon's are restored afterwards."""
+    socket_path, _ = running_daemon
+    path, source, destination = tempdir
+    template = source / "environment"
+    template.mkdir()
+    (template / ".itmpl.py").write_text(
+        "import os\n"
+        "def get_variables(project_name, destination, variables):\n"
+        "    return {'value': os.environ.get('ITMPL_TEST_VALUE'),\n"
+        "            'cwd': os.getcwd()}\n"
+    )
+    (template / "out.txt").write_text("{{ value }} {{ cwd }}")
+    monkeypatch.delenv("ITMPL_TEST_VALUE", raising=False)
+    cwd = os.getcwd()
+
+    response = daemon.render(
+        socket_path,
+        daemon.RenderRequest(
+            template="environment",
+            name="test-project",
+            destination=destination / "test-project",
+            environment={**os.environ, "ITMPL_TEST_VALUE": "client"},
+            cwd=path,
+        ),
+    )
+
+    assert response.ok, response.error
+    assert (destination / "test-project" / "out.txt").read_text() == (f"client {path}")
+    assert "ITMPL_TEST_VALUE" not in os.environ
+    assert os.getcwd() == cwd
+
+
+def test_render_unknown_template(running_daemon, tempdir):
+    """Test that rendering a template that doesn't exist returns an error."""
+    socket_path, _ = running_daemon
+    _, _, destination = tempdir
+
+    response = daemon.render(
+        socket_path,
+        daemon.RenderRequest(
+            template="missing",
+            name="test-project",
+            destination=destination / "test-project",
+        ),
+    )
+
+    assert not response.ok
+    assert not response.interactive
+    assert "missing" in response.error
+
+
+def test_unknown_command(running_daemon):
+    """Test that unknown commands return an error rather than crashing."""
+    socket_path, _ = running_daemon
+    response = daemon.send_request(socket_path, {"command": "explode"})
+    assert response == {"ok": False, "error": "Unknown command: explode"}
+
+
+def test_compile_template_cached():
+    """Test that identical template sources are only compiled once."""
+    first = templating.compile_template("Hello {{ name }}")
+    second = templating.compile_template("Hello {{ name }}")
+    assert first is second
+    assert first.render(name="World") == "Hello World"
+
+
+def test_compile_cache_info():
+    """Test that compile cache statistics count hits, and clearing the cache
+    forgets compiled templates."""
+    templating.clear_compile_cache()
+    templating.compile_template("Hello {{ name }}")
+    templating.compile_template("Hello {{ name }}")
+
+    info = templating.compile_cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    templating.clear_compile_cache()
+    assert templating.compile_cache_info().currsize == 0
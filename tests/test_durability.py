@@ -0,0 +1,76 @@
+import os
+import stat
+
+import pytest
+
+from itmpl import durability, profiling, templating
+from itmpl.durability import Durability, OutputWriter
+
+
+@pytest.mark.parametrize("mode", list(Durability))
+def test_write_bytes(tempdir, mode):
+    """Test that every mode replaces a file's contents, keeps its permissions
+    and leaves no temporary files behind."""
+    _, source, _ = tempdir
+    path = source / "script.sh"
+    path.write_text("old")
+    path.chmod(0o750)
+
+    OutputWriter(mode).write_bytes(path, b"new")
+
+    assert path.read_bytes() == b"new"
+    assert stat.S_IMODE(path.stat().st_mode) == 0o750
+    assert os.listdir(source) == ["script.sh"]
+
+
+def test_sync_follows_renames(tempdir, monkeypatch):
+    """Test that files are still synced after they, or their directories, are
+    renamed, and nothing is synced twice."""
+    _, source, _ = tempdir
+    monkeypatch.setattr(durability, "_syncfs", None)
+    synced = []
+    monkeypatch.setattr(durability, "_fsync_path", lambda p, **_: synced.append(p))
+    (source / "{{ name }}").mkdir()
+    writer = OutputWriter(Durability.DURABLE)
+    writer.write_bytes(source / "{{ name }}" / "a.txt", b"a")
+
+    writer.rename(source / "{{ name }}", source / "project")
+    writer.sync(source)
+
+    assert source / "project" / "a.txt" in synced
+    assert source / "project" in synced
+    assert source / "{{ name }}" not in synced
+    assert writer.sync(source) == 1
+
+
+@pytest.mark.skipif(durability._syncfs is None, reason="needs syncfs")
+def test_sync_syncfs(tempdir):
+    """Test that one syncfs call covers everything written to a
+    filesystem."""
+    _, source, _ = tempdir
+    writer = OutputWriter(Durability.DURABLE)
+    for name in ["a", "b", "c"]:
+        writer.write_bytes(source / name, b"x")
+
+    assert writer.sync() == 1
+
+
+def test_render_template_durable(template_dirs):
+    """Test that a durable render is synced in its own profiled phase."""
+    source, destination = template_dirs
+    profiler = profiling.Profiler()
+
+    templating.render_template(
+        project_name="test-project",
+        template="test-template-empty-files",
+        destination=destination / "test-project",
+        template_path=source / "test-template-empty-files",
+        prompt_if_duplicates=False,
+        profiler=profiler,
+        durability=Durability.DURABLE,
+    )
+
+    assert profiler.report.durability == Durability.DURABLE
+    assert profiler.report.phases[-1].name == "sync"
+    assert profiler.report.phases[-1].sync_calls > 0
+    assert not list((destination / "test-project").rglob("*.tmp"))
@@ -0,0 +1,224 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from itmpl import async_templating, events, profiling, templating
+
+
+class RecordingObserver(events.RenderObserver):
+    def __init__(self):
+        self.events = []
+
+    def on_event(self, event):
+        self.events.append(event)
+
+
+def _make_template(source: Path) -> Path:
+    template = source / "evented"
+    template.mkdir()
+    (template / ".itmpl.toml").write_text("[metadata]\n")
+    (template / ".itmpl.py").write_text(
+        "def get_variables(project_name, destination, variables):\n"
+        "    return {'greeting': 'hello'}\n"
+    )
+    (template / "static.txt").write_text("No templating here\n")
+    (template / "dynamic.txt").write_text("{{ greeting }} {{ project_name }}\n")
+    return template
+
+
+def test_render_emits_events(tempdir):
+    """Test that a render sends start, file, hook and finish events."""
+    _, source, destination = tempdir
+    template = _make_template(source)
+    observer = RecordingObserver()
+
+    templating.render_template(
+        project_name="test-project",
+        template="evented",
+        destination=destination / "test-project",
+        template_path=template,
+        prompt_if_duplicates=False,
+        profiler=profiling.Profiler(enabled=False, observers=[observer]),
+    )
+
+    kinds = [event.event for event in observer.events]
+    assert kinds[0] == "render_started"
+    assert kinds[-1] == "render_finished"
+    assert kinds.index("hook_started") < kinds.index("hook_finished")
+    assert all(event.template == "evented" for event in observer.events)
+
+    rendered = {
+        event.path.name
+        for event in observer.events
+        if isinstance(event, events.FileRendered)
+    }
+    skipped = {
+        event.path.name
+        for event in observer.events
+        if isinstance(event, events.FileSkipped)
+    }
+    assert "dynamic.txt" in rendered
+    assert "static.txt" in skipped
+
+    finished = observer.events[-1]
+    assert finished.ok
+    assert finished.files_rendered == len(rendered)
+    assert finished.files_skipped == len(skipped)
+    assert finished.files_copied == sum(
+        isinstance(event, events.FileCopied) for event in observer.events
+    )
+    assert finished.files_copied >= 2
+
+
+def test_async_render_emits_events(tempdir):
+    """Test that renders through a RenderPool send the same events as
+    render_template, to the pool's observers."""
+    _, source, destination = tempdir
+    template = _make_template(source)
+    observer = RecordingObserver()
+
+    async def render_all():
+        async with async_templating.RenderPool(observers=[observer]) as pool:
+            await asyncio.gather(
+                *(
+                    pool.render_template(
+                        project_name=f"project-{i}",
+                        template="evented",
+                        destination=destination / f"project-{i}",
+                        template_path=template,
+                    )
+                    for i in range(2)
+                )
+            )
+
+    asyncio.run(render_all())
+
+    finished = [e for e in observer.events if isinstance(e, events.RenderFinished)]
+    assert len(finished) == 2
+    assert all(e.ok and e.files_rendered == 1 for e in finished)
+    assert all(e.files_skipped == 1 and e.files_copied >= 2 for e in finished)
+    kinds = [event.event for event in observer.events]
+    assert kinds.count("render_started") == 2
+    assert kinds.count("hook_finished") == 2
+    assert all(event.template == "evented" for event in observer.events)
+
+
+def test_failed_render_emits_error(tempdir):
+    """Test that a failed render still sends a render_finished event."""
+    _, source, destination = tempdir
+    template = _make_template(source)
+    (template / ".itmpl.py").write_text(
+        "def get_variables(project_name, destination, variables):\n"
+        "    raise ValueError('broken hook')\n"
+    )
+    observer = RecordingObserver()
+
+    with pytest.raises(templating.TemplatingException):
+        templating.render_template(
+            project_name="test-project",
+            template="evented",
+            destination=destination / "test-project",
+            template_path=template,
+            prompt_if_duplicates=False,
+            profiler=profiling.Profiler(enabled=False, observers=[observer]),
+        )
+
+    hook_finished = next(
+        event for event in observer.events if isinstance(event, events.HookFinished)
+    )
+    assert not hook_finished.ok
+    finished = observer.events[-1]
+    assert isinstance(finished, events.RenderFinished)
+    assert not finished.ok
+    assert "broken hook" in finished.error
+
+
+def test_metrics_exporter_writes_files(tempdir):
+    """Test that the exporter writes a Prometheus textfile and JSON lines."""
+    path, _, _ = tempdir
+    exporter = events.MetricsExporter(
+        textfile=path / "metrics" / "itmpl.prom",
+        jsonl=path / "metrics" / "events.jsonl",
+    )
+
+    exporter.on_event(events.RenderStarted(template="t", destination=path))
+    exporter.on_event(
+        events.HookFinished(template="t", hook="post_script", duration=0.5)
+    )
+    exporter.on_event(
+        events.RenderFinished(
+            template="t",
+            destination=path,
+            duration=1.5,
+            files_rendered=2,
+            bytes_written=12345678,
+        )
+    )
+    exporter.close()
+
+    lines = (path / "metrics" / "events.jsonl").read_text().splitlines()
+    assert [json.loads(line)["event"] for line in lines] == [
+        "render_started",
+        "hook_finished",
+        "render_finished",
+    ]
+
+    textfile = (path / "metrics" / "itmpl.prom").read_text()
+    assert "# TYPE itmpl_renders_total counter" in textfile
+    assert 'itmpl_renders_total{status="ok",template="t"} 1' in textfile
+    assert 'itmpl_files_rendered_total{template="t"} 2' in textfile
+    assert 'itmpl_bytes_written_total{template="t"} 12345678' in textfile
+    assert 'itmpl_render_duration_seconds_sum{template="t"} 1.5' in textfile
+    assert 'itmpl_hook_duration_seconds_count{hook="post_script"} 1' in textfile
+
+
+def test_metrics_exporters_add_to_textfile(tempdir):
+    """Test that exporters in separate processes add to the counters in the
+    textfile, rather than replacing them."""
+    path, _, _ = tempdir
+    textfile = path / "itmpl.prom"
+    template = 'a"b\\c'
+
+    for _ in range(3):
+        # A new exporter for each process, as for `itmpl new`
+        exporter = events.MetricsExporter(textfile=textfile)
+        exporter.on_event(
+            events.RenderFinished(
+                template=template, destination=path, duration=0.5, files_rendered=2
+            )
+        )
+        exporter.on_event(
+            events.RenderFinished(template=template, destination=path, ok=False)
+        )
+
+    text = textfile.read_text()
+    assert 'itmpl_renders_total{status="ok",template="a\\"b\\\\c"} 3' in text
+    assert 'itmpl_renders_total{status="error",template="a\\"b\\\\c"} 3' in text
+    assert 'itmpl_files_rendered_total{template="a\\"b\\\\c"} 6' in text
+    assert 'itmpl_render_duration_seconds_sum{template="a\\"b\\\\c"} 1.5' in text
+    assert text.count("# TYPE itmpl_renders_total counter") == 1
+
+
+def test_metrics_exporter_escapes_labels():
+    """Test that label values are escaped in the Prometheus text format."""
+    exporter = events.MetricsExporter()
+    exporter.on_event(
+        events.RenderFinished(template='a"b\\c', destination=Path("."), ok=False)
+    )
+
+    assert (
+        'itmpl_renders_total{status="error",template="a\\"b\\\\c"} 1'
+        in exporter.render_textfile()
+    )
+
+
+def test_configured_observers(mock_config_file, tmp_path):
+    """Test that an exporter is only configured when metrics_dir is set."""
+    assert events.configured_observers() == []
+
+    mock_config_file.write_text(json.dumps({"metrics_dir": str(tmp_path)}))
+    [exporter] = events.configured_observers()
+    assert exporter.textfile == tmp_path / events.TEXTFILE_NAME
+    assert exporter.jsonl == tmp_path / events.JSONL_NAME
@@ -0,0 +1,194 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from itmpl import config, git_templates, global_vars, templating
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+
+def _git(repo, *args):
+    return subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=repo,
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture
+def git_dir(tmp_path, monkeypatch):
+    path = tmp_path / "git"
+    monkeypatch.setattr(git_templates, "GIT_DIR", path)
+    monkeypatch.setattr(git_templates, "_resolved", {})
+    return path
+
+
+@pytest.fixture
+def template_repo(tempdir):
+    """Create a repository containing one template, and return it with its
+    first commit."""
+    _, source, _ = tempdir
+    _git(source, "init", "--quiet")
+    (source / "greeting").mkdir()
+    (source / "greeting" / "README.md").write_text("Hello {{ project_title }}\n")
+    _git(source, "add", "-A")
+    _git(source, "commit", "--quiet", "-m", "Add greeting")
+    _git(source, "tag", "v1")
+    return source, _git(source, "rev-parse", "HEAD")
+
+
+def test_parse_repo_spec(tmp_path):
+    assert git_templates.parse_repo_spec("https://example.com/t.git#v1") == (
+        "https://example.com/t.git",
+        "v1",
+    )
+    assert git_templates.parse_repo_spec("git@example.com:org/t.git") == (
+        "git@example.com:org/t.git",
+        None,
+    )
+    assert git_templates.parse_repo_spec(str(tmp_path)) == (str(tmp_path), None)
+
+
+def test_get_repo_root(git_dir, template_repo):
+    """Test that a ref is exported from a bare mirror without a checkout."""
+    source, commit = template_repo
+
+    root = git_templates.get_repo_root(f"{source}#v1", max_age=3600)
+
+    assert root == git_dir / "snapshots" / commit
+    assert (root / "greeting" / "README.md").exists()
+    repo = git_templates.repo_path(str(source))
+    assert (repo / "HEAD").exists()
+    assert not (repo / "greeting").exists()
+
+
+def test_get_repo_root_refresh(git_dir, template_repo):
+    """Test that a stale mirror is fetched, and new commits are exported."""
+    source, first_commit = template_repo
+    git_templates.get_repo_root(str(source), max_age=3600)
+
+    (source / "greeting" / "README.md").write_text("Hi\n")
+    _git(source, "commit", "--quiet", "-am", "Change greeting")
+    second_commit = _git(source, "rev-parse", "HEAD")
+
+    # Still fresh, so not fetched
+    git_templates._resolved.clear()
+    assert git_templates.get_repo_root(str(source), max_age=3600).name == first_commit
+
+    git_templates._resolved.clear()
+    assert git_templates.get_repo_root(str(source), max_age=0).name == second_commit
+    # Left for renders that may still be using it
+    assert (git_dir / "snapshots" / first_commit).exists()
+
+
+def test_prune_snapshots(git_dir, template_repo):
+    """Test that only snapshots no ref resolves to, and that haven't been used
+    recently, are pruned."""
+    source, first_commit = template_repo
+    git_templates.get_repo_root(str(source), max_age=3600)
+    (source / "greeting" / "README.md").write_text("Hi\n")
+    _git(source, "commit", "--quiet", "-am", "Change greeting")
+    git_templates._resolved.clear()
+    second_commit = git_templates.get_repo_root(str(source), max_age=0).name
+
+    assert git_templates.prune_snapshots() == []
+    first_snapshot = git_dir / "snapshots" / first_commit
+    assert git_templates.prune_snapshots(grace_period=0, dry_run=True) == [
+        first_snapshot
+    ]
+    assert first_snapshot.exists()
+
+    assert git_templates.prune_snapshots(grace_period=0) == [first_snapshot]
+    assert not first_snapshot.exists()
+    assert (git_dir / "snapshots" / second_commit).exists()
+
+
+def test_get_repo_root_recorded_ref(git_dir, template_repo, monkeypatch):
+    """Test that a ref resolved since the mirror was last fetched needs no git
+    commands in another process."""
+    source, commit = template_repo
+    git_templates.get_repo_root(f"{source}#v1", max_age=3600)
+    git_templates._resolved.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("git was run")
+
+    monkeypatch.setattr(git_templates, "_git", fail)
+    root = git_templates.get_repo_root(f"{source}#v1", max_age=3600)
+    assert root == git_dir / "snapshots" / commit
+
+
+def test_get_repo_root_failed_fetch(git_dir, template_repo, monkeypatch):
+    """Test that a failed fetch falls back to the mirror, and isn't retried
+    until FETCH_RETRY_DELAY has passed."""
+    source, commit = template_repo
+    git_templates.get_repo_root(str(source), max_age=60)
+    shutil.rmtree(source)
+    repo = git_templates.repo_path(str(source))
+    fetches = []
+    git = git_templates._git
+
+    def counting_git(*args, **kwargs):
+        if args[0] == "fetch":
+            fetches.append(args)
+        return git(*args, **kwargs)
+
+    monkeypatch.setattr(git_templates, "_git", counting_git)
+    for _ in range(2):
+        git_templates._resolved.clear()
+        os.utime(repo / "HEAD", (time.time() - 120, time.time() - 120))
+        assert git_templates.get_repo_root(str(source), max_age=60).name == commit
+    assert len(fetches) == 1
+
+    monkeypatch.setattr(git_templates, "FETCH_RETRY_DELAY", 0.0)
+    git_templates._resolved.clear()
+    os.utime(repo / "HEAD", (time.time() - 120, time.time() - 120))
+    git_templates.get_repo_root(str(source), max_age=60)
+    assert len(fetches) == 2
+
+
+def test_get_repo_root_exported_commit(git_dir, template_repo, monkeypatch):
+    """Test that a commit that has been exported before needs no git
+    commands."""
+    source, commit = template_repo
+    git_templates.get_repo_root(f"{source}#{commit}", max_age=3600)
+    git_templates._resolved.clear()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("git was run")
+
+    monkeypatch.setattr(git_templates, "_git", fail)
+    root = git_templates.get_repo_root(f"{source}#{commit}", max_age=3600)
+    assert root == git_dir / "snapshots" / commit
+
+
+def test_render_git_template(git_dir, template_repo, tempdir, monkeypatch):
+    """Test that templates in a repository can be rendered."""
+    source, _ = template_repo
+    path, builtin, destination = tempdir
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(
+            extra_templates_dir=path / "extra",
+            template_repos=[f"{source}#v1"],
+        ).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", path / "builtin")
+    (path / "builtin").mkdir()
+
+    template_path, toml = templating.get_template_options()["greeting"]
+    templating.render_template(
+        project_name="test-project",
+        template="greeting",
+        destination=destination / "out",
+        template_path=template_path,
+        exclude=toml.metadata.templating_excludes,
+    )
+
+    assert (destination / "out" / "README.md").read_text() == "Hello Test Project\n"
@@ -0,0 +1,47 @@
+import pytest
+
+from itmpl import ignore
+
+
+@pytest.mark.parametrize(
+    "patterns, path, is_dir, expected",
+    [
+        (["*.pyc"], "a.pyc", False, True),
+        (["*.pyc"], "src/pkg/a.pyc", False, True),
+        (["*.pyc"], "a.py", False, False),
+        (["node_modules/"], "node_modules", True, True),
+        (["node_modules/"], "web/node_modules", True, True),
+        (["node_modules/"], "node_modules", False, False),
+        (["/build"], "build", True, True),
+        (["/build"], "src/build", True, False),
+        (["docs/*.md"], "docs/a.md", False, True),
+        (["docs/*.md"], "docs/api/a.md", False, False),
+        (["docs/**/*.md"], "docs/api/a.md", False, True),
+        (["docs/**/*.md"], "docs/a.md", False, True),
+        (["**/cache"], "a/b/cache", True, True),
+        (["logs/**"], "logs/today/a.log", False, True),
+        (["*.log", "!keep.log"], "keep.log", False, False),
+        (["*.log", "!keep.log"], "other.log", False, True),
+        (["*.log", "!keep.log", "keep.log"], "keep.log", False, True),
+        (["file?.txt"], "file1.txt", False, True),
+        (["file[!0-9].txt"], "file1.txt", False, False),
+        (["# comment", "", "\\#literal"], "#literal", False, True),
+    ],
+)
+def test_is_ignored(patterns, path, is_dir, expected):
+    assert ignore.IgnoreRules(patterns).is_ignored(path, is_dir) == expected
+
+
+def test_read_ignore_rules(tempdir):
+    """Test that copy_excludes are combined with each layer's .itmplignore,
+    with later layers able to re-include paths."""
+    _, source, destination = tempdir
+    (source / ignore.IGNORE_FILE).write_text("*.log\n")
+    (destination / ignore.IGNORE_FILE).write_text("!keep.log\n")
+
+    rules = ignore.read_ignore_rules([source, destination], ["/dist"])
+
+    assert rules.is_ignored("dist", True)
+    assert rules.is_ignored("other.log", False)
+    assert not rules.is_ignored("keep.log", False)
+    assert not ignore.read_ignore_rules([destination / "missing"])
@@ -0,0 +1,177 @@
+import os
+import time
+
+import pytest
+
+from itmpl import config, global_vars, template_index, templating
+
+
+@pytest.fixture
+def template_roots(tempdir, monkeypatch):
+    """Configure a built-in and a personal template root."""
+    path, source, destination = tempdir
+    personal = path / "personal"
+    personal.mkdir()
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(
+            extra_templates_dir=path / "extra",
+            template_dirs=[personal],
+        ).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+    return source, personal, destination
+
+
+def test_render_extended_template(template_roots, write_template):
+    """Test that a template is rendered as an overlay of its base, with merged
+    variables."""
+    builtin, personal, destination = template_roots
+    write_template(
+        builtin / "base",
+        {
+            ".itmpl.toml": '[variables]\ngreeting = "Hello"\nname = "base"\n',
+            "README.md": "{{ greeting }} {{ name }}",
+            "{{ project_name }}/a.txt": "a",
+        },
+    )
+    write_template(
+        personal / "child",
+        {
+            ".itmpl.toml": (
+                '[metadata]\nextends = "base"\n[variables]\nname = "child"\n'
+            ),
+            "{{ project_name }}/a.txt": "overridden",
+            "b.txt": "{{ name }}",
+        },
+    )
+
+    templates = templating.get_template_options()
+    assert templates["child"][1].variables == {"greeting": "Hello", "name": "child"}
+
+    templating.render_template(
+        project_name="test-project",
+        template="child",
+        destination=destination / "out",
+        template_path=personal / "child",
+    )
+
+    out = destination / "out"
+    assert (out / "README.md").read_text() == "Hello child"
+    assert (out / "test-project" / "a.txt").read_text() == "overridden"
+    assert (out / "b.txt").read_text() == "child"
+    assert not (out / ".itmpl.toml").exists()
+
+
+def test_extend_shadowed_template(template_roots, write_template):
+    """Test that a template can extend the template it shadows."""
+    builtin, personal, _ = template_roots
+    write_template(builtin / "project", {".itmpl.toml": "", "a.txt": "a"})
+    write_template(
+        personal / "project", {".itmpl.toml": '[metadata]\nextends = "project"\n'}
+    )
+
+    layers, _ = templating.resolve_template(personal / "project")
+
+    assert layers == [builtin / "project", personal / "project"]
+
+
+def _age(*paths, seconds=60):
+    """Set paths' mtimes into the past, so their indexes can be stored."""
+    mtime = time.time() - seconds
+    for path in paths:
+        os.utime(path, (mtime, mtime))
+
+
+def test_extended_templates_resolved_once(template_roots, monkeypatch, write_template):
+    """Test that listing templates reads the template roots once however many
+    templates extend others, and that what they resolve to is stored in the
+    index until a template changes."""
+    builtin, personal, _ = template_roots
+    write_template(builtin / "base", {".itmpl.toml": '[variables]\nname = "base"\n'})
+    for name in ("a", "b"):
+        write_template(
+            personal / name, {".itmpl.toml": '[metadata]\nextends = "base"\n'}
+        )
+    tomls = [builtin / "base", personal / "a", personal / "b"]
+    _age(builtin, personal, *(path / ".itmpl.toml" for path in tomls))
+    get_template_roots = templating.get_template_roots
+    calls = []
+    monkeypatch.setattr(
+        templating,
+        "get_template_roots",
+        lambda: calls.append(None) or get_template_roots(),
+    )
+
+    templates = templating.get_template_options()
+
+    assert len(calls) == 1
+    assert templates["a"][1].variables == {"name": "base"}
+    indexed = template_index.get_root_index(personal).templates["a"]
+    assert indexed.layers == [builtin / "base", personal / "a"]
+
+    with monkeypatch.context() as m:
+        m.setattr(templating, "_resolve_layers", None)
+        assert templating.get_template_options()["b"][1].variables == {
+            "name": "base",
+        }
+
+    (builtin / "base" / ".itmpl.toml").write_text('[variables]\nname = "new"\n')
+    _age(builtin / "base" / ".itmpl.toml", seconds=30)
+    assert templating.get_template_options()["a"][1].variables == {"name": "new"}
+
+
+def test_extends_cycle(template_roots, write_template):
+    """Test that a cycle of templates extending each other is an error."""
+    _, personal, _ = template_roots
+    write_template(personal / "a", {".itmpl.toml": '[metadata]\nextends = "b"\n'})
+    write_template(personal / "b", {".itmpl.toml": '[metadata]\nextends = "a"\n'})
+
+    with pytest.raises(templating.TemplatingException, match="cycle"):
+        templating.resolve_template(personal / "a")
+
+
+def test_render_preserves_symlinks(template_roots, write_template):
+    """Test that with the preserve policy, symlinked assets are linked rather
+    than copied or templated."""
+    builtin, _, destination = template_roots
+    shared = destination / "shared"
+    shared.mkdir()
+    (shared / "asset.txt").write_text("{{ not_a_variable }}")
+    write_template(
+        builtin / "assets",
+        {
+            ".itmpl.toml": '[metadata]\nsymlinks = "preserve"\n',
+            "README.md": "{{ project_title }}",
+        },
+    )
+    (builtin / "assets" / "shared").symlink_to(shared)
+    (builtin / "assets" / "{{ project_name }}.txt").symlink_to(shared / "asset.txt")
+
+    templating.render_template(
+        project_name="test-project",
+        template="assets",
+        destination=destination / "out",
+        template_path=builtin / "assets",
+    )
+
+    out = destination / "out"
+    assert (out / "shared").resolve() == shared.resolve()
+    assert (out / "test-project.txt").is_symlink()
+    assert (shared / "asset.txt").read_text() == "{{ not_a_variable }}"
+
+
+def test_render_symlink_loop(template_roots, write_template):
+    """Test that a symlink loop in a template is reported as an error."""
+    builtin, _, destination = template_roots
+    write_template(builtin / "loop", {".itmpl.toml": "", "subdir/a.txt": "a"})
+    (builtin / "loop" / "subdir" / "loop").symlink_to("..")
+
+    with pytest.raises(templating.TemplatingException, match="loop"):
+        templating.render_template(
+            project_name="test-project",
+            template="loop",
+            destination=destination / "out",
+            template_path=builtin / "loop",
+        )
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 from itmpl import metadata
+from itmpl.budgets import Budgets
 
 
 def test_read_itmpl_toml():
@@ -17,3 +18,31 @@ def test_read_itmpl_toml_nonexistent_file():
 
     assert toml.metadata.template_description is None
     assert toml.variables == {}
+
+
+def test_merge_itmpl_toml():
+    base = metadata.ItmplToml(
+        metadata=metadata.ItmplMetadata(
+            template_description="Base",
+            template_requirements=["poetry"],
+            templating_excludes=["**/.venv/**"],
+            budgets=Budgets(hook_timeout=10, render_timeout=1),
+        ),
+        variables={"a": 1, "b": 2},
+    )
+    child = metadata.ItmplToml(
+        metadata=metadata.ItmplMetadata(
+            template_requirements=["poetry", "pyyaml"],
+            extends="base",
+            budgets=Budgets(hook_timeout=30),
+        ),
+        variables={"b": 3},
+    )
+
+    merged = metadata.merge_itmpl_toml(base, child)
+
+    assert merged.metadata.template_description == "Base"
+    assert merged.metadata.template_requirements == ["poetry", "pyyaml"]
+    assert merged.metadata.templating_excludes == ["**/.venv/**"]
+    assert merged.metadata.budgets == Budgets(hook_timeout=30, render_timeout=1)
+    assert merged.variables == {"a": 1, "b": 3}
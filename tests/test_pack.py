@@ -0,0 +1,160 @@
+import filecmp
+import importlib.machinery
+import os
+
+import jinja2
+import pytest
+
+from itmpl import pack, profiling, templating
+
+TEMPLATE = {
+    ".itmpl.toml": (
+        '[metadata]\ntemplating_excludes = ["raw/*"]\n\n[variables]\nauthor = "me"\n'
+    ),
+    ".itmpl.py": (
+        "def get_variables(project_name, destination, variables):\n"
+        "    return {'greeting': 'hello'}\n"
+        "\n"
+        "def post_script(project_name, destination, variables):\n"
+        "    (destination / 'late.txt').write_text('{{ late }}')\n"
+        "    return {'late': 'done'}\n"
+    ),
+    "{{ project_name }}/{{ author }}.txt": "{{ greeting }} {{ author }}\n",
+    "plain.txt": "No templating here\n",
+    "crlf.txt": b"one\r\ntwo\r\n",
+    "binary.dat": b"\xff\xfe{{ project_name }}",
+    "run.sh": "#!/bin/sh\necho {{ project_name }}\n",
+    "raw/keep.txt": "{{ not_rendered }}\n",
+}
+
+
+def _compare(left, right):
+    comparison = filecmp.dircmp(left, right)
+    assert not comparison.left_only and not comparison.right_only
+    _, mismatch, errors = filecmp.cmpfiles(
+        left, right, comparison.common_files, shallow=False
+    )
+    assert not mismatch and not errors
+    for directory in comparison.common_dirs:
+        _compare(left / directory, right / directory)
+
+
+def test_pack_classifies_entries(tempdir, write_template):
+    """Test that entries are classified when a template is packed."""
+    path, source, _ = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+
+    header = pack.write_pack(source, path / "test.itmplpack")
+    kinds = {entry.path: entry.kind for entry in header.entries}
+
+    assert kinds["{{ project_name }}"] == pack.EntryKind.DIRECTORY
+    assert kinds["{{ project_name }}/{{ author }}.txt"] == pack.EntryKind.TEXT
+    assert kinds["plain.txt"] == pack.EntryKind.VERBATIM
+    assert kinds["crlf.txt"] == pack.EntryKind.TEXT
+    assert kinds["binary.dat"] == pack.EntryKind.BINARY
+    assert kinds["raw/keep.txt"] == pack.EntryKind.VERBATIM
+    assert kinds[".itmpl.py"] == pack.EntryKind.VERBATIM
+    assert header.hook_pyc is not None
+    assert [entry.path for entry in header.entries].index("raw") < [
+        entry.path for entry in header.entries
+    ].index("raw/keep.txt")
+
+
+def test_render_pack_matches_render_template(tempdir, write_template):
+    """Test that rendering a pack creates the same project as rendering the
+    template it was made from."""
+    path, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    pack.write_pack(source, path / "test.itmplpack")
+
+    template = pack.render_pack(
+        project_name="test-project",
+        pack_path=path / "test.itmplpack",
+        destination=destination / "packed",
+        prompt_if_duplicates=False,
+    )
+    templating.render_template(
+        project_name="test-project",
+        template="source",
+        destination=destination / "unpacked",
+        template_path=source,
+        exclude=["raw/*"],
+        prompt_if_duplicates=False,
+    )
+
+    assert template == "source"
+    _compare(destination / "packed", destination / "unpacked")
+    assert (destination / "packed" / "late.txt").read_text() == "done"
+    assert os.access(destination / "packed" / "run.sh", os.X_OK)
+
+
+def test_render_pack_uses_compiled_code(tempdir, monkeypatch, write_template):
+    """Test that rendering a pack doesn't compile any templates or hooks."""
+    path, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    (source / ".itmpl.py").write_text(
+        "def get_variables(project_name, destination, variables):\n"
+        "    return {'greeting': 'hello'}\n"
+    )
+    pack.write_pack(source, path / "test.itmplpack")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Compiled while rendering")
+
+    templating.clear_compile_cache()
+    monkeypatch.setattr(jinja2.Environment, "compile", fail)
+    monkeypatch.setattr(importlib.machinery.SourceFileLoader, "source_to_code", fail)
+    profiler = profiling.Profiler()
+    pack.render_pack(
+        project_name="test-project",
+        pack_path=path / "test.itmplpack",
+        destination=destination / "project",
+        prompt_if_duplicates=False,
+        profiler=profiler,
+    )
+
+    assert (destination / "project" / "test-project" / "me.txt").read_text() == (
+        "hello me\n"
+    )
+    assert "copy to temp" not in [phase.name for phase in profiler.report.phases]
+
+
+def test_render_pack_without_compatible_code(tempdir, monkeypatch, write_template):
+    """Test that a pack written by another Jinja version is rendered from the
+    stored sources."""
+    path, source, destination = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    pack.write_pack(source, path / "test.itmplpack")
+    monkeypatch.setattr(jinja2, "__version__", "0.0")
+
+    with pack.Pack(path / "test.itmplpack") as opened:
+        assert not opened.compiled
+    pack.render_pack(
+        project_name="test-project",
+        pack_path=path / "test.itmplpack",
+        destination=destination / "project",
+        prompt_if_duplicates=False,
+    )
+
+    assert (destination / "project" / "test-project" / "me.txt").read_text() == (
+        "hello me\n"
+    )
+
+
+def test_open_invalid_pack(tempdir):
+    """Test that a file that isn't a pack raises a TemplatingException."""
+    path, _, _ = tempdir
+    (path / "bad.itmplpack").write_bytes(b"not a pack at all")
+
+    with pytest.raises(templating.TemplatingException):
+        pack.Pack(path / "bad.itmplpack")
+
+
+def test_pack_reports_syntax_errors(tempdir, write_template):
+    """Test that packing a template with a Jinja syntax error fails."""
+    path, source, _ = tempdir
+    write_template(source, TEMPLATE, executable=["run.sh"])
+    (source / "broken.txt").write_text("{% if %}\n")
+
+    with pytest.raises(templating.TemplatingException, match="broken.txt"):
+        pack.write_pack(source, path / "test.itmplpack")
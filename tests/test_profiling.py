@@ -0,0 +1,143 @@
+import json
+from pathlib import Path
+
+from itmpl import profiling, templating, tree_utils
+
+
+def test_profiler_records_phases():
+    """Test that the profiler records each phase in order."""
+    with profiling.Profiler() as profiler:
+        with profiler.phase("first") as stats:
+            stats.bytes_read = 10
+        with profiler.phase("second"):
+            pass
+
+    assert [phase.name for phase in profiler.report.phases] == ["first", "second"]
+    assert profiler.report.phases[0].bytes_read == 10
+    assert all(phase.wall_time >= 0 for phase in profiler.report.phases)
+    assert all(phase.memory_peak is not None for phase in profiler.report.phases)
+
+
+def test_profiler_adds_file_bytes_to_phase():
+    """Test that bytes recorded for files are added to the enclosing phase."""
+    profiler = profiling.Profiler()
+    with profiler.phase("render"):
+        with profiler.file(Path("a.txt")) as stats:
+            stats.bytes_read = 3
+            stats.bytes_written = 4
+        with profiler.file(Path("b.txt")) as stats:
+            stats.bytes_read = 5
+
+    assert len(profiler.report.files) == 2
+    assert profiler.report.phases[0].bytes_read == 8
+    assert profiler.report.phases[0].bytes_written == 4
+
+
+def test_disabled_profiler_records_nothing():
+    """Test that a disabled profiler does not keep any stats."""
+    profiler = profiling.Profiler(enabled=False)
+    with profiler.phase("render"):
+        with profiler.file(Path("a.txt")) as stats:
+            stats.bytes_read = 3
+
+    assert profiler.report.phases == []
+    assert profiler.report.files == []
+
+
+def test_template_directory_records_files(template_dirs):
+    """Test that template_directory records each templated file."""
+    source, destination = template_dirs
+    tree_utils.copy_tree(source / "test-template-complete", destination)
+
+    profiler = profiling.Profiler()
+    templating.template_directory(
+        destination,
+        {
+            **templating.get_default_variables("test-project"),
+            "project_description": "Test project description",
+        },
+        profiler=profiler,
+    )
+
+    assert len(profiler.report.files) == 3
+    assert sum(f.bytes_written for f in profiler.report.files) > 0
+
+
+def test_template_directory_records_unchanged_files(tempdir):
+    """Test that files left unchanged by rendering are counted separately from
+    files written."""
+    _, source, _ = tempdir
+    (source / "static.txt").write_text("static\n")
+    (source / "dynamic.txt").write_text("{{ project_name }}\n")
+
+    profiler = profiling.Profiler()
+    with profiler.phase("render"):
+        templating.template_directory(
+            source,
+            templating.get_default_variables("test-project"),
+            profiler=profiler,
+        )
+
+    (phase,) = profiler.report.phases
+    assert (phase.files_written, phase.files_unchanged) == (1, 1)
+    assert phase.bytes_written == len("test-project\n")
+
+
+def test_render_template_records_phases(template_dirs):
+    """Test that render_template records every phase of the render."""
+    source, destination = template_dirs
+    profiler = profiling.Profiler()
+
+    templating.render_template(
+        project_name="test-project",
+        template="test-template-empty-files",
+        destination=destination / "test-project",
+        template_path=source / "test-template-empty-files",
+        prompt_if_duplicates=False,
+        profiler=profiler,
+    )
+
+    assert [phase.name for phase in profiler.report.phases] == [
+        "copy to temp",
+        "get_variables",
+        "render",
+        "find duplicates",
+        "copy to destination",
+        "post_script",
+        "cleanup",
+    ]
+
+
+def test_write_report(tempdir):
+    """Test that write_report writes a machine-readable report."""
+    tempdir, _, _ = tempdir
+    profiler = profiling.Profiler()
+    with profiler.phase("render"):
+        pass
+
+    path = tempdir / "report.json"
+    profiling.write_report(profiler.report, path)
+
+    report = json.loads(path.read_text())
+    assert report["phases"][0]["name"] == "render"
+    assert report["files"] == []
+
+
+def test_format_bytes():
+    """Test that byte counts are shown in the largest fitting unit."""
+    assert profiling.format_bytes(None) == "-"
+    assert profiling.format_bytes(512) == "512 B"
+    assert profiling.format_bytes(1536) == "1.5 KiB"
+    assert profiling.format_bytes(3 * 1024**3) == "3.0 GiB"
+
+
+def test_construct_table_from_report():
+    """Test that the construct_table_from_report function works as expected."""
+    profiler = profiling.Profiler()
+    with profiler.phase("render"):
+        with profiler.file(Path("a.txt")):
+            pass
+
+    table = profiling.construct_table_from_report(profiler.report)
+
+    assert table.row_count == 2
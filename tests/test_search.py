@@ -0,0 +1,149 @@
+import os
+
+from itmpl import config, global_vars, metadata, search, template_index, templating
+from itmpl.metadata import ItmplMetadata, ItmplToml
+
+
+def _postings(templates):
+    postings = {}
+    for name, toml in templates.items():
+        search.add_postings(postings, name, search.template_terms(name, toml))
+    return postings
+
+
+def test_template_terms():
+    """Test that terms are weighted by the field they appear in."""
+    toml = ItmplToml(
+        metadata=ItmplMetadata(
+            template_description="A FastAPI service",
+            template_requirements=["fastapi>=0.100"],
+        ),
+        variables={"python_version": "3.11"},
+    )
+
+    terms = search.template_terms("web-service", toml)
+
+    assert terms["web"] == search.NAME_WEIGHT
+    assert terms["service"] == search.NAME_WEIGHT
+    assert terms["fastapi"] == search.REQUIREMENT_WEIGHT
+    assert terms["python"] == search.VARIABLE_WEIGHT
+    assert terms["a"] == search.DESCRIPTION_WEIGHT
+
+
+def test_rank():
+    """Test that every query term must match, prefixes match, and names count
+    for more than descriptions."""
+    postings = _postings(
+        {
+            "django-site": ItmplToml(
+                metadata=ItmplMetadata(template_description="A Django website")
+            ),
+            "website": ItmplToml(
+                metadata=ItmplMetadata(template_description="Static site with Django")
+            ),
+            "cli": ItmplToml(metadata=ItmplMetadata(template_description="A CLI")),
+        }
+    )
+
+    assert [r.name for r in search.rank(postings, "django")] == [
+        "django-site",
+        "website",
+    ]
+    assert [r.name for r in search.rank(postings, "web")] == ["website", "django-site"]
+    assert [r.name for r in search.rank(postings, "django cli")] == []
+    assert search.rank(postings, "  ") == []
+
+
+def test_scan_root_incremental(tempdir, monkeypatch):
+    """Test that only changed .itmpl.toml files are read again, and the
+    inverted index follows changes and removals."""
+    _, source, _ = tempdir
+    for name in ["a", "b"]:
+        (source / name).mkdir()
+        (source / name / ".itmpl.toml").write_text(
+            f'[metadata]\ntemplate_description = "{name} alpha"\n'
+        )
+    previous = template_index.scan_root(source)
+
+    read = []
+    read_itmpl_toml = metadata.read_itmpl_toml
+    monkeypatch.setattr(
+        metadata,
+        "read_itmpl_toml",
+        lambda path: read.append(path.parent.name) or read_itmpl_toml(path),
+    )
+    toml_path = source / "a" / ".itmpl.toml"
+    mtime_ns = toml_path.stat().st_mtime_ns
+    toml_path.write_text('[metadata]\ntemplate_description = "a beta"\n')
+    os.utime(toml_path, ns=(mtime_ns, mtime_ns + 1_000_000))
+    index = template_index.scan_root(source, previous)
+
+    assert read == ["a"]
+    assert index.postings["alpha"] == {"b": search.DESCRIPTION_WEIGHT}
+    assert index.postings["beta"] == {"a": search.DESCRIPTION_WEIGHT}
+    assert previous.postings["alpha"] == {
+        "a": search.DESCRIPTION_WEIGHT,
+        "b": search.DESCRIPTION_WEIGHT,
+    }
+
+    for path in (source / "b").iterdir():
+        path.unlink()
+    (source / "b").rmdir()
+    index = template_index.scan_root(source, index)
+    assert "alpha" not in index.postings
+
+
+def test_search_templates(tempdir, monkeypatch):
+    """Test that shadowed templates aren't found."""
+    path, source, destination = tempdir
+    team = path / "team"
+    for root, description in [(source, "Old poetry"), (team, "New project")]:
+        (root / "poetry").mkdir(parents=True)
+        (root / "poetry" / ".itmpl.toml").write_text(
+            f'[metadata]\ntemplate_description = "{description}"\n'
+        )
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(extra_templates_dir=destination, template_dirs=[team]).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+
+    assert templating.search_templates("old") == []
+    ((result, template_path, toml),) = templating.search_templates("new")
+    assert result.name == "poetry"
+    assert template_path == team / "poetry"
+    assert toml.metadata.template_description == "New project"
+
+
+def test_search_templates_extends(tempdir, monkeypatch, write_template):
+    """Test that a template is found by the metadata it inherits, and follows
+    changes to the template it extends."""
+    path, source, destination = tempdir
+    team = path / "team"
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(extra_templates_dir=destination, template_dirs=[team]).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+    write_template(
+        source / "base",
+        {".itmpl.toml": '[metadata]\ntemplate_requirements = ["django"]\n'},
+    )
+    write_template(team / "child", {".itmpl.toml": '[metadata]\nextends = "base"\n'})
+
+    for _ in range(2):
+        results = templating.search_templates("django")
+        assert sorted(result.name for result, _, _ in results) == ["base", "child"]
+    child = next(toml for result, _, toml in results if result.name == "child")
+    assert child.metadata.template_requirements == ["django"]
+
+    toml_path = source / "base" / ".itmpl.toml"
+    mtime_ns = toml_path.stat().st_mtime_ns
+    toml_path.write_text('[metadata]\ntemplate_requirements = ["flask"]\n')
+    os.utime(toml_path, ns=(mtime_ns, mtime_ns + 1_000_000))
+
+    assert templating.search_templates("django") == []
+    results = templating.search_templates("flask")
+    assert sorted(result.name for result, _, _ in results) == ["base", "child"]
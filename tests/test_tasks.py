@@ -0,0 +1,99 @@
+import sys
+import threading
+
+import pytest
+
+from itmpl.tasks import TaskError, TaskGraph, TaskStatus
+
+
+def test_task_graph_runs_commands_and_functions(tempdir):
+    """Test that commands and functions are run, and their results returned."""
+    tempdir, _, _ = tempdir
+    graph = TaskGraph(cwd=tempdir, report=False)
+    graph.add(
+        "write",
+        [sys.executable, "-c", "open('out.txt', 'w').write('hello')"],
+    )
+    graph.add(
+        "read",
+        function=lambda: (tempdir / "out.txt").read_text(),
+        depends_on=["write"],
+    )
+
+    results = graph.run()
+
+    assert results["write"].status == TaskStatus.SUCCEEDED
+    assert results["write"].returncode == 0
+    assert results["read"].value == "hello"
+
+
+def test_task_graph_runs_independent_tasks_concurrently():
+    """Test that independent tasks run at the same time."""
+    barrier = threading.Barrier(2, timeout=5)
+    graph = TaskGraph(report=False)
+    graph.add("a", function=barrier.wait)
+    graph.add("b", function=barrier.wait)
+
+    results = graph.run()
+
+    assert all(r.status == TaskStatus.SUCCEEDED for r in results.values())
+
+
+def test_task_graph_respects_dependencies():
+    """Test that tasks only start once their dependencies have finished."""
+    order = []
+    graph = TaskGraph(report=False)
+    graph.add("c", function=lambda: order.append("c"), depends_on=["b"])
+    graph.add("b", function=lambda: order.append("b"), depends_on=["a"])
+    graph.add("a", function=lambda: order.append("a"))
+
+    graph.run()
+
+    assert order == ["a", "b", "c"]
+
+
+def test_task_graph_skips_dependents_of_failed_tasks():
+    """Test that a failure skips dependent tasks, but not independent ones."""
+    graph = TaskGraph(report=False)
+    graph.add("fail", [sys.executable, "-c", "raise SystemExit(3)"])
+    graph.add("dependent", function=lambda: None, depends_on=["fail"])
+    graph.add("independent", function=lambda: None)
+
+    with pytest.raises(TaskError) as e:
+        graph.run()
+
+    results = e.value.results
+    assert results["fail"].status == TaskStatus.FAILED
+    assert results["fail"].returncode == 3
+    assert results["dependent"].status == TaskStatus.SKIPPED
+    assert results["independent"].status == TaskStatus.SUCCEEDED
+
+
+def test_task_graph_function_exception():
+    """Test that an exception in a function task fails the task."""
+
+    def fail():
+        raise RuntimeError("boom")
+
+    graph = TaskGraph(report=False)
+    graph.add("fail", function=fail)
+
+    with pytest.raises(TaskError, match="boom"):
+        graph.run()
+
+
+def test_task_graph_invalid_graphs():
+    """Test that unknown dependencies and cycles are rejected."""
+    graph = TaskGraph(report=False)
+    graph.add("a", function=lambda: None, depends_on=["missing"])
+    with pytest.raises(ValueError, match="unknown task"):
+        graph.run()
+
+    graph = TaskGraph(report=False)
+    graph.add("a", function=lambda: None, depends_on=["b"])
+    graph.add("b", function=lambda: None, depends_on=["a"])
+    with pytest.raises(ValueError, match="cycle"):
+        graph.run()
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        graph.add("a", function=lambda: None)
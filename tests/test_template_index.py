@@ -0,0 +1,122 @@
+import os
+import time
+
+import pytest
+
+from itmpl import config, global_vars, template_index, templating
+
+
+def _age(path, seconds=60):
+    """Set a path's mtime into the past, so its index can be stored."""
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def add_template(write_template):
+    """Return a function that writes a template with a description, aged so
+    its root's index can be stored."""
+
+    def add(root, name, description):
+        toml = f'[metadata]\ntemplate_description = "{description}"\n'
+        write_template(root / name, {".itmpl.toml": toml})
+        _age(root / name / ".itmpl.toml")
+        _age(root)
+
+    return add
+
+
+def test_get_root_index_cached(tempdir, monkeypatch, add_template):
+    """Test that an unchanged root is read from the stored index."""
+    _, source, _ = tempdir
+    add_template(source, "a", "A")
+    index = template_index.get_root_index(source)
+    assert index.templates["a"].toml.metadata.template_description == "A"
+
+    def fail(root):
+        raise AssertionError("root was re-scanned")
+
+    monkeypatch.setattr(template_index, "scan_root", fail)
+    assert template_index.get_root_index(source) == index
+
+
+def test_get_root_index_rescanned_on_change(tempdir, add_template):
+    """Test that adding a template or changing a .itmpl.toml re-scans the
+    root."""
+    _, source, _ = tempdir
+    add_template(source, "a", "A")
+    template_index.get_root_index(source)
+
+    add_template(source, "a", "Changed")
+    os.utime(source / "a" / ".itmpl.toml")
+    index = template_index.get_root_index(source)
+    assert index.templates["a"].toml.metadata.template_description == "Changed"
+
+    (source / "b").mkdir()
+    assert set(template_index.get_root_index(source).templates) == {"a", "b"}
+
+
+def test_get_root_index_racy(tempdir, index_dir):
+    """Test that an index isn't stored while the root is still changing."""
+    _, source, _ = tempdir
+    (source / "a").mkdir()
+
+    template_index.get_root_index(source)
+
+    assert not list(index_dir.glob("*.json"))
+
+
+def test_get_template_options_precedence(tempdir, monkeypatch, add_template):
+    """Test that templates in template_dirs shadow later template roots, and
+    missing roots are skipped."""
+    path, source, destination = tempdir
+    team, personal = path / "team", path / "personal"
+    add_template(source, "shared", "Built-in")
+    add_template(destination, "extra", "Extra")
+    add_template(team, "shared", "Team")
+    add_template(team, "team-only", "Team only")
+    add_template(personal, "shared", "Personal")
+
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(
+            extra_templates_dir=destination,
+            template_dirs=[personal, team, path / "missing"],
+        ).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+
+    templates = templating.get_template_options()
+
+    assert {
+        name: toml.metadata.template_description
+        for name, (_, toml) in templates.items()
+    } == {
+        "shared": "Personal",
+        "team-only": "Team only",
+        "extra": "Extra",
+    }
+    assert templates["shared"][0] == personal / "shared"
+
+
+def test_iter_template_options(tempdir, monkeypatch, add_template):
+    """Test that templates are yielded in order of precedence, without
+    shadowed templates."""
+    path, source, destination = tempdir
+    team = path / "team"
+    add_template(source, "shared", "Built-in")
+    add_template(source, "builtin-only", "Built-in only")
+    add_template(team, "shared", "Team")
+
+    config_path = path / "config.json"
+    config_path.write_text(
+        config.Config(extra_templates_dir=destination, template_dirs=[team]).json(),
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+
+    assert [
+        (name, toml.metadata.template_description)
+        for name, _, toml in templating.iter_template_options()
+    ] == [("shared", "Team"), ("builtin-only", "Built-in only")]
@@ -1,9 +1,11 @@
+import os
 import shutil
 from pathlib import Path
 
 import pytest
+from typer.testing import CliRunner
 
-from itmpl import global_vars, templating, tree_utils
+from itmpl import global_vars, main, templating, tree_utils
 from itmpl.metadata import ItmplMetadata, ItmplToml
 
 
@@ -162,6 +164,31 @@ def test_get_template_options_with_duplicates(
     shutil.rmtree(temp_template_dir)
 
 
+@pytest.mark.parametrize("output_format", ["json", "table"])
+def test_list_with_duplicates(
+    monkeypatch,
+    mock_config_file,
+    template_dirs,
+    output_format,
+):
+    """Test that listing duplicate templates writes nothing to stdout, and the
+    error to stderr."""
+    source, _ = template_dirs
+    temp_template_dir = Path("/tmp/templates")
+    (temp_template_dir / "test-template-complete").mkdir(parents=True, exist_ok=True)
+    monkeypatch.setattr(global_vars, "TEMPLATES_DIR", source)
+
+    result = CliRunner(mix_stderr=False).invoke(
+        main.app,
+        ["list", "--format", output_format],
+    )
+
+    assert result.exit_code == 1
+    assert result.stdout == ""
+    assert "Duplicate templates found" in result.stderr
+    shutil.rmtree(temp_template_dir)
+
+
 def test_get_default_variables():
     """Test that the get_default_variables function works as expected."""
     variables = templating.get_default_variables(project_name="test-project")
@@ -361,3 +388,130 @@ def test_template_directory_with_exclude_glob(template_dirs):
     test_file_path = destination / "test-project.txt"
     assert template_file_path.exists()
     assert not test_file_path.exists()
+
+
+def test_render_template_only(template_dirs):
+    """Test that only the paths matching the only globs are rendered, names are
+    still templated, and nothing else in the destination is touched."""
+    source, destination = template_dirs
+    (destination / ".itmpl-keep").touch()
+
+    templating.render_template(
+        project_name="test-project",
+        template="test-template-complete",
+        destination=destination,
+        template_path=source / "test-template-complete",
+        prompt_if_duplicates=False,
+        only=["{{ project_title }}/test.txt"],
+    )
+
+    assert sorted(p.relative_to(destination) for p in destination.rglob("*")) == [
+        Path(".itmpl-keep"),
+        Path("Test Project"),
+        Path("Test Project/test.txt"),
+    ]
+
+
+def test_render_template_only_no_matches(template_dirs):
+    """Test that an error is raised if nothing matches the only globs."""
+    source, destination = template_dirs
+
+    with pytest.raises(templating.TemplatingException):
+        templating.render_template(
+            project_name="test-project",
+            template="test-template-complete",
+            destination=destination,
+            template_path=source / "test-template-complete",
+            only=["missing/**"],
+        )
+
+    assert not list(destination.iterdir())
+
+
+def test_render_template_only_undefined_variables(tempdir):
+    """Test that a partial render using variables only the post script defines
+    fails, listing them, rather than writing the placeholders."""
+    _, source, destination = tempdir
+    (source / ".itmpl.py").write_text(
+        "def post_script(project_name, destination, variables):\n"
+        "    return {'late': 'done', 'later': 'done'}\n"
+    )
+    (source / "sub").mkdir()
+    (source / "sub" / "a.txt").write_text("x={{ late }}\n")
+    (source / "sub" / "{{ later }}.txt").write_text("")
+    (source / "b.txt").write_text("{{ project_name }}\n")
+
+    with pytest.raises(templating.TemplatingException, match="late, later"):
+        templating.render_template(
+            project_name="test-project",
+            template="source",
+            destination=destination,
+            template_path=source,
+            prompt_if_duplicates=False,
+            only=["sub/**"],
+        )
+    assert not list(destination.iterdir())
+
+    templating.render_template(
+        project_name="test-project",
+        template="source",
+        destination=destination,
+        template_path=source,
+        prompt_if_duplicates=False,
+        only=["b.txt"],
+    )
+    assert (destination / "b.txt").read_text() == "test-project\n"
+
+
+def test_render_template_copy_excludes(tempdir):
+    """Test that paths excluded by copy_excludes or .itmplignore are never
+    copied into the destination."""
+    path, source, destination = tempdir
+    (source / ".itmpl.toml").write_text(
+        '[metadata]\ncopy_excludes = ["node_modules/"]\n'
+    )
+    (source / ".itmplignore").write_text("/.venv\n*.log\n!keep.log\n")
+    for relative in [
+        "README.md",
+        "keep.log",
+        "debug.log",
+        "node_modules/pkg/index.js",
+        "web/node_modules/pkg/index.js",
+        ".venv/bin/python",
+        "src/.venv",
+    ]:
+        (source / relative).parent.mkdir(parents=True, exist_ok=True)
+        (source / relative).write_text("{{ project_name }}\n")
+
+    templating.render_template(
+        project_name="test-project",
+        template="test-template",
+        destination=destination / "out",
+        template_path=source,
+    )
+
+    out = destination / "out"
+    assert sorted(
+        p.relative_to(out).as_posix() for p in out.rglob("*") if p.is_file()
+    ) == ["README.md", "keep.log", "src/.venv"]
+
+
+def test_template_directory_skips_unchanged_files(tempdir):
+    """Test that files whose rendered contents equal their source are not
+    rewritten, and only written files are counted."""
+    _, source, _ = tempdir
+    (source / "static.txt").write_text("No templating here\n")
+    (source / "dynamic.txt").write_text("{{ project_name }}\n")
+    (source / "{{ project_name }}.txt").write_text("static\n")
+    for path in source.iterdir():
+        os.utime(path, ns=(0, 0))
+
+    written = templating.template_directory(
+        source, templating.get_default_variables("test-project")
+    )
+
+    assert written == 1
+    assert (source / "static.txt").stat().st_mtime_ns == 0
+    assert (source / "test-project.txt").stat().st_mtime_ns == 0
+    assert (source / "dynamic.txt").read_text() == "test-project\n"
+    assert (source / "dynamic.txt").stat().st_mtime_ns != 0
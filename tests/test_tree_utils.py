@@ -1,3 +1,9 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
 from itmpl import tree_utils
 
 
@@ -210,3 +216,155 @@ def test_recursive_delete_in_subdirectories(tempdir):
 
     assert sorted(source.iterdir()) == [source / "c.json", source / "subdir"]
     assert sorted((source / "subdir").iterdir()) == [source / "subdir" / "c.json"]
+
+
+def test_copy_tree_with_ignore_in_subdirectory(tempdir):
+    """Test that the ignore function applies to nested directories too."""
+    tempdir, source, destination = tempdir
+    (source / "subdir").mkdir()
+    (source / "subdir" / "a.txt").touch()
+    (source / "subdir" / "b.txt").touch()
+
+    tree_utils.copy_tree(source, destination, ignore=lambda p: p.name == "b.txt")
+
+    assert sorted((destination / "subdir").iterdir()) == [
+        destination / "subdir" / "a.txt",
+    ]
+
+
+def test_copy_matching(tempdir):
+    """Test that only matching files and directories are copied, keeping their
+    relative paths."""
+    tempdir, source, destination = tempdir
+    (source / "a.txt").write_text("a")
+    (source / "b.py").write_text("b")
+    (source / "tests" / "unit").mkdir(parents=True)
+    (source / "tests" / "unit" / "test_a.py").write_text("test")
+    (source / "docs").mkdir()
+    (source / "docs" / "index.md").write_text("docs")
+
+    copied = tree_utils.copy_matching(source, destination, ["*.txt", "tests"])
+
+    assert copied == 5
+    assert sorted(p.relative_to(destination) for p in destination.rglob("*")) == [
+        Path("a.txt"),
+        Path("tests"),
+        Path("tests/unit"),
+        Path("tests/unit/test_a.py"),
+    ]
+
+
+def test_copy_matching_nested_once(tempdir, monkeypatch):
+    """Test that files under a recursive pattern are copied once each, not
+    again for every matching directory above them."""
+    tempdir, source, destination = tempdir
+    nested = source / "tests" / "a" / "b" / "c" / "d"
+    nested.mkdir(parents=True)
+    for name in ["one", "two", "three", "four"]:
+        (nested / name).write_text("x" * 100)
+    copies = []
+    copy2 = shutil.copy2
+    monkeypatch.setattr(
+        shutil, "copy2", lambda src, dst: copies.append(src) or copy2(src, dst)
+    )
+
+    copied = tree_utils.copy_matching(source, destination, ["tests/**", "tests/a/**/*"])
+
+    assert copied == 400
+    assert sorted(copies) == sorted(nested.iterdir())
+    assert sorted(
+        p.name for p in (destination / nested.relative_to(source)).iterdir()
+    ) == [
+        "four",
+        "one",
+        "three",
+        "two",
+    ]
+
+
+def test_copy_overlay(tempdir):
+    """Test that later sources override earlier ones, file by file."""
+    tempdir, source, destination = tempdir
+    base, child = source / "base", source / "child"
+    (base / "subdir").mkdir(parents=True)
+    (child / "subdir").mkdir(parents=True)
+    (base / "a.txt").write_text("base")
+    (base / "subdir" / "b.txt").write_text("base")
+    (child / "subdir" / "b.txt").write_text("child")
+    (child / "c.txt").write_text("child")
+
+    copied = tree_utils.copy_overlay([base, child], destination)
+
+    assert copied == 14
+    assert (destination / "a.txt").read_text() == "base"
+    assert (destination / "subdir" / "b.txt").read_text() == "child"
+    assert (destination / "c.txt").read_text() == "child"
+
+
+def _make_symlinked_tree(tempdir, source):
+    """Create a tree with a link inside the tree, and a link to a directory
+    outside it."""
+    shared = tempdir / "shared"
+    shared.mkdir()
+    (shared / "asset.bin").write_bytes(b"x" * 100)
+    (source / "a.txt").write_text("a")
+    (source / "link.txt").symlink_to("a.txt")
+    (source / "assets").symlink_to(os.path.relpath(shared, source))
+    return shared
+
+
+def test_copy_tree_symlinks_copy(tempdir):
+    """Test that by default symlink targets are copied."""
+    tempdir, source, destination = tempdir
+    _make_symlinked_tree(tempdir, source)
+
+    copied = tree_utils.copy_tree(source, destination)
+
+    assert copied == 102
+    assert not (destination / "assets").is_symlink()
+    assert (destination / "assets" / "asset.bin").read_bytes() == b"x" * 100
+
+
+def test_copy_tree_symlinks_preserve(tempdir):
+    """Test that symlinks are recreated, with links out of the tree made
+    absolute."""
+    tempdir, source, destination = tempdir
+    shared = _make_symlinked_tree(tempdir, source)
+
+    copied = tree_utils.copy_tree(
+        source,
+        destination,
+        symlinks=tree_utils.SymlinkPolicy.PRESERVE,
+    )
+
+    assert copied == 1
+    assert os.readlink(destination / "link.txt") == "a.txt"
+    assert os.readlink(destination / "assets") == str(shared.resolve())
+
+
+def test_copy_tree_symlinks_skip(tempdir):
+    """Test that symlinks can be left out."""
+    tempdir, source, destination = tempdir
+    _make_symlinked_tree(tempdir, source)
+
+    tree_utils.copy_tree(source, destination, symlinks=tree_utils.SymlinkPolicy.SKIP)
+
+    assert sorted(destination.iterdir()) == [destination / "a.txt"]
+
+
+def test_copy_tree_symlink_loop(tempdir):
+    """Test that following a symlink loop raises an error instead of recursing
+    forever."""
+    tempdir, source, destination = tempdir
+    (source / "subdir").mkdir()
+    (source / "subdir" / "loop").symlink_to("..")
+
+    with pytest.raises(tree_utils.SymlinkLoopError):
+        tree_utils.copy_tree(source, destination)
+
+    tree_utils.copy_tree(
+        source,
+        destination,
+        symlinks=tree_utils.SymlinkPolicy.PRESERVE,
+    )
+    assert os.readlink(destination / "subdir" / "loop") == ".."
@@ -1,3 +1,4 @@
+import io
 from pathlib import Path
 
 import pytest
@@ -56,3 +57,223 @@ def test_construct_table_from_templates():
 
     assert table is not None
     assert table.row_count == 2
+
+
+def test_is_requirement_satisfied_installed():
+    """Test that installed requirements are satisfied."""
+    assert utils.is_requirement_satisfied("pydantic")
+    assert utils.is_requirement_satisfied("Jinja2 >= 1.0")
+    assert utils.is_requirement_satisfied("jinja2[i18n]>=1.0")
+
+
+def test_is_requirement_satisfied_not_installed():
+    """Test that missing or out of range requirements are not satisfied."""
+    assert not utils.is_requirement_satisfied("not-a-real-package-itmpl")
+    assert not utils.is_requirement_satisfied("pydantic<0.1")
+    assert not utils.is_requirement_satisfied("https://example.com/a.whl")
+
+
+def test_is_requirement_satisfied_marker():
+    """Test that requirements for other platforms are satisfied."""
+    assert utils.is_requirement_satisfied(
+        'not-a-real-package-itmpl; python_version < "3"'
+    )
+
+
+def test_is_requirement_satisfied_complex():
+    """Test that extras, URLs and multiple specifiers are parsed properly."""
+    assert utils.is_requirement_satisfied("jinja2 [i18n, extra] >=1.0, !=0.5")
+    assert not utils.is_requirement_satisfied("jinja2>=1.0,<1.1")
+    assert not utils.is_requirement_satisfied("jinja2 @ https://example.com/j.whl")
+    assert not utils.is_requirement_satisfied(
+        'not-a-real-package-itmpl; python_version >= "3"'
+    )
+
+
+def test_is_requirement_satisfied_invalid(capsys):
+    """Test that lines that can't be parsed are treated as needing
+    installing, with a warning, rather than crashing."""
+    assert not utils.is_requirement_satisfied("pydantic >= ; bad")
+    assert not utils.is_requirement_satisfied("pydantic; os_name ==")
+    assert utils.check_requirements(["pydantic", "jinja2 >=>= 1"]) == {
+        "pydantic": True,
+        "jinja2 >=>= 1": False,
+    }
+
+    assert "Can't parse requirement" in capsys.readouterr().out
+
+
+def test_deduplicate_requirements():
+    """Test that requirements are de-duplicated by normalised name and
+    specifier."""
+    requirements = utils.deduplicate_requirements(
+        ["poetry", "PyYAML", "pyyaml", "py_yaml", "poetry >= 1.2", "poetry>=1.2"],
+    )
+
+    assert requirements == ["poetry", "PyYAML", "py_yaml", "poetry >= 1.2"]
+
+
+def test_check_requirements():
+    """Test that check_requirements reports every requirement given."""
+    satisfied = utils.check_requirements(
+        ["pydantic", "Pydantic", "not-a-real-package-itmpl"],
+    )
+
+    assert satisfied == {
+        "pydantic": True,
+        "Pydantic": True,
+        "not-a-real-package-itmpl": False,
+    }
+
+
+def test_construct_dependency_table():
+    """Test that the construct_dependency_table function works as expected."""
+    table = utils.construct_dependency_table(
+        [("template1", ["a", "b"]), ("template2", ["b"])],
+        {"a": True, "b": False},
+    )
+
+    assert table.row_count == 2
+
+
+def test_wheelhouse_pip_args():
+    """Test that installing from a wheelhouse disables the package index."""
+    assert utils.wheelhouse_pip_args(None) == []
+    assert utils.wheelhouse_pip_args(Path("wheels")) == [
+        "--no-index",
+        "--find-links",
+        "wheels",
+    ]
+
+
+def test_pin_to_wheelhouse(tempdir):
+    """Test that requirements are pinned to the newest matching wheel in the
+    wheelhouse, and left alone when nothing matches."""
+    path, _, _ = tempdir
+    for wheel in (
+        "black-23.1.0-py3-none-any.whl",
+        "black-22.12.0-py3-none-any.whl",
+        "pre_commit-3.0.4-py2.py3-none-any.whl",
+        "not-a-wheel.whl",
+    ):
+        (path / wheel).touch()
+
+    assert utils.pin_to_wheelhouse(
+        [
+            "black",
+            "black<23",
+            "pre-commit",
+            "ruff",
+            "black>=24",
+            "black; python_version < '3.0'",
+            "Black [d, colorama] >= 22, < 23",
+            "black @ https://example.com/black.whl",
+        ],
+        path,
+    ) == [
+        "black==23.1.0",
+        "black==22.12.0",
+        "pre-commit==3.0.4",
+        "ruff",
+        "black>=24",
+        "black; python_version < '3.0'",
+        "Black[colorama,d]==22.12.0",
+        "black @ https://example.com/black.whl",
+    ]
+
+
+def test_read_template_requirements_files(tempdir):
+    """Test that requirements are read from every .itmpl.requirements*.txt
+    file."""
+    _, source, _ = tempdir
+    (source / ".itmpl.requirements.txt").write_text("poetry\n\n# comment\n")
+    (source / ".itmpl.requirements.dev.txt").write_text("pytest  # tests\nblack\n")
+    (source / "requirements.txt").write_text("ignored\n")
+
+    requirements = utils.read_template_requirements_files(source)
+
+    assert requirements == ["pytest", "black", "poetry"]
+
+
+def test_get_virtualenv_package_versions(tempdir):
+    """Test that package versions are read from dist-info metadata."""
+    _, source, _ = tempdir
+    site_packages = source / "lib" / "python3.11" / "site-packages"
+    for name, version in [("black", "23.1.0"), ("typing_extensions", "4.5.0")]:
+        dist_info = site_packages / f"{name}-{version}.dist-info"
+        dist_info.mkdir(parents=True)
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        )
+
+    versions = utils.get_virtualenv_package_versions(
+        source,
+        ["black", "typing-extensions", "isort"],
+    )
+
+    assert versions == {"black": "23.1.0", "typing-extensions": "4.5.0"}
+
+
+def test_parse_template_filter():
+    assert utils.parse_template_filter("name=poetry-*") == ("name", "poetry-*")
+    assert utils.parse_template_filter("Requirements=django") == (
+        "requirements",
+        "django",
+    )
+    assert utils.parse_template_filter("api") == (None, "*api*")
+    with pytest.raises(ValueError):
+        utils.parse_template_filter("size=big")
+
+
+def test_template_matches():
+    toml = ItmplToml(
+        metadata=ItmplMetadata(
+            template_description="A REST API",
+            template_requirements=["fastapi", "uvicorn"],
+        )
+    )
+
+    assert utils.template_matches("web", toml, [("name", "w*")])
+    assert utils.template_matches("web", toml, [("requirements", "uvi*")])
+    assert utils.template_matches("web", toml, [(None, "*rest*")])
+    assert not utils.template_matches(
+        "web", toml, [("name", "w*"), ("description", "cli*")]
+    )
+
+
+@pytest.mark.parametrize(
+    "output_format, expected",
+    [
+        (
+            utils.ListFormat.JSON,
+            '[\n  {"name": "a", "path": "a", "description": "First", '
+            '"requirements": []},\n'
+            '  {"name": "b", "path": "b", "description": null, '
+            '"requirements": ["x"]}\n]\n',
+        ),
+        (
+            utils.ListFormat.JSONL,
+            '{"name": "a", "path": "a", "description": "First", "requirements": []}\n'
+            '{"name": "b", "path": "b", "description": null, "requirements": ["x"]}\n',
+        ),
+        (utils.ListFormat.PLAIN, "a\tFirst\nb\t\n"),
+    ],
+)
+def test_write_templates(output_format, expected):
+    stream = io.StringIO()
+    templates = [
+        (
+            "a",
+            Path("a"),
+            ItmplToml(metadata=ItmplMetadata(template_description="First")),
+        ),
+        (
+            "b",
+            Path("b"),
+            ItmplToml(metadata=ItmplMetadata(template_requirements=["x"])),
+        ),
+    ]
+
+    utils.write_templates(templates, output_format, stream)
+
+    assert stream.getvalue() == expected
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+
+import pytest
+
+from itmpl import virtualenvs
+
+
+@pytest.fixture
+def golden_virtualenvs_dir(monkeypatch, tempdir):
+    tempdir, _, _ = tempdir
+    path = tempdir / "virtualenvs"
+    monkeypatch.setattr(virtualenvs, "GOLDEN_VIRTUALENVS_DIR", path)
+    yield path
+
+
+def _fake_create_virtualenv(path, requirements, wheelhouse=None):
+    (path / "bin").mkdir(parents=True)
+    (path / "lib").mkdir()
+    (path / "pyvenv.cfg").write_text(f"command = python -m venv {path}\n")
+    (path / "bin" / "pip").write_text(f"#!{path}/bin/python\n")
+    (path / "bin" / "python").symlink_to(sys.executable)
+    (path / "lib" / "module.py").write_text("\n".join(requirements))
+
+
+def test_requirements_key_ignores_order_and_duplicates():
+    """Test that equivalent sets of requirements have the same key."""
+    assert virtualenvs.requirements_key(["a", "b"]) == virtualenvs.requirements_key(
+        ["b", "a", "a"],
+    )
+    assert virtualenvs.requirements_key(["a"]) != virtualenvs.requirements_key(["b"])
+
+
+def test_requirements_key_expires_unpinned(monkeypatch):
+    """Test that the key for unpinned requirements changes once they are old
+    enough to have new releases, and the key for pinned requirements
+    doesn't."""
+    unpinned = virtualenvs.requirements_key(["a", "b==1.0"])
+    pinned = virtualenvs.requirements_key(["a==2.0", "b==1.0"])
+
+    later = time.time() + virtualenvs.GOLDEN_VIRTUALENV_MAX_AGE
+    monkeypatch.setattr(virtualenvs.time, "time", lambda: later)
+
+    assert virtualenvs.requirements_key(["a", "b==1.0"]) != unpinned
+    assert virtualenvs.requirements_key(["a==2.0", "b==1.0"]) == pinned
+
+
+def test_get_golden_virtualenv_pins_to_wheelhouse(
+    monkeypatch, golden_virtualenvs_dir, tempdir
+):
+    """Test that requirements are pinned to the wheelhouse, so a newer wheel
+    gives a new golden virtualenv."""
+    path, _, _ = tempdir
+    wheelhouse = path / "wheels"
+    wheelhouse.mkdir()
+    (wheelhouse / "black-22.12.0-py3-none-any.whl").touch()
+    monkeypatch.setattr(virtualenvs, "create_virtualenv", _fake_create_virtualenv)
+
+    first = virtualenvs.get_golden_virtualenv("template", ["black"], wheelhouse)
+    assert (first / "lib" / "module.py").read_text() == "black==22.12.0"
+
+    (wheelhouse / "black-23.1.0-py3-none-any.whl").touch()
+    second = virtualenvs.get_golden_virtualenv("template", ["black"], wheelhouse)
+    assert second != first
+    assert (second / "lib" / "module.py").read_text() == "black==23.1.0"
+
+
+def test_get_golden_virtualenv_builds_once(monkeypatch, golden_virtualenvs_dir):
+    """Test that a golden virtualenv is only built the first time it is
+    requested."""
+    calls = []
+
+    def create(path, requirements, wheelhouse=None):
+        calls.append(path)
+        _fake_create_virtualenv(path, requirements)
+
+    monkeypatch.setattr(virtualenvs, "create_virtualenv", create)
+
+    first = virtualenvs.get_golden_virtualenv("template", ["a", "b"])
+    second = virtualenvs.get_golden_virtualenv("template", ["b", "a"])
+
+    assert first == second
+    assert first.parent == golden_virtualenvs_dir / "template"
+    assert len(calls) == 1
+    assert (first / virtualenvs.COMPLETE_MARKER).exists()
+    assert sorted(p.name for p in first.parent.iterdir()) == [first.name]
+
+
+def test_get_golden_virtualenv_failed_build(monkeypatch, golden_virtualenvs_dir):
+    """Test that a failed build does not leave a golden virtualenv behind."""
+
+    def create(path, requirements, wheelhouse=None):
+        raise OSError("build failed")
+
+    monkeypatch.setattr(virtualenvs, "create_virtualenv", create)
+
+    with pytest.raises(OSError):
+        virtualenvs.get_golden_virtualenv("template", ["a"])
+
+    assert list((golden_virtualenvs_dir / "template").iterdir()) == []
+
+
+def test_clone_virtualenv(monkeypatch, golden_virtualenvs_dir, tempdir):
+    """Test that a cloned virtualenv shares data with the golden virtualenv and
+    points at its new location."""
+    _, _, destination = tempdir
+    monkeypatch.setattr(virtualenvs, "create_virtualenv", _fake_create_virtualenv)
+    golden = virtualenvs.get_golden_virtualenv("template", ["a"])
+    built_at = (golden / virtualenvs.COMPLETE_MARKER).read_text()
+
+    venv = destination / ".venv"
+    virtualenvs.clone_virtualenv(golden, venv)
+
+    assert not (venv / virtualenvs.COMPLETE_MARKER).exists()
+    assert (venv / "lib" / "module.py").read_text() == "a"
+    assert (venv / "bin" / "python").is_symlink()
+    assert (venv / "bin" / "pip").read_text() == f"#!{venv.resolve()}/bin/python\n"
+    assert str(venv.resolve()) in (venv / "pyvenv.cfg").read_text()
+
+    # The golden virtualenv is untouched
+    assert (golden / "bin" / "pip").read_text() == f"#!{built_at}/bin/python\n"
+
+
+def test_clone_virtualenv_hardlinks(monkeypatch, golden_virtualenvs_dir, tempdir):
+    """Test that files are copied when reflinks are unavailable, unless
+    hardlinks are enabled."""
+    _, _, destination = tempdir
+    monkeypatch.setattr(virtualenvs, "create_virtualenv", _fake_create_virtualenv)
+    monkeypatch.setattr(virtualenvs, "_reflink", lambda source, destination: False)
+    golden = virtualenvs.get_golden_virtualenv("template", ["a"])
+
+    virtualenvs.clone_virtualenv(golden, destination / "linked", hardlink=True)
+    virtualenvs.clone_virtualenv(golden, destination / "copied")
+
+    module = golden / "lib" / "module.py"
+    assert os.path.samefile(module, destination / "linked" / "lib" / "module.py")
+    assert not os.path.samefile(
+        module,
+        destination / "copied" / "lib" / "module.py",
+    )
+    # Rewritten files are never shared
+    assert not os.path.samefile(
+        golden / "bin" / "pip", destination / "linked" / "bin" / "pip"
+    )
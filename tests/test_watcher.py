@@ -0,0 +1,104 @@
+import os
+
+from itmpl import watcher
+
+
+def _touch(path, contents):
+    """Write a file, making sure its mtime differs from before."""
+    stat = path.stat() if path.exists() else None
+    path.write_text(contents)
+    if stat is not None:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+TEMPLATE = {
+    "{{ project_name }}/__init__.py": "# {{ project_title }}\n",
+    "README.md": "# {{ project_title }}\n",
+    "static.txt": "static\n",
+    ".itmpl.toml": '[variables]\ngreeting = "Hello"\n',
+}
+
+
+def test_diff_snapshots(tempdir):
+    """Test that added, modified and removed files are detected."""
+    _, source, _ = tempdir
+    (source / "a.txt").write_text("a")
+    (source / "b.txt").write_text("b")
+    before = watcher.snapshot_tree(source)
+
+    _touch(source / "a.txt", "aa")
+    (source / "b.txt").unlink()
+    (source / "c.txt").write_text("c")
+    after = watcher.snapshot_tree(source)
+
+    assert watcher.diff_snapshots(before, after) == ({"a.txt", "c.txt"}, {"b.txt"})
+
+
+def test_render(tempdir, write_template):
+    """Test that the whole template is rendered, without .itmpl files."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE)
+
+    renderer = watcher.DevRenderer("test-project", source, destination / "out")
+    assert renderer.render() == 3
+
+    out = destination / "out"
+    assert (out / "test-project" / "__init__.py").read_text() == "# Test Project\n"
+    assert (out / "README.md").read_text() == "# Test Project\n"
+    assert not (out / ".itmpl.toml").exists()
+
+
+def test_poll_renders_only_changed_files(tempdir, write_template):
+    """Test that only changed files are rendered again, and removed files are
+    removed from the output."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE)
+    out = destination / "out"
+    renderer = watcher.DevRenderer("test-project", source, out)
+    renderer.render()
+    assert renderer.poll() is None
+
+    _touch(source / "README.md", "# {{ greeting }} {{ project_title }}\n")
+    (source / "static.txt").unlink()
+    count, _ = renderer.poll()
+
+    assert count == 1
+    assert (out / "README.md").read_text() == "# Hello Test Project\n"
+    assert not (out / "static.txt").exists()
+
+
+def test_poll_variables_changed(tempdir, write_template):
+    """Test that changing .itmpl.toml renders every file again."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE)
+    (source / "README.md").write_text("{{ greeting }}\n")
+    out = destination / "out"
+    renderer = watcher.DevRenderer("test-project", source, out)
+    renderer.render()
+
+    _touch(source / ".itmpl.toml", '[variables]\ngreeting = "Goodbye"\n')
+    count, _ = renderer.poll()
+
+    assert count == 3
+    assert (out / "README.md").read_text() == "Goodbye\n"
+
+
+def test_poll_ignore_file_changed(tempdir, write_template):
+    """Test that files excluded by .itmplignore aren't rendered, and changing
+    the ignore file updates the output."""
+    _, source, destination = tempdir
+    write_template(source, TEMPLATE)
+    (source / "build").mkdir()
+    (source / "build" / "out.txt").write_text("built\n")
+    (source / ".itmplignore").write_text("build/\n")
+
+    renderer = watcher.DevRenderer("test-project", source, destination / "out")
+    renderer.render()
+    assert "build/out.txt" not in renderer.snapshot
+    assert not (destination / "out" / "build").exists()
+
+    _touch(source / ".itmplignore", "static.txt\n")
+    renderer.poll()
+
+    assert (destination / "out" / "build" / "out.txt").exists()
+    assert not (destination / "out" / "static.txt").exists()